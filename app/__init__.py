@@ -4,19 +4,18 @@ This defines the application module that essentially creates a new flask app obj
 """
 import logging
 import os
-from datetime import datetime
 
 import jinja2
 from flask import Flask, g
 from flask_login import LoginManager, current_user
-from flask_sqlalchemy import SQLAlchemy
 from flask_mail import Mail
 from config import config
+from app.database import RoutingSQLAlchemy
 
 # initialize objects of flask extensions that will be used and then initialize the application
 # once the flask object has been created and initialized. 1 caveat for this is that when
 # configuring Celery, the broker will remain constant for all configurations
-db = SQLAlchemy()
+db = RoutingSQLAlchemy()
 login_manager = LoginManager()
 login_manager.session_protection = "strong"
 login_manager.login_view = "auth.login"
@@ -77,8 +76,30 @@ def create_app(config_name):
     db.init_app(app)
     login_manager.init_app(app)
 
+    from app.mod_auth.token_cache import token_cache
+    from app.mod_auth.hashing import password_hasher
+    token_cache.init_app(app)
+    password_hasher.init_app(app)
+
     error_handlers(app)
     register_app_blueprints(app)
+
+    from app.search import search
+    from app.cache import response_cache
+    from app.telemetry.queries import query_counter
+    from app.telemetry.metrics import metrics
+    from app.telemetry.profiler import profiler
+    from app.outbox import outbox
+    from app.encoding import negotiation
+    from app.ratelimit import rate_limiter
+    search.init_app(app)
+    response_cache.init_app(app)
+    outbox.init_app(app)
+    query_counter.init_app(app)
+    metrics.init_app(app)
+    profiler.init_app(app)
+    negotiation.init_app(app)
+    rate_limiter.init_app(app)
     app_request_handlers(app, db)
     app_logger_handler(app, config_name)
 
@@ -99,62 +120,49 @@ def app_request_handlers(app, db_):
     :param app: the current flask app
     """
 
+    from app.mod_auth.last_seen import last_seen
+    last_seen.init_app(app)
+
     @app.before_request
     def before_request():
         """
-        Before submitting the request, change the currently logged in user 'last seen' status to now
-        this will update the database last_seen column and every time the user makes a request (refreshes the
-        page), the last seen will be updated. this is called before any request is ma
+        Before submitting the request, record that the currently logged in user was last seen now.
+        The tracker coalesces these updates and writes them in bulk in the background, so a request
+        does not pay for a write transaction just to update the last_seen column
         """
         g.user = current_user
         if current_user.is_authenticated:
-            current_user.last_seen = datetime.now()
-            db.session.add(g.user)
-            db_.session.add(current_user)
-            db_.session.commit()
+            last_seen.touch(current_user.id)
 
 
 def app_logger_handler(app, config_name):
     """
     Will handle error logging for the application and will store the app log files in a file that can 
-    later be accessed.
+    later be accessed. File, syslog and email handlers run behind the log pipeline, so logging an
+    error never waits on disk or on the mail server
     :param app: current flask application
     """
-    from logging.handlers import SMTPHandler, RotatingFileHandler
-    mail_server = app.config.get("MAIL_SERVER")
+    from logging.handlers import RotatingFileHandler
+    from app.telemetry.logs import log_pipeline
 
     if app.debug:
         logging.basicConfig(level=logging.DEBUG)
     else:
         logging.basicConfig(level=logging.INFO)
+    file_handler = None
     if config_name == "production":
-        if not app.debug and mail_server != "":
-            credentials = None
-
-            mail_username = app.config.get("MAIL_USERNAME")
-            mail_password = app.config.get("MAIL_PASSWORD")
-
-            if mail_username or mail_password:
-                credentials = (mail_username, mail_password)
-
-            mail_handler = SMTPHandler(mailhost=(mail_server, app.config.get("MAIL_HOST")),
-                                       fromaddr="no-reply@" + mail_server,
-                                       toaddrs=app.config.get("ADMINS"),
-                                       subject="App failure",
-                                       credentials=credentials)
-            mail_handler.setLevel(logging.ERROR)
-            app.logger.addHandler(mail_handler)
-
+        # errors are emailed to the administrators by the handler of the production configuration
         if not app.debug and os.environ.get("HEROKU") is None:
-            # log file will be saved in the tmp directory
+            # log file will be saved in the tmp directory, one JSON record per line
             file_handler = RotatingFileHandler(filename="tmp/app.log", mode="a", maxBytes=1 * 1024 * 1024,
                                                backupCount=10)
-            file_handler.setFormatter(logging.Formatter('%(asctime)s %(levelname)s: %(message)s [in %(pathname)s:%('
-                                                        'lineno)d]'))
             app.logger.setLevel(logging.INFO)
             file_handler.setLevel(logging.INFO)
-            app.logger.addHandler(file_handler)
-            app.logger.info("App")
+            log_pipeline.add_handler(app, file_handler)
+
+    log_pipeline.init_app(app)
+    if file_handler is not None:
+        app.logger.info("App")
 
 
 def error_handlers(app):
@@ -0,0 +1,184 @@
+"""
+Per user response cache for the list reads.
+A cached response is keyed on the user, the endpoint with its arguments and the user's current
+version. Every successful write a user makes bumps their version, which makes all of their
+cached responses unreachable at once without having to find them, while other users keep their
+cache. RESPONSE_CACHE_BACKEND picks memory, an LRU in each process, or redis, which is shared by
+all processes. Leaving it empty turns the cache off. Responses read from a replica are not stored,
+the replica may not have the write that moved the user to their current version yet
+"""
+import hashlib
+import threading
+from functools import wraps
+
+from flask import current_app, request
+from sqlalchemy import inspect
+
+from app.database import RoutingSQLAlchemy
+from app.mod_auth.authentication import authenticated_user
+from .backends import MemoryBackend, RedisBackend
+
+# headers of a cached response that are sent again with it
+CACHED_HEADERS = ("Content-Type", "ETag")
+WRITE_METHODS = ("POST", "PUT", "PATCH", "DELETE")
+
+
+class _CacheState(object):
+    """
+    Per application state of the response cache
+    """
+
+    def __init__(self, backend, ttl):
+        self.backend = backend
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.invalidations = 0
+
+    def count(self, counter):
+        with self.lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+
+class ResponseCache(object):
+    """
+    Response cache extension
+    """
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """
+        Creates the cache backend of the given application
+        :param app: current flask app
+        """
+        app.config.setdefault("RESPONSE_CACHE_BACKEND", "memory")
+        app.config.setdefault("RESPONSE_CACHE_SIZE", 1024)
+        app.config.setdefault("RESPONSE_CACHE_TTL", 60)
+        app.config.setdefault("RESPONSE_CACHE_REDIS_URL", "redis://localhost:6379/0")
+
+        name = app.config["RESPONSE_CACHE_BACKEND"]
+        if not name:
+            backend = None
+        elif name == "memory":
+            backend = MemoryBackend(app.config["RESPONSE_CACHE_SIZE"])
+        elif name == "redis":
+            backend = RedisBackend(app.config["RESPONSE_CACHE_REDIS_URL"])
+        else:
+            raise ValueError("No response cache backend named {}".format(name))
+        app.extensions["response_cache"] = _CacheState(backend, app.config["RESPONSE_CACHE_TTL"])
+
+    @staticmethod
+    def _state():
+        return current_app.extensions["response_cache"]
+
+    @staticmethod
+    def _key(user_id, version):
+        args = sorted(request.args.items(multi=True))
+        digest = hashlib.sha1(repr((request.endpoint, sorted(request.view_args.items()), args))
+                              .encode("utf-8")).hexdigest()
+        return "{}:{}:{}".format(user_id, version, digest)
+
+    def cached(self, f):
+        """
+        Caches the successful GET responses of a view for the authenticated user. Must be applied
+        below the authentication decorators
+        :param f: view function
+        """
+        @wraps(f)
+        def decorated(*args, **kwargs):
+            state = self._state()
+            if state.backend is None or request.method != "GET":
+                return f(*args, **kwargs)
+
+            user_id = authenticated_user().id
+            key = self._key(user_id, state.backend.version(user_id))
+            entry = state.backend.get(key)
+
+            if entry is not None:
+                state.count("hits")
+                return self._replay(entry)
+
+            state.count("misses")
+            response = current_app.make_response(f(*args, **kwargs))
+            # a lagging replica would store the rows from before the write under the version the
+            # write moved to, for every session of the user, only reads of the primary are stored
+            if response.status_code == 200 and not response.is_streamed and RoutingSQLAlchemy.replica() is None:
+                state.backend.set(key, dict(
+                    status=response.status_code, body=response.get_data(),
+                    headers=[(name, response.headers[name]) for name in CACHED_HEADERS
+                             if name in response.headers]), state.ttl)
+                state.count("stores")
+            response.headers["X-Cache"] = "MISS"
+            return response
+        return decorated
+
+    @staticmethod
+    def _replay(entry):
+        """
+        Rebuilds a cached response, or a 304 if the client already has it
+        """
+        response = current_app.response_class(entry["body"], status=entry["status"])
+        for name, value in entry["headers"]:
+            response.headers[name] = value
+        if ResponseCache._is_fresh(response):
+            response = current_app.response_class(status=304, headers=[
+                (name, value) for name, value in entry["headers"] if name != "Content-Type"])
+        response.headers["X-Cache"] = "HIT"
+        return response
+
+    @staticmethod
+    def _is_fresh(response):
+        """
+        Checks the conditional headers of the request against a cached response, the same way
+        the views check them. The cached responses are collections, which are only validated by
+        their ETag, a delete does not move the time of their latest change forward
+        """
+        etag = response.get_etag()[0]
+        if request.if_none_match:
+            return etag is not None and request.if_none_match.contains_weak(etag)
+        return False
+
+    def invalidate(self, user_id):
+        """
+        Drops every response cached for a user by moving them on to a new version
+        :param user_id: id of the user
+        """
+        state = self._state()
+        if state.backend is not None:
+            state.backend.bump(user_id)
+            state.count("invalidations")
+
+    def invalidate_after_write(self, response):
+        """
+        after_request handler invalidating the cache of the authenticated user after a
+        successful write
+        :param response: response of the request
+        :return: the response
+        """
+        if request.method in WRITE_METHODS and response.status_code < 400:
+            user = authenticated_user()
+            if user is not None and user.is_authenticated:
+                # the write committed and expired the user, its identity is read without
+                # loading it again
+                self.invalidate(inspect(user).identity[0])
+        return response
+
+    def metrics(self):
+        """
+        Counters of the cache of the current application
+        :return: hits, misses, stored responses and invalidations
+        :rtype: dict
+        """
+        state = self._state()
+        with state.lock:
+            return dict(backend=current_app.config["RESPONSE_CACHE_BACKEND"] or None,
+                        hits=state.hits, misses=state.misses, stores=state.stores,
+                        invalidations=state.invalidations)
+
+
+response_cache = ResponseCache()
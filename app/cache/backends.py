@@ -0,0 +1,127 @@
+"""
+Storage backends of the response cache. A backend stores cached responses under string keys
+and keeps a version counter per user, bumping a user's counter makes every response cached for
+that user unreachable at once
+"""
+import base64
+import json
+import threading
+import time
+from abc import ABCMeta, abstractmethod
+from collections import OrderedDict
+
+
+class CacheBackend(object):
+    """
+    Base class of the response cache backends
+    """
+    __metaclass__ = ABCMeta
+
+    @abstractmethod
+    def get(self, key):
+        """
+        :param key: cache key
+        :return: the cached entry or None if there is none or it has expired
+        :rtype: dict
+        """
+        pass
+
+    @abstractmethod
+    def set(self, key, entry, ttl):
+        """
+        :param key: cache key
+        :param entry: status, headers and body of a response
+        :param ttl: seconds the entry stays valid
+        """
+        pass
+
+    @abstractmethod
+    def version(self, user_id):
+        """
+        :param user_id: id of the user
+        :return: current version of the user's cached responses
+        :rtype: int
+        """
+        pass
+
+    @abstractmethod
+    def bump(self, user_id):
+        """
+        Moves a user on to a new version, invalidating their cached responses
+        :param user_id: id of the user
+        """
+        pass
+
+
+class MemoryBackend(CacheBackend):
+    """
+    Least recently used cache in the memory of the process. Every process has its own copy, so
+    a write only invalidates the cache of the process that handled it
+    """
+
+    def __init__(self, size):
+        self.size = size
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+        self.versions = {}
+
+    def get(self, key):
+        with self.lock:
+            cached = self.entries.get(key)
+            if cached is None:
+                return None
+            expires_at, entry = cached
+            if expires_at < time.time():
+                del self.entries[key]
+                return None
+            self.entries.move_to_end(key)
+            return entry
+
+    def set(self, key, entry, ttl):
+        with self.lock:
+            self.entries[key] = (time.time() + ttl, entry)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.size:
+                self.entries.popitem(last=False)
+
+    def version(self, user_id):
+        with self.lock:
+            return self.versions.get(user_id, 0)
+
+    def bump(self, user_id):
+        with self.lock:
+            self.versions[user_id] = self.versions.get(user_id, 0) + 1
+
+
+class RedisBackend(CacheBackend):
+    """
+    Cache in Redis or a server speaking its protocol, shared by every process of the app so a
+    write invalidates the cache everywhere. Needs the redis package
+    """
+
+    def __init__(self, url, prefix="bucketlist:cache:"):
+        try:
+            import redis
+        except ImportError:
+            raise RuntimeError("The redis response cache backend needs the redis package, "
+                               "pip install redis")
+        self.client = redis.StrictRedis.from_url(url)
+        self.prefix = prefix
+
+    def get(self, key):
+        value = self.client.get(self.prefix + key)
+        if value is None:
+            return None
+        entry = json.loads(value.decode("utf-8"))
+        entry["body"] = base64.b64decode(entry["body"])
+        return entry
+
+    def set(self, key, entry, ttl):
+        value = dict(entry, body=base64.b64encode(entry["body"]).decode("ascii"))
+        self.client.setex(self.prefix + key, int(ttl), json.dumps(value))
+
+    def version(self, user_id):
+        return int(self.client.get("{}version:{}".format(self.prefix, user_id)) or 0)
+
+    def bump(self, user_id):
+        self.client.incr("{}version:{}".format(self.prefix, user_id))
@@ -0,0 +1,4 @@
+"""
+Implementation of the longer running manage.py commands, kept out of manage.py so they can be
+imported and tested without the command line
+"""
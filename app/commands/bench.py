@@ -0,0 +1,308 @@
+"""
+Load testing benchmark behind manage.py bench.
+A fresh database is seeded with users, bucket lists and items and the real WSGI application is
+then driven by concurrent clients through a weighted mix of logins, listings, searches and item
+create, read, update and delete cycles. Requests go either straight to the application in
+process, which measures the application alone, or over HTTP to a server on a local socket, which
+adds the cost of the server and of parsing HTTP. Latency percentiles and throughput are reported
+as JSON so runs of different builds can be compared
+"""
+import http.cookiejar
+import logging
+import math
+import os
+import random
+import shutil
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+
+from flask import json
+from werkzeug.serving import make_server
+
+from app import create_app, db
+from app.mod_auth.models import UserAccount
+from .seed import seed_database
+
+BENCH_PASSWORD = "bench_pass"
+DEFAULT_MIX = dict(login=1, list=4, search=2, crud=3)
+TRANSPORTS = ("inprocess", "socket")
+
+# words searches look for, most of them appear in the names the seed generates
+WORDS = ("visit", "paris", "learn", "french", "spanish", "piano", "read", "marathon", "eat",
+         "things", "travel", "weekend", "goals", "mountain", "sights", "meet", "write", "london")
+
+
+def parse_mix(mix):
+    """
+    Reads an operation mix such as login=1,list=4,search=2,crud=3
+    :param mix: comma separated operation=weight pairs
+    :raises: ValueError on unknown operations or weights that are not positive integers
+    :return: operation to weight
+    :rtype: dict
+    """
+    weights = {}
+    for pair in mix.split(","):
+        name, _, weight = pair.partition("=")
+        name = name.strip()
+        if name not in DEFAULT_MIX:
+            raise ValueError("Unknown operation {}, use one of {}".format(name, ", ".join(DEFAULT_MIX)))
+        weights[name] = int(weight)
+        if weights[name] < 0:
+            raise ValueError("Weight of {} can not be negative".format(name))
+    if not sum(weights.values()):
+        raise ValueError("The mix needs at least one operation with a positive weight")
+    return weights
+
+
+def percentile(sorted_values, fraction):
+    """
+    Nearest rank percentile
+    :param sorted_values: values in ascending order
+    :param fraction: percentile as a fraction, 0.95 for the 95th percentile
+    :rtype: float
+    """
+    if not sorted_values:
+        return None
+    rank = int(math.ceil(fraction * len(sorted_values)))
+    return sorted_values[min(max(rank, 1), len(sorted_values)) - 1]
+
+
+def _summary(samples):
+    """
+    Latency percentiles in milliseconds of a list of (seconds, ok) samples
+    """
+    latencies = sorted(seconds * 1000 for seconds, _ in samples)
+    return dict(requests=len(samples), errors=sum(1 for _, ok in samples if not ok),
+                p50=_round(percentile(latencies, 0.50)), p95=_round(percentile(latencies, 0.95)),
+                p99=_round(percentile(latencies, 0.99)),
+                mean=_round(sum(latencies) / len(latencies) if latencies else None))
+
+
+def _round(value):
+    return round(value, 3) if value is not None else None
+
+
+class InProcessClient(object):
+    """
+    Sends requests straight to the WSGI application through the flask test client
+    """
+
+    def __init__(self, app):
+        self.client = app.test_client()
+
+    def request(self, method, path, data=None, headers=None):
+        """
+        Sends a request
+        :return: status code and body of the response
+        :rtype: tuple
+        """
+        try:
+            response = self.client.open(path, method=method, data=data, headers=headers)
+        except Exception:
+            # with exceptions propagated, as in debug mode, an API error surfaces as an exception
+            return 500, b""
+        return response.status_code, response.get_data()
+
+
+class SocketClient(object):
+    """
+    Sends requests over HTTP to the server of the benchmark, keeping the session cookie
+    """
+
+    def __init__(self, base_url):
+        self.base_url = base_url
+        self.opener = urllib.request.build_opener(
+            urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar()))
+
+    def request(self, method, path, data=None, headers=None):
+        body = urllib.parse.urlencode(data).encode("utf-8") if data is not None else None
+        request = urllib.request.Request(self.base_url + path, data=body, method=method,
+                                         headers=headers or {})
+        try:
+            with self.opener.open(request) as response:
+                return response.status, response.read()
+        except urllib.error.HTTPError as e:
+            return e.code, e.read()
+
+
+class Worker(object):
+    """
+    A client logged in as one of the seeded users, running operations drawn from the mix
+    """
+
+    def __init__(self, client, username, rng, weights):
+        self.client = client
+        self.username = username
+        self.rng = rng
+        self.operations = [name for name in sorted(weights) for _ in range(weights[name])]
+        self.samples = {}
+        self.headers = None
+        self.bucketlist_id = None
+        self.created = 0
+
+    def timed(self, name, method, path, data=None, expected=200):
+        started = time.time()
+        status, body = self.client.request(method, path, data=data, headers=self.headers)
+        self.samples.setdefault(name, []).append((time.time() - started, status == expected))
+        return status, body
+
+    def login(self):
+        status, body = self.timed("login", "POST", "/auth/login/",
+                                  data=dict(username=self.username,
+                                            password=BENCH_PASSWORD))
+        if status == 200:
+            self.headers = {"Authorization": "Bearer {}".format(json.loads(body)["token"])}
+        return status
+
+    def setup(self):
+        """
+        Logs in and picks the bucket list the item operations work on
+        """
+        if self.login() != 200:
+            raise RuntimeError("Benchmark user {} can not log in".format(self.username))
+        status, body = self.client.request("GET", "/bucketlists/?limit=1&cursor=", headers=self.headers)
+        self.bucketlist_id = json.loads(body)["message"][0]["id"]
+        self.samples.clear()
+
+    def run(self, operations):
+        for _ in range(operations):
+            getattr(self, "op_" + self.rng.choice(self.operations))()
+
+    def op_login(self):
+        self.login()
+
+    def op_list(self):
+        self.timed("list", "GET", "/bucketlists/?limit=20&cursor=")
+
+    def op_search(self):
+        self.timed("search", "GET", "/bucketlists/search?limit=20&q=" + self.rng.choice(WORDS))
+
+    def op_crud(self):
+        self.created += 1
+        items = "/bucketlists/{}/items".format(self.bucketlist_id)
+        status, body = self.timed("item_create", "POST", items, expected=201,
+                                  data=dict(name="bench item {}.{}".format(self.username, self.created)))
+        if status != 201:
+            return
+        item = "{}/{}".format(items, json.loads(body)["bucketlistitem"]["id"])
+        self.timed("item_get", "GET", item)
+        self.timed("item_update", "PUT", item, data=dict(done="true"))
+        self.timed("item_delete", "DELETE", item)
+
+
+def _drive(app, transport, usernames, operations, concurrency, weights, seed_value):
+    """
+    Runs the mix over one transport
+    :return: report of the run
+    :rtype: dict
+    """
+    server = None
+    if transport == "socket":
+        server = make_server("127.0.0.1", 0, app, threaded=True)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        base_url = "http://127.0.0.1:{}".format(server.server_port)
+
+    def client():
+        return SocketClient(base_url) if server is not None else InProcessClient(app)
+
+    try:
+        workers = [Worker(client(), usernames[n], random.Random(seed_value + n), weights)
+                   for n in range(concurrency)]
+        for worker in workers:
+            worker.setup()
+
+        shares = [operations // concurrency + (1 if n < operations % concurrency else 0)
+                  for n in range(concurrency)]
+        threads = [threading.Thread(target=worker.run, args=(share,))
+                   for worker, share in zip(workers, shares)]
+        started = time.time()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        seconds = time.time() - started
+    finally:
+        if server is not None:
+            server.shutdown()
+            server.server_close()
+
+    samples = {}
+    for worker in workers:
+        for name, values in worker.samples.items():
+            samples.setdefault(name, []).extend(values)
+    every = [sample for values in samples.values() for sample in values]
+
+    report = dict(transport=transport, seconds=round(seconds, 3),
+                  requests_per_second=round(len(every) / seconds, 2) if seconds else None)
+    report.update(_summary(every))
+    report["operations"] = dict((name, _summary(values)) for name, values in sorted(samples.items()))
+    return report
+
+
+def run_benchmark(config_name="testing", users=10, lists=5, items=20, operations=1000,
+                  concurrency=4, transports=TRANSPORTS, mix=None, database_url=None, seed_value=0):
+    """
+    Seeds a database and benchmarks the application against it
+    :param config_name: configuration the application is created with
+    :param users: number of users to seed
+    :param lists: number of bucket lists per user
+    :param items: number of items per bucket list
+    :param operations: number of operations drawn from the mix per transport
+    :param concurrency: number of concurrent clients
+    :param transports: inprocess, socket or both
+    :param mix: operation to weight, DEFAULT_MIX if not given
+    :param database_url: database to seed, its tables are dropped and created again. A temporary
+    SQLite database is used if not given
+    :param seed_value: seed of the random generators, runs with the same seed make the same
+    requests
+    :return: report of the benchmark
+    :rtype: dict
+    """
+    weights = mix or DEFAULT_MIX
+    if concurrency > users:
+        raise ValueError("Every concurrent client needs its own user, seed at least {} users"
+                         .format(concurrency))
+    if lists < 1:
+        raise ValueError("Every user needs at least one bucket list")
+
+    workdir = None
+    if database_url is None:
+        workdir = tempfile.mkdtemp(prefix="bucketlist-bench-")
+        database_url = "sqlite:///" + os.path.join(workdir, "bench.db")
+
+    app = create_app(config_name)
+    app.config["SQLALCHEMY_DATABASE_URI"] = database_url
+    from app.search import search
+    search.init_app(app)
+
+    # request logging would measure the terminal rather than the application
+    logging.getLogger().setLevel(logging.WARNING)
+    logging.getLogger("werkzeug").setLevel(logging.WARNING)
+
+    try:
+        with app.app_context():
+            db.drop_all()
+            db.create_all()
+            seeded = seed_database(users, lists, items, seed=seed_value, password=BENCH_PASSWORD)
+            usernames = [username for username, in db.session.query(UserAccount.username)
+                         .order_by(UserAccount.id).limit(concurrency)]
+            db.session.remove()
+
+        runs = [_drive(app, transport, usernames, operations, concurrency, weights, seed_value)
+                for transport in transports]
+    finally:
+        with app.app_context():
+            db.session.remove()
+            db.get_engine(app).dispose()
+        from app.mod_auth.hashing import password_hasher
+        password_hasher.shutdown(app)
+        if workdir is not None:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    return dict(config=config_name, database=app.config["SQLALCHEMY_DATABASE_URI"].split("@")[-1],
+                users=users, lists_per_user=lists, items_per_list=items, concurrency=concurrency,
+                mix=weights, seed=seed_value, seed_seconds=round(seeded.seconds, 3), runs=runs)
@@ -0,0 +1,119 @@
+"""
+Benchmark of the response encodings behind manage.py bench_encoding.
+Documents shaped like the item and bucket list responses are built from seeded rows and encoded
+with every installed JSON backend and MessagePack, then compressed with gzip and brotli at a few
+levels, whole and chunk by chunk as streamed responses are. The size of every payload and the CPU
+time of encoding, compressing and decompressing it are reported as JSON, so the cost of a
+setting can be weighed against the bandwidth it saves
+"""
+import time
+import zlib
+
+from app.encoding import _GzipStream, _BrotliStream, _import_brotli, _import_msgpack
+from app.mod_bucketlist.models import BUCKETLIST_JSON, ITEM_JSON
+from app.serializers import BACKENDS, load_backend
+from .bench import _round
+from .seed import _Generator
+
+GZIP_LEVELS = (1, 6, 9)
+# the gzip levels of COMPRESSION_LEVEL that map to brotli qualities 4 and 11
+BROTLI_LEVELS = (3, 9)
+# items per chunk of a streamed response, as written by the items endpoint
+STREAM_CHUNK = 500
+
+
+def _documents(items, seed):
+    """
+    An items response with the given number of items and a bucket lists response of a tenth as
+    many bucket lists, with the fields the endpoints send
+    """
+    generator = _Generator(seed, 1, max(1, items // 10), 10, "hash", dict(
+        user_profile=1, user_account=1, bucketlists=1, bucketlist_items=1))
+    lists = [BUCKETLIST_JSON.dump(tuple(row[key] for key in BUCKETLIST_JSON.keys))
+             for row in generator.bucketlists()]
+    rows = [ITEM_JSON.dump(tuple(row[key] for key in ITEM_JSON.keys))
+            for row in generator.bucketlist_items()][:items]
+    return dict(items=dict(message="Bucket list items", items=rows, next_cursor=None),
+                bucketlists=dict(message=lists, next_cursor=None))
+
+
+def _timed(repeat, f, *args):
+    """
+    Result of f and the mean CPU time of a call in milliseconds
+    """
+    start = time.process_time()
+    for _ in range(repeat):
+        result = f(*args)
+    return result, _round((time.process_time() - start) * 1000 / repeat)
+
+
+def _encoders():
+    encoders = {}
+    for name in BACKENDS:
+        try:
+            encoders[name] = load_backend(name).dumps
+        except RuntimeError:
+            continue
+    msgpack = _import_msgpack()
+    if msgpack is not None:
+        encoders["msgpack"] = lambda document: msgpack.packb(document, use_bin_type=True)
+    return encoders
+
+
+def _compressors():
+    compressors = dict(("gzip-{}".format(level), (lambda level=level: _GzipStream(level), _gunzip))
+                       for level in GZIP_LEVELS)
+    brotli = _import_brotli()
+    if brotli is not None:
+        for level in BROTLI_LEVELS:
+            compressors["br-{}".format(level)] = (lambda level=level: _BrotliStream(brotli, level),
+                                                  brotli.decompress)
+    return compressors
+
+
+def _gunzip(data):
+    return zlib.decompress(data, zlib.MAX_WBITS | 16)
+
+
+def _compress_whole(factory, payload):
+    stream = factory()
+    return stream.compress(payload) + stream.finish()
+
+
+def _compress_chunked(factory, chunks):
+    stream = factory()
+    return b"".join(stream.compress(chunk) + stream.flush() for chunk in chunks) + stream.finish()
+
+
+def run_encoding_benchmark(items=5000, repeat=20, seed_value=0):
+    """
+    Encodes and compresses response documents with every available setting
+    :param items: number of items in the items document
+    :param repeat: number of times every measurement is repeated
+    :param seed_value: seed of the generated rows
+    :return: report of the benchmark
+    :rtype: dict
+    """
+    documents = _documents(items, seed_value)
+    encoders = _encoders()
+    compressors = _compressors()
+    report = dict(items=items, repeat=repeat, documents={})
+
+    for document_name, document in sorted(documents.items()):
+        results = report["documents"][document_name] = {}
+        for encoder_name, encode in sorted(encoders.items()):
+            payload, encode_ms = _timed(repeat, encode, document)
+            result = results[encoder_name] = dict(bytes=len(payload), encode_ms=encode_ms, compressed={})
+            # a streamed response is sent in chunks of STREAM_CHUNK items, each flushed by the
+            # compressor
+            size = max(1, len(payload) * STREAM_CHUNK // max(1, items))
+            chunks = [payload[i:i + size] for i in range(0, len(payload), size)]
+            for compressor_name, (factory, decompress) in sorted(compressors.items()):
+                compressed, compress_ms = _timed(repeat, _compress_whole, factory, payload)
+                streamed, stream_ms = _timed(repeat, _compress_chunked, factory, chunks)
+                _, decompress_ms = _timed(repeat, decompress, compressed)
+                result["compressed"][compressor_name] = dict(
+                    bytes=len(compressed), ratio=_round(len(compressed) / len(payload)),
+                    compress_ms=compress_ms, decompress_ms=decompress_ms,
+                    streamed_bytes=len(streamed), streamed_compress_ms=stream_ms)
+    return report
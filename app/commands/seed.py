@@ -0,0 +1,213 @@
+"""
+Synthetic data generator behind manage.py seed.
+Users with their profiles, bucket lists and items are generated in batches and written with the
+fastest bulk path of the database, COPY on Postgres and executemany everywhere else. Only one
+batch is held in memory at a time, so the number of rows is bounded by disk rather than memory.
+Every row, ids included, is derived from the seed, which makes a dataset reproducible: the same
+seed on an empty database always produces the same rows
+"""
+import csv
+import io
+import random
+import time
+from datetime import datetime, timedelta
+
+from faker import Faker
+from sqlalchemy import func, text
+
+from app import db
+
+DEFAULT_BATCH_SIZE = 10000
+
+# shapes of the generated bucket list and item names, filled in with Faker data
+LIST_NAMES = ("Visit {city}", "Travel to {country}", "Things to do in {city}", "Before I turn {age}",
+              "{year} goals", "Weekend plans in {city}", "Learn {language}")
+ITEM_NAMES = ("Visit {city}", "See the sights of {country}", "Eat at {company}", "Learn {language}",
+              "Read {title}", "Run a marathon in {city}", "Meet {name}", "Climb a mountain in {country}",
+              "Work at {company}", "Write about {title}")
+LANGUAGES = ("French", "Spanish", "Swahili", "Japanese", "Portuguese", "German", "Italian",
+             "Mandarin", "Arabic", "Korean", "the piano", "the guitar", "to sail", "to dive")
+# number of distinct names generated with Faker, rows pick from them which is far cheaper than
+# calling Faker per row
+NAME_POOL_SIZE = 500
+
+
+class SeedResult(object):
+    """
+    Outcome of a seeding run
+    :ivar rows: table name to the number of rows written
+    :ivar seconds: time the run took
+    """
+
+    def __init__(self, rows, seconds):
+        self.rows = rows
+        self.seconds = seconds
+
+    def to_json(self):
+        return dict(rows=self.rows, seconds=round(self.seconds, 3),
+                    rows_per_second=round(sum(self.rows.values()) / self.seconds, 2) if self.seconds else None)
+
+
+def _name_pool(fake, templates, size):
+    pool = []
+    for _ in range(size):
+        template = fake.random_element(templates)
+        pool.append(template.format(city=fake.city(), country=fake.country(), age=fake.random_int(25, 70),
+                                    year=fake.random_int(2017, 2030), company=fake.company(),
+                                    title=fake.catch_phrase(), name=fake.name(),
+                                    language=fake.random_element(LANGUAGES)))
+    return pool
+
+
+class _Generator(object):
+    """
+    Generates the rows of every table from a seed. Ids start after the largest id already in each
+    table so a dataset can be added to an existing database
+    """
+
+    def __init__(self, seed, users, lists, items, password_hash, first_ids):
+        self.fake = Faker()
+        self.fake.seed_instance(seed)
+        self.rng = random.Random(seed)
+        self.users = users
+        self.lists = lists
+        self.items = items
+        self.password_hash = password_hash
+        self.first_ids = first_ids
+        self.start = datetime(2017, 1, 1)
+        self.list_names = _name_pool(self.fake, LIST_NAMES, NAME_POOL_SIZE)
+        self.item_names = _name_pool(self.fake, ITEM_NAMES, NAME_POOL_SIZE)
+
+    def _moment(self, n):
+        # creation times grow with the id, a few minutes apart, like rows created over time
+        return self.start + timedelta(seconds=n * 180 + self.rng.randrange(180))
+
+    def profiles(self):
+        first_id = self.first_ids["user_profile"]
+        for n in range(self.users):
+            profile_id = first_id + n
+            created = self._moment(profile_id)
+            yield dict(id=profile_id, first_name=self.fake.first_name(), last_name=self.fake.last_name(),
+                       email="user{}@{}".format(profile_id, self.fake.free_email_domain()),
+                       accept_tos=True, time_zone=None, date_created=created, date_modified=created)
+
+    def accounts(self):
+        first_id, first_profile = self.first_ids["user_account"], self.first_ids["user_profile"]
+        for n in range(self.users):
+            account_id = first_id + n
+            created = self._moment(account_id)
+            # the id after the last dot keeps generated user names apart
+            username = "{}.{}".format(self.fake.user_name(), account_id)
+            yield dict(id=account_id, uuid=self.fake.uuid4(), username=username,
+                       email="{}@example.com".format(username), email_confirmation_token=None,
+                       last_seen=None, password_hash=self.password_hash, admin=False,
+                       registered_on=created, confirmed=True, confirmed_on=created,
+                       user_profile_id=first_profile + n, user_account_status_id=None,
+                       date_created=created, date_modified=created)
+
+    def bucketlists(self):
+        first_id, first_account = self.first_ids["bucketlists"], self.first_ids["user_account"]
+        for n in range(self.users * self.lists):
+            bucketlist_id = first_id + n
+            created = self._moment(bucketlist_id)
+            yield dict(id=bucketlist_id, created_by=first_account + n // self.lists,
+                       name=self.rng.choice(self.list_names), date_created=created, date_modified=created)
+
+    def bucketlist_items(self):
+        first_id, first_list = self.first_ids["bucketlist_items"], self.first_ids["bucketlists"]
+        for n in range(self.users * self.lists * self.items):
+            item_id = first_id + n
+            created = self._moment(item_id)
+            # item names are unique, the id keeps generated names apart
+            yield dict(id=item_id, bucketlist_id=first_list + n // self.items,
+                       name="{} #{}".format(self.rng.choice(self.item_names), item_id),
+                       done=self.rng.random() < 0.3, date_created=created, date_modified=created)
+
+
+def _batches(rows, size):
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def _copy(connection, table, batch):
+    """
+    Writes a batch with COPY FROM STDIN, the fastest way to load rows into Postgres
+    """
+    columns = list(batch[0])
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for row in batch:
+        writer.writerow(["" if row[c] is None else row[c] for c in columns])
+    buffer.seek(0)
+    cursor = connection.connection.cursor()
+    try:
+        cursor.copy_expert("COPY {} ({}) FROM STDIN WITH (FORMAT csv)".format(table.name, ", ".join(columns)),
+                           buffer)
+    finally:
+        cursor.close()
+
+
+def _write(engine, table, rows, batch_size):
+    """
+    Writes rows batch by batch, each batch in its own transaction
+    :return: number of rows written
+    :rtype: int
+    """
+    written = 0
+    copy = engine.dialect.name == "postgresql"
+    for batch in _batches(rows, batch_size):
+        with engine.begin() as connection:
+            if copy:
+                _copy(connection, table, batch)
+            else:
+                connection.execute(table.insert(), batch)
+        written += len(batch)
+    return written
+
+
+def seed_database(users, lists, items, seed=0, password="password", batch_size=DEFAULT_BATCH_SIZE):
+    """
+    Generates users with profiles, their bucket lists and the items of those and writes them to
+    the database of the current application. Every user gets the same password, which is hashed
+    once
+    :param users: number of users
+    :param lists: number of bucket lists per user
+    :param items: number of items per bucket list
+    :param seed: seed of the generator
+    :param password: password of every generated user
+    :param batch_size: number of rows written per statement
+    :return: number of rows written per table and the time it took
+    :rtype: SeedResult
+    """
+    from app.mod_auth.hashing import password_hasher
+    from app.mod_auth.models import UserAccount, UserProfile
+    from app.mod_bucketlist.models import BucketList, BucketListItem
+
+    started = time.time()
+    engine = db.get_engine()
+    models = (UserProfile, UserAccount, BucketList, BucketListItem)
+    first_ids = dict((model.__tablename__, (db.session.query(func.max(model.id)).scalar() or 0) + 1)
+                     for model in models)
+    db.session.commit()
+
+    generator = _Generator(seed, users, lists, items, password_hasher.hash(password), first_ids)
+    rows = {}
+    for model, generate in zip(models, (generator.profiles, generator.accounts, generator.bucketlists,
+                                        generator.bucketlist_items)):
+        rows[model.__tablename__] = _write(engine, model.__table__, generate(), batch_size)
+
+    if engine.dialect.name == "postgresql":
+        # ids were given explicitly, move the sequences past them
+        with engine.begin() as connection:
+            for model in models:
+                connection.execute(text("SELECT setval(pg_get_serial_sequence(:table, 'id'), "
+                                        "(SELECT max(id) FROM {}))".format(model.__tablename__)),
+                                   table=model.__tablename__)
+
+    return SeedResult(rows, time.time() - started)
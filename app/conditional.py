@@ -0,0 +1,89 @@
+"""
+Conditional GET helpers shared by the bucket list endpoints.
+A resource is described by validators, a weak ETag and a Last-Modified time, derived from the
+ids and date_modified of the rows it is built from. For a collection they come from a single
+aggregate query, count, latest date_modified and largest id, so a client polling a resource that
+has not changed gets a 304 without the rows being loaded or serialized. Collections have no
+Last-Modified time, deleting a row, or editing it out of a search, leaves the latest
+date_modified of the remaining rows as it was or even earlier, only the ETag changes
+"""
+import hashlib
+
+from flask import request, current_app
+from sqlalchemy import func
+
+
+class Validators(object):
+    """
+    ETag and Last-Modified time of a representation of a resource
+    :ivar etag: opaque tag, sent as a weak ETag since the same data may be encoded differently
+    :ivar last_modified: latest date_modified of the rows of the resource, naive UTC, None for a
+    collection
+    """
+
+    def __init__(self, state, last_modified):
+        # the query string is part of the tag, different pages or filters of the same rows are
+        # different representations
+        digest = hashlib.sha1(repr((request.path, request.query_string, state)).encode("utf-8"))
+        self.etag = digest.hexdigest()
+        self.last_modified = last_modified
+
+    @classmethod
+    def for_rows(cls, *rows):
+        """
+        Validators of a resource built from the given rows
+        :param rows: model instances
+        :rtype: Validators
+        """
+        state = [(type(row).__name__, row.id, row.date_modified) for row in rows]
+        modified = [row.date_modified for row in rows if row.date_modified is not None]
+        return cls(state, max(modified) if modified else None)
+
+    @classmethod
+    def for_query(cls, query, model, *rows):
+        """
+        Validators of a collection, from one aggregate query over the rows it is built from. Any
+        insert, update or delete changes the count, the latest date_modified or the largest id,
+        so the collection is only validated by its ETag
+        :param query: query selecting the rows of the collection
+        :param model: model of the rows
+        :param rows: already loaded rows that are part of the representation too, such as the
+        bucket list of a list of items
+        :rtype: Validators
+        """
+        count, modified, last_id = query.order_by(None).with_entities(
+            func.count(model.id), func.max(model.date_modified), func.max(model.id)).one()
+        state = [(model.__name__, count, modified, last_id)]
+        state.extend((type(row).__name__, row.id, row.date_modified) for row in rows)
+        return cls(state, None)
+
+    def is_fresh(self):
+        """
+        Checks whether the client already has this representation. If-None-Match takes
+        precedence over If-Modified-Since, which has a precision of one second
+        :rtype: bool
+        """
+        if request.method not in ("GET", "HEAD"):
+            return False
+        if request.if_none_match:
+            return request.if_none_match.contains_weak(self.etag)
+        if request.if_modified_since and self.last_modified is not None:
+            return self.last_modified.replace(microsecond=0) <= request.if_modified_since
+        return False
+
+    def apply(self, response):
+        """
+        Adds the validators to a response
+        :param response: response carrying the representation
+        :return: the response
+        """
+        response.set_etag(self.etag, weak=True)
+        if self.last_modified is not None:
+            response.last_modified = self.last_modified
+        return response
+
+    def not_modified(self):
+        """
+        Empty 304 response telling the client its copy is still current
+        """
+        return self.apply(current_app.response_class(status=304))
@@ -0,0 +1,114 @@
+"""
+SQLAlchemy extension with tunable connection pools and read replicas.
+Pool size, overflow, timeout, recycle and pre ping come from the configuration and apply to the
+primary and to every replica. SQLALCHEMY_REPLICA_URIS lists read replicas of the primary, a
+request whose handler is marked as a reader with use_replica sends its reads to one of them,
+picked per request, while flushes and writes always go to the primary. Replicas lag behind the
+primary, so a client that has just written is kept on the primary for
+SQLALCHEMY_REPLICA_STICKY_SECONDS and reads its own writes. The client is recognised by a
+timestamp in its session cookie
+"""
+import random
+import time
+
+from flask import current_app, has_request_context, request, session, _request_ctx_stack
+from flask_sqlalchemy import SQLAlchemy, SignallingSession, get_state
+from sqlalchemy import orm
+from sqlalchemy.sql.elements import TextClause
+from sqlalchemy.sql.expression import UpdateBase
+
+REPLICA_BIND = "replica_{}"
+# session cookie key holding the time until which the client reads from the primary
+STICKY_KEY = "_db_primary_until"
+WRITE_METHODS = ("POST", "PUT", "PATCH", "DELETE")
+# pool options that only apply to pools holding connections, SQLite gets a static or null pool
+POOL_SIZING = ("pool_size", "max_overflow", "pool_timeout")
+
+
+def _writes(clause):
+    if isinstance(clause, UpdateBase):
+        return True
+    return isinstance(clause, TextClause) and not clause.text.lstrip().upper().startswith(("SELECT", "WITH"))
+
+
+class RoutingSession(SignallingSession):
+    """
+    Session sending the reads of a replica routed request to the replica picked for it
+    """
+
+    def get_bind(self, mapper=None, clause=None):
+        replica = RoutingSQLAlchemy.replica()
+        if replica is not None and (mapper is None or mapper.persist_selectable.info.get("bind_key") is None):
+            if self._flushing or _writes(clause):
+                # the request has written, the rest of it reads from the primary to see its writes
+                _request_ctx_stack.top.db_replica = None
+            else:
+                return get_state(self.app).db.get_engine(self.app, bind=replica)
+        return SignallingSession.get_bind(self, mapper, clause)
+
+
+class RoutingSQLAlchemy(SQLAlchemy):
+    """
+    Flask-SQLAlchemy with pool settings and read replica routing
+    """
+
+    def init_app(self, app):
+        """
+        Registers the replicas of the given application as binds and the request hook that keeps
+        writing clients on the primary
+        :param app: current flask app
+        """
+        app.config.setdefault("SQLALCHEMY_POOL_PRE_PING", False)
+        app.config.setdefault("SQLALCHEMY_REPLICA_URIS", [])
+        app.config.setdefault("SQLALCHEMY_REPLICA_STICKY_SECONDS", 10)
+        app.config.setdefault("DATABASE_CONNECT_OPTIONS", {})
+
+        replicas = app.config["SQLALCHEMY_REPLICA_URIS"]
+        binds = dict(app.config.get("SQLALCHEMY_BINDS") or {})
+        binds.update((REPLICA_BIND.format(n), uri) for n, uri in enumerate(replicas))
+        app.config["SQLALCHEMY_BINDS"] = binds or None
+        app.extensions["replicas"] = [REPLICA_BIND.format(n) for n in range(len(replicas))]
+
+        SQLAlchemy.init_app(self, app)
+        if replicas:
+            app.after_request(self._stick)
+
+    def create_session(self, options):
+        return orm.sessionmaker(class_=RoutingSession, db=self, **options)
+
+    def apply_driver_hacks(self, app, info, options):
+        if info.drivername.startswith("sqlite"):
+            for option in POOL_SIZING:
+                options.pop(option, None)
+        SQLAlchemy.apply_driver_hacks(self, app, info, options)
+        if app.config["SQLALCHEMY_POOL_PRE_PING"]:
+            options["pool_pre_ping"] = True
+        if app.config["DATABASE_CONNECT_OPTIONS"]:
+            options.setdefault("connect_args", {}).update(app.config["DATABASE_CONNECT_OPTIONS"])
+
+    def use_replica(self):
+        """
+        Sends the reads of the current request to a replica, unless the client has written
+        recently or there are no replicas. Meant for the before_request hook of read only
+        handlers
+        """
+        replicas = current_app.extensions["replicas"]
+        ctx = _request_ctx_stack.top
+        ctx.db_replica = None
+        if replicas and session.get(STICKY_KEY, 0) <= time.time():
+            ctx.db_replica = random.choice(replicas)
+
+    @staticmethod
+    def replica():
+        """
+        Bind key of the replica serving the reads of the current request
+        :return: the bind key, None when reads go to the primary
+        :rtype: str
+        """
+        return getattr(_request_ctx_stack.top, "db_replica", None) if has_request_context() else None
+
+    @staticmethod
+    def _stick(response):
+        if request.method in WRITE_METHODS and response.status_code < 400:
+            session[STICKY_KEY] = time.time() + current_app.config["SQLALCHEMY_REPLICA_STICKY_SECONDS"]
+        return response
@@ -0,0 +1,241 @@
+"""
+Content negotiation of the encoding of responses.
+JSON responses are sent as MessagePack to clients whose Accept header prefers
+application/msgpack, when the msgpack package is installed. Responses built by json_response keep
+the document they were encoded from, which is packed directly, others are decoded first.
+Compression is WSGI middleware around the whole app. Responses of a compressible type are
+compressed with brotli, when the brotli package is installed, or gzip, whichever the
+Accept-Encoding header of the client prefers. Responses of a known length are compressed whole
+when they are at least COMPRESSION_MIN_SIZE bytes. Streamed responses, whose length is not known,
+are always compressed and every chunk is flushed as it is written, so a client decodes a
+streamed list as it arrives rather than when the compressor's buffer fills
+"""
+import zlib
+
+from flask import current_app, json, request
+from werkzeug.http import parse_accept_header
+
+MSGPACK_MIMETYPES = ("application/msgpack", "application/x-msgpack")
+
+
+def _import_msgpack():
+    try:
+        import msgpack
+    except ImportError:
+        return None
+    return msgpack
+
+
+def _import_brotli():
+    try:
+        import brotli
+    except ImportError:
+        return None
+    return brotli
+
+
+class _GzipStream(object):
+    """
+    Gzip compressor of a response body
+    """
+
+    def __init__(self, level):
+        self.compressor = zlib.compressobj(level, zlib.DEFLATED, zlib.MAX_WBITS | 16)
+
+    def compress(self, chunk):
+        return self.compressor.compress(chunk)
+
+    def flush(self):
+        return self.compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self):
+        return self.compressor.flush(zlib.Z_FINISH)
+
+
+class _BrotliStream(object):
+    """
+    Brotli compressor of a response body
+    """
+
+    def __init__(self, brotli, level):
+        # brotli levels run from 0 to 11, the level is scaled from the 1 to 9 of gzip
+        self.compressor = brotli.Compressor(quality=min(11, max(0, round(level * 11 / 9))))
+
+    def compress(self, chunk):
+        return self.compressor.process(chunk)
+
+    def flush(self):
+        return self.compressor.flush()
+
+    def finish(self):
+        return self.compressor.finish()
+
+
+class _CompressedBody(object):
+    """
+    Body of a streamed response, compressed chunk by chunk. Closes the body it wraps
+    """
+
+    def __init__(self, body, stream):
+        self.body = body
+        self.stream = stream
+
+    def __iter__(self):
+        for chunk in self.body:
+            if chunk:
+                yield self.stream.compress(chunk) + self.stream.flush()
+        yield self.stream.finish()
+
+    def close(self):
+        if hasattr(self.body, "close"):
+            self.body.close()
+
+
+class CompressionMiddleware(object):
+    """
+    WSGI middleware compressing the responses of an application
+    """
+
+    def __init__(self, wsgi_app, min_size=1024, level=6, mimetypes=(), encodings=("br", "gzip")):
+        """
+        :param wsgi_app: application to wrap
+        :param min_size: smallest body of known length that is compressed, in bytes
+        :param level: compression level, 1 to 9
+        :param mimetypes: compressible content types
+        :param encodings: encodings to offer, preferred first. br is left out when brotli is not
+        installed
+        """
+        self.wsgi_app = wsgi_app
+        self.min_size = min_size
+        self.level = level
+        self.mimetypes = frozenset(mimetypes)
+        self.brotli = _import_brotli() if "br" in encodings else None
+        self.encodings = [e for e in encodings if e == "gzip" or (e == "br" and self.brotli)]
+
+    def choose(self, accept_encoding):
+        """
+        Encoding to compress a response with
+        :param accept_encoding: Accept-Encoding header of the request
+        :return: br, gzip or None to send the response as it is
+        :rtype: str
+        """
+        accepted = parse_accept_header(accept_encoding)
+        encoding = accepted.best_match(self.encodings)
+        return encoding if encoding is not None and accepted[encoding] > 0 else None
+
+    def compressor(self, encoding):
+        return _BrotliStream(self.brotli, self.level) if encoding == "br" else _GzipStream(self.level)
+
+    def _compressible(self, status, headers):
+        code = int(status.split(None, 1)[0])
+        if code < 200 or code in (204, 206, 304):
+            return False
+        names = dict((name.lower(), value) for name, value in headers)
+        if "content-encoding" in names:
+            return False
+        return names.get("content-type", "").split(";")[0].strip() in self.mimetypes
+
+    def __call__(self, environ, start_response):
+        encoding = self.choose(environ.get("HTTP_ACCEPT_ENCODING", ""))
+        if encoding is None or environ["REQUEST_METHOD"] == "HEAD":
+            return self.wsgi_app(environ, start_response)
+
+        started = []
+
+        def deferred_start_response(status, headers, exc_info=None):
+            started[:] = [status, headers, exc_info]
+
+            def write(data):
+                raise RuntimeError("The write callable is not supported behind compression")
+            return write
+
+        body = self.wsgi_app(environ, deferred_start_response)
+        status, headers, exc_info = started
+        if not self._compressible(status, headers):
+            start_response(status, headers, exc_info)
+            return body
+
+        length = [value for name, value in headers if name.lower() == "content-length"]
+        headers = [(name, value) for name, value in headers
+                   if name.lower() not in ("content-length", "vary")] + [
+            ("Vary", self._vary(headers)), ("Content-Encoding", encoding)]
+        stream = self.compressor(encoding)
+
+        if not length:
+            start_response(status, headers, exc_info)
+            return _CompressedBody(body, stream)
+
+        try:
+            data = b"".join(body)
+        finally:
+            if hasattr(body, "close"):
+                body.close()
+        if len(data) < self.min_size:
+            headers = [(name, value) for name, value in headers if name != "Content-Encoding"]
+            start_response(status, headers + [("Content-Length", str(len(data)))], exc_info)
+            return [data]
+        data = stream.compress(data) + stream.finish()
+        start_response(status, headers + [("Content-Length", str(len(data)))], exc_info)
+        return [data]
+
+    @staticmethod
+    def _vary(headers):
+        values = [v.strip() for name, value in headers if name.lower() == "vary"
+                  for v in value.split(",") if v.strip()]
+        if "accept-encoding" not in [v.lower() for v in values]:
+            values.append("Accept-Encoding")
+        return ", ".join(values)
+
+
+class ContentNegotiation(object):
+    """
+    Negotiates the encoding of the responses of an application
+    """
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """
+        Registers MessagePack negotiation and wraps the application in the compression
+        middleware
+        :param app: current flask app
+        """
+        app.config.setdefault("RESPONSE_MSGPACK", True)
+        app.config.setdefault("COMPRESSION_ENABLED", True)
+        app.config.setdefault("COMPRESSION_MIN_SIZE", 1024)
+        app.config.setdefault("COMPRESSION_LEVEL", 6)
+        app.config.setdefault("COMPRESSION_ENCODINGS", ("br", "gzip"))
+        app.config.setdefault("COMPRESSION_MIMETYPES", ("application/json",) + MSGPACK_MIMETYPES + (
+            "text/html", "text/plain", "text/css", "application/javascript"))
+
+        msgpack = _import_msgpack() if app.config["RESPONSE_MSGPACK"] else None
+        app.extensions["msgpack"] = msgpack
+        if msgpack is not None:
+            app.after_request(self._negotiate)
+        if app.config["COMPRESSION_ENABLED"]:
+            app.wsgi_app = CompressionMiddleware(
+                app.wsgi_app, min_size=app.config["COMPRESSION_MIN_SIZE"],
+                level=app.config["COMPRESSION_LEVEL"], mimetypes=app.config["COMPRESSION_MIMETYPES"],
+                encodings=app.config["COMPRESSION_ENCODINGS"])
+
+    @staticmethod
+    def _negotiate(response):
+        if response.mimetype != "application/json" or response.is_streamed:
+            return response
+        response.vary.add("Accept")
+        mimetype = request.accept_mimetypes.best_match(("application/json",) + MSGPACK_MIMETYPES)
+        if mimetype not in MSGPACK_MIMETYPES:
+            return response
+
+        msgpack = current_app.extensions["msgpack"]
+        document = getattr(response, "document", None)
+        if document is None:
+            document = json.loads(response.get_data(as_text=True))
+        response.set_data(msgpack.packb(document, use_bin_type=True))
+        response.mimetype = mimetype
+        return response
+
+
+negotiation = ContentNegotiation()
@@ -20,3 +20,40 @@ class ValidationError(APIException):
     """ Raises exception when token is invalid """
     status_code = 406
     detail = 'Invalid Token'
+
+
+class InvalidCursor(APIException):
+    """ Raises a 400 status when a pagination cursor can not be decoded """
+    status_code = 400
+    detail = 'Invalid cursor. Use the next_cursor value returned with the previous page'
+
+
+class InvalidLimit(APIException):
+    """ Raises a 400 status when the limit argument asks for pages of no rows """
+    status_code = 400
+    detail = 'Invalid limit. Use a page size of at least 1'
+
+
+class InvalidFields(APIException):
+    """ Raises a 400 status when the fields argument names fields a resource does not have """
+    status_code = 400
+    detail = 'Invalid fields. Pass a comma separated list of field names'
+
+
+class RateLimitExceeded(APIException):
+    """ Raises a 429 status when a client has used up its rate limit """
+    status_code = 429
+    detail = 'Too many requests. Please try again later'
+
+    def __init__(self, retry_after, detail=None):
+        """
+        :param retry_after: seconds until the client may try again
+        """
+        APIException.__init__(self, detail)
+        self.retry_after = retry_after
+
+
+class HashingQueueFull(APIException):
+    """ Raises a 503 status when too many passwords are already waiting to be hashed """
+    status_code = 503
+    detail = 'The service is busy. Please try again shortly'
@@ -0,0 +1,121 @@
+"""
+Token authentication pipeline used by the auth_required decorator.
+The bearer token is validated and the user account and session it belongs to are resolved
+with a single query, tokens that were verified recently are served from the token cache
+without either. The result is attached to flask.g so the decorators and views further down the
+request can use it without querying for the user again
+"""
+import jwt
+from flask import request, current_app, g
+from flask_api.exceptions import AuthenticationFailed, PermissionDenied
+from flask_login import current_user
+
+from app import db
+from .models import UserAccount, Session
+from .token_cache import token_cache, token_digest
+
+
+def bearer_token():
+    """
+    Reads the token from the Authorization header of the current request
+    :raises: PermissionDenied if the header is missing
+    :return: the token without its Bearer scheme
+    :rtype: str
+    """
+    header = request.headers.get("Authorization")
+
+    if header is None:
+        raise PermissionDenied("You need to pass your token as a header")
+
+    scheme, _, token = header.partition(" ")
+    return token if scheme == "Bearer" else header
+
+
+def decode_token(token):
+    """
+    Verifies the signature and expiry of a JWT token
+    :param token: JWT token string
+    :raises: PermissionDenied if the token has expired, AuthenticationFailed if it is invalid
+    :return: the claims of the token
+    :rtype: dict
+    """
+    try:
+        return jwt.decode(token, current_app.config.get("SECRET_KEY"))
+    except jwt.ExpiredSignatureError:
+        raise PermissionDenied("Your token has expired! Please login again")
+    except jwt.InvalidTokenError:
+        raise AuthenticationFailed()
+
+
+def authenticate_request():
+    """
+    Authenticates the current request with its bearer token. Unless the token is in the token
+    cache, the session and the user account it belongs to are fetched together in one query on
+    the session token
+    :raises: AuthenticationFailed if there is no session for the token or the token was issued
+    for somebody else
+    :return: the authenticated user account
+    :rtype: UserAccount
+    """
+    token = bearer_token()
+    cached = token_cache.get(token)
+
+    if cached is not None:
+        user_account = _logged_in_user(cached.user_id) or UserAccount.query.get(cached.user_id)
+        session_id = cached.session_id
+        if user_account is None:
+            token_cache.invalidate(token)
+            raise AuthenticationFailed()
+    else:
+        user_account, session_id = _verify(token)
+
+    # a cookie session logged in as a different user can not borrow this token
+    if current_user.is_authenticated and current_user.id != user_account.id:
+        raise AuthenticationFailed()
+
+    g.auth_user = user_account
+    g.auth_session_id = session_id
+    return user_account
+
+
+def _verify(token):
+    """
+    Verifies a token that is not in the cache and caches the outcome
+    :param token: bearer token
+    :return: user account and session id of the token
+    :rtype: tuple
+    """
+    claims = decode_token(token)
+
+    row = db.session.query(UserAccount, Session.id) \
+        .join(Session, Session.user_id == UserAccount.id) \
+        .filter(Session.token_hash == token_digest(token)) \
+        .first()
+
+    if row is None:
+        raise AuthenticationFailed()
+
+    user_account, session_id = row
+    if user_account.username != claims.get("username"):
+        raise AuthenticationFailed()
+
+    token_cache.put(token, user_account.id, session_id, claims["exp"])
+    return user_account, session_id
+
+
+def _logged_in_user(user_id):
+    """
+    The flask login user if it is the given user, it has already been loaded for this request
+    """
+    if current_user.is_authenticated and current_user.id == user_id:
+        return current_user._get_current_object()
+    return None
+
+
+def authenticated_user():
+    """
+    User account resolved for the current request, falls back to the flask login user on routes
+    that are not token authenticated
+    :return: the current user account
+    """
+    return g.get("auth_user") or current_user
@@ -0,0 +1,204 @@
+"""
+Password hashing executor.
+Key stretching holds the GIL for the whole hash, so a burst of logins on the request threads
+starves the threads serving cheap reads. The hasher runs werkzeug's hashing in a pool of worker
+processes instead, the request thread only waits on the result. The number of hashes waiting
+for a worker is bounded, requests beyond that are turned away with a 503 rather than queueing
+up behind each other. A hash holds its slot until the worker finishes it, even when the request
+waiting on it timed out, so the bound holds for the work given to the pool as well. Hashes that
+time out or whose worker died are turned away with a 503 too
+"""
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, TimeoutError
+from concurrent.futures.process import BrokenProcessPool
+
+from flask import current_app, has_app_context
+from werkzeug.security import generate_password_hash, check_password_hash
+
+from app.exceptions.handler import HashingQueueFull
+
+
+class _HasherState(object):
+    """
+    Per application state of the hasher
+    """
+
+    def __init__(self, app):
+        self.method = app.config["PASSWORD_HASH_METHOD"]
+        self.salt_length = app.config["PASSWORD_HASH_SALT_LENGTH"]
+        self.workers = app.config["PASSWORD_HASH_WORKERS"]
+        self.max_pending = app.config["PASSWORD_HASH_MAX_PENDING"]
+        self.timeout = app.config["PASSWORD_HASH_TIMEOUT"]
+        self.slots = threading.BoundedSemaphore(self.max_pending)
+        self.lock = threading.Lock()
+        self.executor = None
+        self.pid = None
+        self.submitted = 0
+        self.completed = 0
+        self.failed = 0
+        self.rejected = 0
+        self.in_flight = 0
+        self.seconds = 0.0
+
+
+class PasswordHasher(object):
+    """
+    Hashes and verifies passwords, in worker processes when PASSWORD_HASH_WORKERS is more than 0
+    and on the calling thread otherwise
+    """
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """
+        Registers the hasher with the given application
+        :param app: current flask app
+        """
+        app.config.setdefault("PASSWORD_HASH_METHOD", "pbkdf2:sha256:150000")
+        app.config.setdefault("PASSWORD_HASH_SALT_LENGTH", 8)
+        app.config.setdefault("PASSWORD_HASH_WORKERS", 2)
+        app.config.setdefault("PASSWORD_HASH_MAX_PENDING", 64)
+        app.config.setdefault("PASSWORD_HASH_TIMEOUT", 10)
+        app.extensions["password_hasher"] = _HasherState(app)
+
+    @staticmethod
+    def _state():
+        if not has_app_context():
+            return None
+        return current_app.extensions.get("password_hasher")
+
+    def hash(self, password):
+        """
+        Hashes a password with the configured method and cost
+        :param password: plain text password
+        :raises: HashingQueueFull if too many hashes are already waiting for a worker
+        :return: password hash
+        :rtype: str
+        """
+        state = self._state()
+        if state is None:
+            return generate_password_hash(password)
+        return self._run(state, generate_password_hash, password, state.method, state.salt_length)
+
+    def verify(self, password_hash, password):
+        """
+        Checks a password against a hash
+        :param password_hash: stored password hash
+        :param password: plain text password to check
+        :raises: HashingQueueFull if too many hashes are already waiting for a worker
+        :return: True if the password matches
+        :rtype: bool
+        """
+        state = self._state()
+        if state is None:
+            return check_password_hash(password_hash, password)
+        return self._run(state, check_password_hash, password_hash, password)
+
+    def metrics(self):
+        """
+        Counters of the hasher of the current application
+        :return: submitted, completed, failed and rejected hashes, hashes in flight and total
+        seconds spent waiting on hashes
+        :rtype: dict
+        """
+        state = self._state()
+        with state.lock:
+            return dict(submitted=state.submitted, completed=state.completed, failed=state.failed,
+                        rejected=state.rejected, in_flight=state.in_flight,
+                        seconds=state.seconds, workers=state.workers,
+                        max_pending=state.max_pending)
+
+    def _run(self, state, func, *args):
+        if not state.slots.acquire(False):
+            with state.lock:
+                state.rejected += 1
+            raise HashingQueueFull()
+
+        with state.lock:
+            state.submitted += 1
+            state.in_flight += 1
+        started = time.time()
+        outcome = "failed"
+        try:
+            if state.workers <= 0:
+                try:
+                    result = func(*args)
+                finally:
+                    self._release(state)
+            else:
+                result = self._submit(state, func, *args)
+            outcome = "completed"
+            return result
+        finally:
+            with state.lock:
+                setattr(state, outcome, getattr(state, outcome) + 1)
+                state.seconds += time.time() - started
+
+    def _submit(self, state, func, *args):
+        """
+        Runs a hash in the pool. The slot is given back when the worker is done with the hash,
+        not when the request stops waiting on it
+        """
+        executor = self._executor(state)
+        try:
+            future = executor.submit(func, *args)
+        except BaseException as e:
+            self._release(state)
+            if isinstance(e, BrokenProcessPool):
+                self._discard(state, executor)
+                raise HashingQueueFull()
+            raise
+        future.add_done_callback(lambda _: self._release(state))
+        try:
+            return future.result(timeout=state.timeout)
+        except TimeoutError:
+            raise HashingQueueFull()
+        except BrokenProcessPool:
+            self._discard(state, executor)
+            raise HashingQueueFull()
+
+    @staticmethod
+    def _discard(state, executor):
+        """
+        Drops a pool whose worker died, the next hash starts a new one
+        """
+        with state.lock:
+            if state.executor is executor:
+                state.executor = None
+
+    @staticmethod
+    def _release(state):
+        state.slots.release()
+        with state.lock:
+            state.in_flight -= 1
+
+    @staticmethod
+    def _executor(state):
+        """
+        Process pool of the current process, created on first use so every worker process of
+        a pre forking server gets its own pool
+        """
+        if state.executor is not None and state.pid == os.getpid():
+            return state.executor
+        with state.lock:
+            if state.executor is None or state.pid != os.getpid():
+                state.executor = ProcessPoolExecutor(max_workers=state.workers)
+                state.pid = os.getpid()
+            return state.executor
+
+    def shutdown(self, app):
+        """
+        Stops the worker processes of the given application
+        :param app: flask app
+        """
+        state = app.extensions["password_hasher"]
+        if state.executor is not None and state.pid == os.getpid():
+            state.executor.shutdown(wait=True)
+            state.executor = None
+
+
+password_hasher = PasswordHasher()
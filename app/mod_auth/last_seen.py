@@ -0,0 +1,159 @@
+"""
+Write behind tracking of the users 'last seen' timestamps.
+Recording when a user was last seen used to cost a commit on every authenticated request.
+The tracker keeps the timestamps in memory instead, ignores repeat sightings of the same user
+within a configurable window and writes all the pending timestamps with a single bulk UPDATE
+from a background flusher
+"""
+import atexit
+import os
+import threading
+from datetime import datetime, timedelta
+
+from flask import current_app
+from sqlalchemy import bindparam
+
+from app import db, app_logger
+
+
+class _TrackerState(object):
+    """
+    Per application state of the tracker
+    :ivar recorded: user id to the last timestamp accepted for that user
+    :ivar pending: user id to the timestamp waiting to be written
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self.window = timedelta(seconds=app.config["LAST_SEEN_UPDATE_WINDOW"])
+        self.interval = app.config["LAST_SEEN_FLUSH_INTERVAL"]
+        self.lock = threading.Lock()
+        self.recorded = {}
+        self.pending = {}
+        self.flusher = None
+        self.stopped = threading.Event()
+        self.pid = None
+
+
+class LastSeenTracker(object):
+    """
+    Coalesces 'last seen' updates and writes them in bulk.
+    Setting LAST_SEEN_FLUSH_INTERVAL to 0 disables the background flusher and writes accepted
+    timestamps straight away, which is what the tests use
+    """
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """
+        Registers the tracker with the given application
+        :param app: current flask app
+        """
+        app.config.setdefault("LAST_SEEN_UPDATE_WINDOW", 60)
+        app.config.setdefault("LAST_SEEN_FLUSH_INTERVAL", 30)
+        state = _TrackerState(app)
+        app.extensions["last_seen"] = state
+
+        if state.interval > 0:
+            atexit.register(self._stop, state)
+
+    @staticmethod
+    def _state(app):
+        return app.extensions["last_seen"]
+
+    def touch(self, user_id, seen_at=None):
+        """
+        Records that a user has been seen. Sightings within the update window of the last
+        recorded one are dropped
+        :param user_id: id of the user account
+        :param seen_at: time the user was seen, defaults to now
+        :return: True if the sighting will be written, False if it was coalesced
+        :rtype: bool
+        """
+        app = current_app._get_current_object()
+        state = self._state(app)
+        seen_at = seen_at or datetime.now()
+
+        with state.lock:
+            last = state.recorded.get(user_id)
+            if last is not None and seen_at - last < state.window:
+                return False
+            state.recorded[user_id] = seen_at
+            state.pending[user_id] = seen_at
+
+        if state.interval > 0:
+            self._ensure_flusher(state)
+        else:
+            self.flush(app)
+        return True
+
+    def flush(self, app=None):
+        """
+        Writes all pending timestamps with one bulk UPDATE. Timestamps that could not be written
+        are put back so the next flush retries them
+        :param app: flask app to flush, defaults to the current app
+        :return: number of user accounts updated
+        :rtype: int
+        """
+        from .models import UserAccount
+
+        app = app or current_app._get_current_object()
+        state = self._state(app)
+        with state.lock:
+            pending, state.pending = state.pending, {}
+            # forget users that have not been seen for a whole window so the map stays bounded
+            horizon = datetime.now() - state.window
+            state.recorded = dict((k, v) for k, v in state.recorded.items() if v >= horizon)
+
+        if not pending:
+            return 0
+
+        table = UserAccount.__table__
+        statement = table.update().where(table.c.id == bindparam("user_id")).values(
+            last_seen=bindparam("seen_at"))
+        rows = [dict(user_id=user_id, seen_at=seen_at) for user_id, seen_at in pending.items()]
+
+        try:
+            with db.get_engine(app).begin() as connection:
+                connection.execute(statement, rows)
+        except Exception:
+            with state.lock:
+                for user_id, seen_at in pending.items():
+                    state.pending.setdefault(user_id, seen_at)
+            raise
+        return len(rows)
+
+    def _ensure_flusher(self, state):
+        """
+        Starts the background flusher for this process, a worker forked from a parent that had
+        already started it gets its own thread
+        """
+        if state.flusher is not None and state.pid == os.getpid():
+            return
+        with state.lock:
+            if state.flusher is not None and state.pid == os.getpid():
+                return
+            state.pid = os.getpid()
+            state.flusher = threading.Thread(target=self._run, args=(state,),
+                                             name="last-seen-flusher")
+            state.flusher.daemon = True
+            state.flusher.start()
+
+    def _run(self, state):
+        while not state.stopped.wait(state.interval):
+            self._safe_flush(state)
+
+    def _stop(self, state):
+        state.stopped.set()
+        self._safe_flush(state)
+
+    def _safe_flush(self, state):
+        try:
+            self.flush(state.app)
+        except Exception as e:
+            app_logger.exception("Failed to write last seen timestamps. Error => {}".format(e))
+
+
+last_seen = LastSeenTracker()
@@ -1,11 +1,13 @@
 from sqlalchemy import Column, String, Integer, DateTime, ForeignKey, Boolean
 from app.models import Base
+from app.serializers import Projection
 import uuid
-from werkzeug.security import generate_password_hash, check_password_hash
 from flask_login import UserMixin
 from .. import db, login_manager
+from .hashing import password_hasher
+from .token_cache import token_digest
 from datetime import datetime
-from sqlalchemy.orm import relationship
+from sqlalchemy.orm import relationship, validates
 import json
 from itsdangerous import TimedJSONWebSignatureSerializer as Serializer
 from flask import current_app
@@ -68,15 +70,7 @@ class UserProfile(Base):
         self.time_zone = user["time_zone"]
 
     def to_json(self):
-        return dict(
-            first_name=self.first_name,
-            last_name=self.last_name,
-            date_created=self.date_created,
-            date_modified=self.date_modified,
-            email=self.email,
-            accept_terms_of_service=self.accept_tos,
-            time_zone=self.time_zone,
-        )
+        return USER_PROFILE_JSON.as_dict(self)
 
     def __repr__(self):
         return "FirstName: {first_name}, LastName:{last_name}\n " \
@@ -133,14 +127,14 @@ class UserAccount(Base, UserMixin):
 
     @password.setter
     def password(self, password):
-        self.password_hash = generate_password_hash(password)
+        self.password_hash = password_hasher.hash(password)
 
     @password.getter
     def get_password(self):
         return self.password_hash
 
     def verify_password(self, password):
-        return check_password_hash(self.password_hash, password)
+        return password_hasher.verify(self.password_hash, password)
 
     def generate_reset_token(self, expiration=3600):
         """
@@ -181,14 +175,7 @@ class UserAccount(Base, UserMixin):
                     self.confirmed_on, self.last_seen)
 
     def to_json(self):
-        return dict(
-            id=self.id, uuid=self.uuid, username=self.username,
-            profile_id=self.user_profile_id, account_status_id=self.user_account_status_id,
-            email=self.email, date_created=self.date_created,
-            date_modified=self.date_modified, registerd_on=self.registered_on,
-            confimed=self.confirmed, confirmed_on=self.confirmed_on,
-            last_seen=self.last_seen
-        )
+        return USER_ACCOUNT_JSON.as_dict(self)
 
     def from_json(self, user_account):
         user = json.loads(user_account)
@@ -197,12 +184,40 @@ class UserAccount(Base, UserMixin):
         self.password_hash = user["password"]
 
 
+USER_PROFILE_JSON = Projection(UserProfile.first_name, UserProfile.last_name,
+                               UserProfile.date_created, UserProfile.date_modified,
+                               UserProfile.email, ("accept_terms_of_service", UserProfile.accept_tos),
+                               UserProfile.time_zone)
+# the misspelt field names are kept, clients read them
+USER_ACCOUNT_JSON = Projection(UserAccount.id, UserAccount.uuid, UserAccount.username,
+                               ("profile_id", UserAccount.user_profile_id),
+                               ("account_status_id", UserAccount.user_account_status_id),
+                               UserAccount.email, UserAccount.date_created, UserAccount.date_modified,
+                               ("registerd_on", UserAccount.registered_on),
+                               ("confimed", UserAccount.confirmed), UserAccount.confirmed_on,
+                               UserAccount.last_seen)
+
+
 class Session(Base):
-    """Maps to session table """
+    """
+    Maps to session table. Sessions are looked up by a digest of their token, which keeps the
+    unique index small whatever the length of the token
+    :cvar token_hash hex sha256 digest of the token, set whenever the token is set
+    """
 
     __tablename__ = 'sessions'
     user_id = db.Column(db.Integer)
     token = db.Column(db.String(256))
+    token_hash = db.Column(db.String(64), nullable=False)
+
+    __table_args__ = (
+        db.Index("ix_sessions_token_hash", "token_hash", unique=True),
+    )
+
+    @validates("token")
+    def _set_token_hash(self, key, token):
+        self.token_hash = token_digest(token)
+        return token
 
     def __repr__(self):
         return "Id:{} UserId: {}, Token:{}, dateCreated:{}".format(self.id, self.user_id,
@@ -6,27 +6,24 @@ The key here is the id. We are going to encode the user email (along with a time
 """
 from itsdangerous import URLSafeTimedSerializer
 from flask import current_app
-from app import mail
-from flask_mail import Message
+from app.outbox import outbox
 import hashlib
+import uuid
 from datetime import datetime, timedelta
 import jwt
 
 
 def send_mail(to, subject, template):
     """
-    Sends a confirmation tmail to the new registering user
+    Sends a confirmation tmail to the new registering user. The email is queued in the outbox
+    with the changes of the current request and sent by the outbox worker
     :param to: recipient of this email, the new registering user
     :param subject: The subject of the email
     :param template: The message body
+    :return: the queued message
     """
-    msg = Message(
-        subject=subject,
-        recipients=[to],
-        html=template,
-        sender=current_app.config.get("MAIL_DEFAULT_SENDER")
-    )
-    mail.send(msg)
+    return outbox.enqueue(to, subject, html=template,
+                          sender=current_app.config.get("MAIL_DEFAULT_SENDER"))
 
 
 def generate_confirmation_token(email):
@@ -68,6 +65,8 @@ def generate_auth_token(username, password):
 
     user = dict(username=username,password=hash_pass)
     user['exp'] = datetime.utcnow() + timedelta(minutes=60)
+    # unique token id, so two logins within the same second get different tokens and sessions
+    user['jti'] = uuid.uuid4().hex
     secret_key = current_app.config.get('SECRET_KEY')
     jwt_string = jwt.encode(user, secret_key)
     return jwt_string.decode("utf-8")
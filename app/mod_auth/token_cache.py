@@ -0,0 +1,133 @@
+"""
+In process cache of verified bearer tokens.
+Clients poll with the same token many times a minute, the cache maps a digest of the token to
+the user and session it was verified for so repeat requests skip the signature check and the
+session lookup. Entries live for AUTH_TOKEN_CACHE_TTL seconds at most and never outlive the
+expiry of the token itself. Logging out invalidates the token in the process that handled the
+logout, other worker processes stop accepting it once their entry expires
+"""
+import hashlib
+import threading
+import time
+from collections import OrderedDict, namedtuple
+
+from flask import current_app
+
+CachedToken = namedtuple("CachedToken", ["user_id", "session_id", "expires_at"])
+
+
+def token_digest(token):
+    """
+    Digest used to key tokens, so the raw tokens are not kept around in memory
+    :param token: bearer token
+    :return: hex sha256 digest of the token
+    :rtype: str
+    """
+    return hashlib.sha256(token.encode("utf-8")).hexdigest()
+
+
+class _LRUTokenStore(object):
+    """
+    Bounded least recently used store with per entry eviction times
+    """
+
+    def __init__(self, max_size, ttl):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, now):
+        with self.lock:
+            item = self.entries.get(key)
+            if item is None:
+                self.misses += 1
+                return None
+            evict_at, value = item
+            if evict_at <= now:
+                del self.entries[key]
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value, evict_at):
+        with self.lock:
+            self.entries[key] = (evict_at, value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+
+    def pop(self, key):
+        with self.lock:
+            self.entries.pop(key, None)
+
+
+class TokenCache(object):
+    """
+    Caches the outcome of token verification for the current application
+    """
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """
+        Registers the cache with the given application
+        :param app: current flask app
+        """
+        app.config.setdefault("AUTH_TOKEN_CACHE_SIZE", 1024)
+        app.config.setdefault("AUTH_TOKEN_CACHE_TTL", 60)
+        app.extensions["token_cache"] = _LRUTokenStore(app.config["AUTH_TOKEN_CACHE_SIZE"],
+                                                       app.config["AUTH_TOKEN_CACHE_TTL"])
+
+    @property
+    def store(self):
+        return current_app.extensions["token_cache"]
+
+    def get(self, token):
+        """
+        Looks up a verified token
+        :param token: bearer token
+        :return: the cached verification or None if the token has to be verified again
+        :rtype: CachedToken
+        """
+        return self.store.get(token_digest(token), time.time())
+
+    def put(self, token, user_id, session_id, expires_at):
+        """
+        Caches a verified token
+        :param token: bearer token
+        :param user_id: id of the user account the token belongs to
+        :param session_id: id of the login session of the token
+        :param expires_at: expiry of the token as a unix timestamp
+        """
+        store = self.store
+        if store.max_size <= 0:
+            return
+        evict_at = min(time.time() + store.ttl, expires_at)
+        store.put(token_digest(token), CachedToken(user_id, session_id, expires_at), evict_at)
+
+    def invalidate(self, token):
+        """
+        Drops a token from the cache, for instance after the user has logged out
+        :param token: bearer token
+        """
+        self.store.pop(token_digest(token))
+
+    def metrics(self):
+        """
+        Counters of the token cache of the current application
+        :return: lookups served from the cache, lookups that missed and cached tokens
+        :rtype: dict
+        """
+        store = self.store
+        with store.lock:
+            return dict(hits=store.hits, misses=store.misses, size=len(store.entries))
+
+
+token_cache = TokenCache()
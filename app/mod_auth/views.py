@@ -7,6 +7,8 @@ from app.exceptions.handler import UserAlreadyExists, CredentialsRequired
 from . import auth
 from .models import UserAccount, Session
 from .security_utils import generate_auth_token
+from .authentication import bearer_token
+from .token_cache import token_cache, token_digest
 
 
 @auth.route('/login/', methods=["POST", "GET"])
@@ -83,12 +85,15 @@ def logout():
     Logout route, handles logging out of users
     :return: JSOn response informing client about status of logging out from service
     """
-    token = request.headers.get("Authorization")
-    session = Session.query.filter_by(token=token[7:]).first()
     user_account = UserAccount.query.filter_by(id=current_user.id).first()
 
     if user_account:
-        # db.session.delete(session)
+        # the token stops working as soon as its session is gone
+        if request.headers.get("Authorization") is not None:
+            token = bearer_token()
+            token_cache.invalidate(token)
+            Session.query.filter_by(token_hash=token_digest(token)).delete()
+            db.session.commit()
         logout_user()
         return jsonify({
             "message": "You have logged out successfully"
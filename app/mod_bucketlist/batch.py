@@ -0,0 +1,173 @@
+"""
+Batch operations on the items of a bucket list.
+A batch is a list of create, update and delete operations that is validated as a whole and
+then applied in a single transaction, with one bulk statement per kind of operation instead
+of a statement and a commit per item
+"""
+from sqlalchemy.exc import IntegrityError
+
+from app import db, app_logger
+from .models import BucketListItem, Tombstone
+
+CREATE, UPDATE, DELETE = "create", "update", "delete"
+
+
+class BatchResult(object):
+    """
+    Outcome of a batch
+    :ivar status: HTTP status of the batch as a whole
+    :ivar message: summary of the outcome
+    :ivar results: outcome of every operation, in the order they were sent
+    """
+
+    def __init__(self, status, message, results):
+        self.status = status
+        self.message = message
+        self.results = results
+
+    def to_json(self):
+        return dict(message=self.message, results=self.results)
+
+
+def _as_bool(value):
+    """
+    Reads the done flag of an operation, which may be sent as a JSON boolean or as a string
+    """
+    if isinstance(value, bool):
+        return value
+    if value in ("True", "true", "1", 1):
+        return True
+    if value in ("False", "false", "0", 0):
+        return False
+    raise ValueError("done must be true or false")
+
+
+def _is_id(value):
+    """
+    Whether a JSON value is an item id. true and false are not, although bool is an int and
+    true equals 1
+    """
+    return type(value) is int
+
+
+def _validate(operations, existing_ids):
+    """
+    Validates every operation of a batch
+    :param operations: operations sent by the client
+    :param existing_ids: ids of the items of the bucket list that are targeted by the batch
+    :return: the normalized operations and the outcome of every operation, errors included
+    :rtype: tuple
+    """
+    normalized, results, seen = [], [], set()
+
+    for index, operation in enumerate(operations):
+        result = dict(index=index)
+        results.append(result)
+        try:
+            if not isinstance(operation, dict):
+                raise ValueError("operation must be an object")
+            op = operation.get("op")
+            result["op"] = op
+            values = {}
+
+            if op not in (CREATE, UPDATE, DELETE):
+                raise ValueError("op must be one of create, update or delete")
+
+            if op in (UPDATE, DELETE):
+                item_id = operation.get("id")
+                if not _is_id(item_id) or item_id not in existing_ids:
+                    raise ValueError("No such item in your bucketlist")
+                if item_id in seen:
+                    raise ValueError("An item can only be changed once per batch")
+                seen.add(item_id)
+                result["id"] = values["id"] = item_id
+
+            if op in (CREATE, UPDATE) and ("name" in operation or op == CREATE):
+                name = operation.get("name")
+                if not name or not isinstance(name, str):
+                    raise ValueError("name is required")
+                values["name"] = name
+
+            if op in (CREATE, UPDATE) and "done" in operation:
+                values["done"] = _as_bool(operation["done"])
+            elif op == CREATE:
+                values["done"] = False
+
+            if op == UPDATE and len(values) == 1:
+                raise ValueError("an update needs a name or done")
+
+            normalized.append((op, values, result))
+        except ValueError as e:
+            result["status"] = 400
+            result["error"] = str(e)
+
+    return normalized, results
+
+
+def apply_item_operations(bucketlist_id, operations, max_operations):
+    """
+    Validates a batch of item operations and applies it in a single transaction. Nothing is
+    applied if any operation is invalid or the batch violates a constraint
+    :param bucketlist_id: id of the bucket list the items belong to, ownership of the bucket list
+    has already been checked
+    :param operations: list of operations sent by the client
+    :param max_operations: largest number of operations allowed in one batch
+    :return: outcome of the batch
+    :rtype: BatchResult
+    """
+    if not isinstance(operations, list) or not operations:
+        return BatchResult(400, "Send a JSON array of operations", [])
+
+    if len(operations) > max_operations:
+        return BatchResult(400, "A batch can have at most {} operations".format(max_operations), [])
+
+    targeted = [o.get("id") for o in operations
+                if isinstance(o, dict) and _is_id(o.get("id"))]
+    existing_ids = set()
+    if targeted:
+        existing_ids = set(item_id for item_id, in db.session.query(BucketListItem.id).filter(
+            BucketListItem.bucketlist_id == bucketlist_id,
+            BucketListItem.id.in_(targeted)))
+
+    normalized, results = _validate(operations, existing_ids)
+    if len(normalized) != len(operations):
+        return BatchResult(400, "Batch was not applied, some operations are invalid", results)
+
+    creates = [dict(values, bucketlist_id=bucketlist_id) for op, values, _ in normalized if op == CREATE]
+    updates = [values for op, values, _ in normalized if op == UPDATE]
+    deletes = [values["id"] for op, values, _ in normalized if op == DELETE]
+
+    # deletes go first so their names are free for the updates and creates of the same batch
+    try:
+        if deletes:
+            BucketListItem.query.filter(BucketListItem.bucketlist_id == bucketlist_id,
+                                        BucketListItem.id.in_(deletes)) \
+                .delete(synchronize_session=False)
+            # bulk deletes skip the mapper events that record tombstones
+            Tombstone.record(db.session.connection(), Tombstone.ITEM, deletes, bucketlist_id)
+        if updates:
+            db.session.bulk_update_mappings(BucketListItem, updates)
+        if creates:
+            db.session.bulk_insert_mappings(BucketListItem, creates)
+
+        # item names are unique, which lets the ids of the new items be read back in one query
+        created_ids = {}
+        if creates:
+            created_ids = dict((name, item_id) for item_id, name in db.session.query(
+                BucketListItem.id, BucketListItem.name).filter(
+                BucketListItem.bucketlist_id == bucketlist_id,
+                BucketListItem.name.in_([values["name"] for values in creates])))
+        db.session.commit()
+    except IntegrityError as ie:
+        app_logger.error("Cannot apply bucket list item batch with error {}".format(ie))
+        db.session.rollback()
+        return BatchResult(409, "Batch was not applied, an item with that name already exists", [])
+
+    for op, values, result in normalized:
+        if op == CREATE:
+            result["id"] = created_ids.get(values["name"])
+            result["status"] = 201
+        else:
+            result["status"] = 200
+
+    return BatchResult(200, "Batch applied successfully", results)
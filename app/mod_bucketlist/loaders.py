@@ -0,0 +1,65 @@
+"""
+Request scoped loading of bucket lists and items.
+The ownership decorators and the views used to fetch the same bucket list and item rows
+separately. The loaders resolve each of them once per request and keep them on the request
+context, the decorators inject what they loaded into the view so the view does not fetch them
+again
+"""
+from flask import _request_ctx_stack
+
+from app import db
+from .models import BucketList, BucketListItem
+
+
+def _cache():
+    """
+    Rows loaded during the current request, keyed on their model and ids
+    :rtype: dict
+    """
+    ctx = _request_ctx_stack.top
+    cache = getattr(ctx, "bucketlist_resources", None)
+    if cache is None:
+        cache = ctx.bucketlist_resources = {}
+    return cache
+
+
+def load_bucketlist(bucket_list_id):
+    """
+    Loads a bucket list, at most once per request
+    :param bucket_list_id: id of the bucket list
+    :return: the bucket list or None if there is no such bucket list
+    :rtype: BucketList
+    """
+    cache = _cache()
+    key = (BucketList, int(bucket_list_id))
+    if key not in cache:
+        cache[key] = BucketList.query.get(key[1])
+    return cache[key]
+
+
+def load_item(bucket_list_id, item_id):
+    """
+    Loads an item of a bucket list, at most once per request. When the bucket list has not been
+    loaded yet it is fetched together with the item in one query
+    :param bucket_list_id: id of the bucket list the item has to belong to
+    :param item_id: id of the item
+    :return: the item or None if the bucket list has no such item
+    :rtype: BucketListItem
+    """
+    cache = _cache()
+    bucketlist_key = (BucketList, int(bucket_list_id))
+    key = (BucketListItem, bucketlist_key[1], int(item_id))
+
+    if key not in cache:
+        if bucketlist_key in cache:
+            cache[key] = BucketListItem.query.filter_by(id=key[2], bucketlist_id=key[1]).first()
+        else:
+            row = db.session.query(BucketListItem, BucketList) \
+                .join(BucketList, BucketList.id == BucketListItem.bucketlist_id) \
+                .filter(BucketListItem.id == key[2], BucketList.id == key[1]) \
+                .first()
+            cache[key] = row[0] if row else None
+            if row:
+                cache[bucketlist_key] = row[1]
+
+    return cache[key]
@@ -1,18 +1,26 @@
-from sqlalchemy import Column, String, Integer, ForeignKey, Boolean
+from sqlalchemy import Column, String, Integer, ForeignKey, Boolean, Index, event, select
 from app.models import Base
 from app.mod_auth.models import UserAccount
+from app.serializers import Projection
 from sqlalchemy.orm import relationship
+from datetime import datetime
 import json
 
 
 class BucketList(Base):
     """Maps to the bucketlists table """
     __tablename__ = 'bucketlists'
+    # serves listing a user's bucket lists in keyset order
+    __table_args__ = (
+        Index("ix_bucketlists_created_by_date_created_id", "created_by", "date_created", "id"),
+        # serves the changes of a user's bucket lists for delta sync
+        Index("ix_bucketlists_created_by_date_modified_id", "created_by", "date_modified", "id"),
+    )
     name = Column(String(256), nullable=False)
     created_by = Column(Integer, ForeignKey(UserAccount.id))
 
     user = relationship('UserAccount')
-    items = relationship('BucketListItem')
+    items = relationship('BucketListItem', lazy='dynamic')
 
     def __init__(self, created_by, name):
         """ Initialize with the creator and name of bucketlist """
@@ -28,13 +36,7 @@ class BucketList(Base):
         return "Id: {}, name: {}, created_by: {}".format(self.id, self.name, self.created_by)
 
     def to_json(self):
-        return dict(
-            id=self.id,
-            name=self.name,
-            created_by=self.created_by,
-            date_created=self.date_created,
-            date_modified=self.date_modified
-        )
+        return BUCKETLIST_JSON.as_dict(self)
 
     def from_json(self, bucket_list):
         bucketlist = json.loads(bucket_list)
@@ -45,6 +47,12 @@ class BucketList(Base):
 class BucketListItem(Base):
     """ Maps to BucketList table """
     __tablename__ = 'bucketlist_items'
+    # serves loading and paging the items of a bucket list
+    __table_args__ = (
+        Index("ix_bucketlist_items_bucketlist_id_id", "bucketlist_id", "id"),
+        # serves the item changes for delta sync
+        Index("ix_bucketlist_items_date_modified_id", "date_modified", "id"),
+    )
     name = Column(String(256), nullable=False, unique=True)
     done = Column(Boolean, default=False)
     bucketlist_id = Column(Integer, ForeignKey(BucketList.id))
@@ -69,14 +77,78 @@ class BucketListItem(Base):
                         done=self.done))
 
     def to_json(self):
-        return dict(
-            id=self.id,
-            bucketlist_id=self.bucketlist_id,
-            name=self.name,
-            done=self.done,
-        )
+        return ITEM_JSON.as_dict(self)
 
     def from_json(self, bucketlist_item):
         bucketlistitem = json.loads(bucketlist_item)
         self.bucketlist_id = bucketlistitem["id"]
         self.name = bucketlistitem["name"]
+
+
+BUCKETLIST_JSON = Projection(BucketList.id, BucketList.name, BucketList.created_by,
+                             BucketList.date_created, BucketList.date_modified)
+ITEM_JSON = Projection(BucketListItem.id, BucketListItem.bucketlist_id, BucketListItem.name,
+                       BucketListItem.done)
+
+
+class Tombstone(Base):
+    """
+    Record of a deleted bucket list or item, kept so that delta sync can tell clients about
+    deletes. date_created is the time of the delete
+    :cvar kind: bucketlist or item
+    :cvar object_id: id the deleted bucket list or item had
+    :cvar bucketlist_id: bucket list the deleted row belonged to, its own id for a bucket list
+    :cvar user_id: owner of the deleted row
+    """
+    __tablename__ = "tombstones"
+    __table_args__ = (
+        Index("ix_tombstones_user_id_date_created_id", "user_id", "date_created", "id"),
+    )
+    kind = Column(String(20), nullable=False)
+    object_id = Column(Integer, nullable=False)
+    bucketlist_id = Column(Integer, nullable=False)
+    user_id = Column(Integer, nullable=False)
+
+    BUCKETLIST, ITEM = "bucketlist", "item"
+
+    def __repr__(self):
+        return "Tombstone: {} {} of user {}".format(self.kind, self.object_id, self.user_id)
+
+    def to_json(self):
+        return dict(id=self.object_id, bucketlist_id=self.bucketlist_id, deleted=self.date_created)
+
+    def from_json(self, tombstone):
+        tombstone = json.loads(tombstone)
+        self.kind = tombstone["kind"]
+        self.object_id = tombstone["id"]
+
+    @staticmethod
+    def record(connection, kind, object_ids, bucketlist_id, user_id=None):
+        """
+        Writes the tombstones of deleted rows in the transaction that deletes them
+        :param connection: connection of the deleting transaction
+        :param kind: bucketlist or item
+        :param object_ids: ids of the deleted rows
+        :param bucketlist_id: bucket list the rows belong to
+        :param user_id: owner of the bucket list, read from the bucket list when not given
+        """
+        if not object_ids:
+            return
+        if user_id is None:
+            user_id = connection.scalar(select([BucketList.created_by])
+                                        .where(BucketList.id == bucketlist_id))
+        now = datetime.utcnow()
+        connection.execute(Tombstone.__table__.insert(), [
+            dict(kind=kind, object_id=object_id, bucketlist_id=bucketlist_id, user_id=user_id,
+                 date_created=now, date_modified=now)
+            for object_id in object_ids])
+
+
+@event.listens_for(BucketList, "after_delete")
+def _bucketlist_deleted(mapper, connection, target):
+    Tombstone.record(connection, Tombstone.BUCKETLIST, [target.id], target.id, target.created_by)
+
+
+@event.listens_for(BucketListItem, "after_delete")
+def _item_deleted(mapper, connection, target):
+    Tombstone.record(connection, Tombstone.ITEM, [target.id], target.bucketlist_id)
@@ -0,0 +1,107 @@
+"""
+Delta sync of a user's bucket lists and items.
+Changes come from three sources, bucket lists and items ordered by date_modified and tombstones
+of deleted rows ordered by the time of the delete. They are merged into one stream ordered by
+(time, source, id) and paged with a keyset on that key, which doubles as the sync token: a
+client keeps the token of its last page and later asks for what changed after it. Every source
+is read through an index on its time column, so a sync costs in proportion to the number of
+changes rather than to the size of the data.
+Timestamps are taken by the application before a transaction commits, so changes newer than a
+short settle time are held back until transactions that started before them have committed
+"""
+from datetime import datetime, timedelta
+
+from sqlalchemy import true
+
+from app.pagination import after_key
+from .models import BucketList, BucketListItem, Tombstone
+
+BUCKETLIST, ITEM, DELETED = "bucketlist", "item", "deleted"
+
+
+class Change(object):
+    """
+    A bucket list or item that was created, modified or deleted
+    :ivar source: bucketlist, item or deleted
+    :ivar kind: bucketlist or item
+    :ivar at: time of the change
+    """
+
+    def __init__(self, source, kind, id, at, data):
+        self.source = source
+        self.kind = kind
+        self.id = id
+        self.at = at
+        self.data = data
+
+    @property
+    def key(self):
+        return self.at, self.source, self.id
+
+    def to_json(self):
+        return dict(type=self.kind, op="delete" if self.source == DELETED else "upsert",
+                    modified=self.at, **self.data)
+
+
+def _after(time_column, id_column, source, since):
+    """
+    Condition selecting the rows of a source that come after a sync token
+    """
+    if since is None:
+        return true()
+    at, last_source, last_id = since
+    if source > last_source:
+        return time_column >= at
+    if source < last_source:
+        return time_column > at
+    return after_key((time_column, id_column), (at, last_id))
+
+
+def _changes(source, query, time_column, id_column, since, until, limit, to_change):
+    rows = query.filter(_after(time_column, id_column, source, since), time_column <= until) \
+        .order_by(time_column, id_column).limit(limit + 1)
+    return [to_change(row) for row in rows]
+
+
+def changes_since(user_id, since, limit, settle_seconds):
+    """
+    One page of the changes to a user's bucket lists and items
+    :param user_id: id of the user
+    :param since: decoded sync token, None for every change since the beginning
+    :param limit: largest number of changes to return, at least 1
+    :param settle_seconds: changes younger than this are left for a later sync
+    :raises: ValueError if the limit is less than 1
+    :return: the changes, the token to continue from and whether more changes are waiting
+    :rtype: tuple
+    """
+    # the token only moves past changes that were returned, a page that can hold none would
+    # move it past everything pending
+    if limit < 1:
+        raise ValueError("A page of changes holds at least one change, got a limit of {}".format(limit))
+    until = datetime.utcnow() - timedelta(seconds=settle_seconds)
+
+    bucketlists = _changes(
+        BUCKETLIST, BucketList.query.filter(BucketList.created_by == user_id),
+        BucketList.date_modified, BucketList.id, since, until, limit,
+        lambda b: Change(BUCKETLIST, BUCKETLIST, b.id, b.date_modified, b.to_json()))
+    items = _changes(
+        ITEM, BucketListItem.query.join(BucketList, BucketList.id == BucketListItem.bucketlist_id)
+        .filter(BucketList.created_by == user_id),
+        BucketListItem.date_modified, BucketListItem.id, since, until, limit,
+        lambda i: Change(ITEM, ITEM, i.id, i.date_modified, i.to_json()))
+    deleted = _changes(
+        DELETED, Tombstone.query.filter(Tombstone.user_id == user_id),
+        Tombstone.date_created, Tombstone.id, since, until, limit,
+        lambda t: Change(DELETED, t.kind, t.id, t.date_created, t.to_json()))
+
+    merged = sorted(bucketlists + items + deleted, key=lambda change: change.key)
+    page, has_more = merged[:limit], len(merged) > limit
+
+    if page:
+        next_key = page[-1].key
+    elif since is not None and since[0] > until:
+        next_key = since
+    else:
+        # nothing new, later changes are all newer than the settle time
+        next_key = (until, "", 0)
+    return page, next_key, has_more
@@ -1,30 +1,121 @@
-from flask import request, jsonify
+from datetime import datetime
+
+from flask import request, jsonify, Response, stream_with_context, current_app
 from flask_api.exceptions import NotFound
 from flask_login import login_required, current_user
 from sqlalchemy.exc import IntegrityError
-from .exceptions import NullBucketListException, NullReferenceException
+from .exceptions import NullReferenceException
 from app import db, app_logger
+from app.cache import response_cache
+from app.conditional import Validators
 from app.decorators.ownership import auth_required, owned_by_bucketlist, owned_by_user
+from app.pagination import parse_limit, decode_cursor, encode_cursor, keyset_page
+from app.search import search
+from app.serializers import dumps, json_response
 from . import bucketlist
-from .models import BucketList, BucketListItem
-import json
+from .batch import apply_item_operations
+from .models import BucketList, BucketListItem, BUCKETLIST_JSON, ITEM_JSON
+from .sync import changes_since
+
+# bucket lists are listed oldest first, the id breaks ties between lists created in the same instant
+BUCKETLIST_SORT_KEY = (BucketList.date_created, BucketList.id)
+ITEM_SORT_KEY = (BucketListItem.id,)
+
+# every successful write drops the cached list reads of the user who made it
+bucketlist.after_request(response_cache.invalidate_after_write)
+
+
+# delta sync moves a client's token up to a moment just before the request, changes a lagging
+# replica has not received by then would be skipped for good, so it always reads the primary
+PRIMARY_READS = ("bucketlist.bucketlist_changes",)
+
+
+@bucketlist.before_request
+def read_from_replica():
+    """
+    The GET handlers only read, their queries go to a read replica when there is one, except
+    for those that must see every committed change
+    """
+    if request.method in ("GET", "HEAD") and request.endpoint not in PRIMARY_READS:
+        db.use_replica()
+
+
+# number of items fetched from the database cursor and written to a streamed response at a time
+ITEM_STREAM_BATCH = 500
+
+
+def stream_items(bucketlist, message, projection=ITEM_JSON):
+    """
+    Generates the items of a bucket list as a JSON document, one batch of items at a time. Rows
+    are read from a server side cursor as plain column tuples, so memory use does not grow with
+    the size of the bucket list
+    :param bucketlist: bucket list whose items to stream
+    :param message: message of the response document
+    :param projection: fields of the items
+    :return: generator of JSON text chunks
+    """
+    rows = projection.query(db.session.query(BucketListItem)) \
+        .filter(BucketListItem.bucketlist_id == bucketlist.id) \
+        .order_by(*ITEM_SORT_KEY) \
+        .execution_options(stream_results=True) \
+        .yield_per(ITEM_STREAM_BATCH)
+
+    yield b'{"message":' + dumps(message) + b',"items":['
+    batch, separator = [], b""
+    for row in rows:
+        batch.append(projection.dump(row))
+        if len(batch) == ITEM_STREAM_BATCH:
+            # a batch is encoded as one array, its brackets are cut off to splice it in
+            yield separator + dumps(batch)[1:-1]
+            batch, separator = [], b","
+    if batch:
+        yield separator + dumps(batch)[1:-1]
+    yield b"]}"
 
 
 @bucketlist.route("", methods=["GET", "POST"])
 @login_required
 @auth_required
+@response_cache.cached
 def bucket_lists():
     """
-    Get bucket lists for the given user
+    Get bucket lists for the given user. Lists are paged either with the page argument or,
+    when a cursor argument is given, with the opaque next_cursor returned by the previous page.
+    The fields argument, such as fields=id,name, limits the fields of every bucket list
     :return: JSOn response with bucketlist items for authenticated users
     """
     user_id = current_user.id
-    result_data = None
 
     if request.method == "GET":
         results = BucketList.get_all(user_id)
-        limit = int(request.args.get("limit", 20))
+        limit = parse_limit(request.args)
         query = request.args.get("q")
+        cursor = request.args.get("cursor")
+        projection = BUCKETLIST_JSON.requested(keep=BUCKETLIST_SORT_KEY)
+
+        if query:
+            result_data = results.filter(search.bucketlist_filter(query))
+        else:
+            result_data = results
+
+        validators = Validators.for_query(result_data, BucketList)
+        if validators.is_fresh():
+            return validators.not_modified()
+
+        # an empty cursor asks for the first page in keyset mode, which never counts or skips
+        # rows, later pages are requested with the next_cursor of the previous page
+        if cursor is not None:
+            last_key = decode_cursor(cursor, datetime, int) if cursor else None
+            page_items, next_key = keyset_page(projection.query(result_data), BUCKETLIST_SORT_KEY,
+                                               limit, last_key)
+
+            if not page_items and last_key is None and not query:
+                return validators.apply(jsonify({"message": "User has no bucket list"}))
+
+            return validators.apply(json_response({
+                "message": projection.dump_all(page_items),
+                "next_cursor": encode_cursor(*next_key) if next_key else None
+            }))
 
         try:
             page = int(request.args.get("page", 1))
@@ -39,28 +130,15 @@ def bucket_lists():
         if not isinstance(limit, int):
             raise ValueError("Please specify an integer for the limit request argument")
 
-        # if the limit is a negative integer, we can convert it to positive
-        if limit < 0:
-            limit *= -1
-
         if page < 1:
             raise NotFound("Please specify a valid page")
 
-        if results.all():
-            result_data = results
-            limit = 100 if limit > 100 else limit
-            if query:
-                result_data = results.filter(BucketList.name.ilike("%{0}%".format(query)))
-
-            result_list = []
-            for item in result_data.paginate(page, limit, False).items:
-                if callable(getattr(item, "to_json")):
-                    result = item.to_json()
-                    result_list.append(result)
+        if db.session.query(results.exists()).scalar():
+            page_items = projection.query(result_data).order_by(*BUCKETLIST_SORT_KEY) \
+                .limit(limit).offset((page - 1) * limit)
+            return validators.apply(json_response({"message": projection.dump_all(page_items)}))
 
-            return jsonify({"message": result_list})
-
-        return jsonify({"message": "User has no bucket list"})
+        return validators.apply(jsonify({"message": "User has no bucket list"}))
 
     if request.method == "POST":
         name = request.values.get("name")
@@ -81,26 +159,73 @@ def bucket_lists():
     return jsonify({})
 
 
+@bucketlist.route("search", methods=["GET"])
+@login_required
+@auth_required
+@response_cache.cached
+def search_bucketlists():
+    """
+    Ranked search over the names of the user's bucket lists and bucket list items. Results are
+    paged with the limit and cursor arguments, best matches first
+    :return: JSON response with the matching bucket lists and items
+    :rtype: dict
+    """
+    query = request.args.get("q", "")
+    limit = parse_limit(request.args)
+    cursor = request.args.get("cursor")
+    last_key = decode_cursor(cursor, float, str, int) if cursor else None
+
+    results, next_key = search.search(current_user.id, query, limit, last_key)
+
+    return jsonify({
+        "message": [result.to_json() for result in results],
+        "next_cursor": encode_cursor(*next_key) if next_key else None
+    })
+
+
+@bucketlist.route("changes", methods=["GET"])
+@login_required
+@auth_required
+def bucketlist_changes():
+    """
+    Delta sync. Returns the bucket lists and items of the user that were created, modified or
+    deleted after the sync token in the since argument, oldest change first. Without a token every
+    bucket list and item is returned. Pass next_token as since to get the next page and, once
+    has_more is false, keep it for the next sync
+    :return: JSON response with the changes and the next sync token
+    :rtype: dict
+    """
+    limit = parse_limit(request.args)
+    token = request.args.get("since")
+    since = decode_cursor(token, datetime, str, int) if token else None
+
+    changes, next_key, has_more = changes_since(current_user.id, since, limit,
+                                                current_app.config.get("SYNC_SETTLE_SECONDS"))
+
+    return jsonify({
+        "changes": [change.to_json() for change in changes],
+        "next_token": encode_cursor(*next_key),
+        "has_more": has_more
+    })
+
+
 @bucketlist.route("<int:bucket_list_id>", methods=["GET", "PUT", "DELETE"])
 @login_required
 @auth_required
-def edit_bucketlist(bucket_list_id, **kwargs):
+@owned_by_user
+def edit_bucketlist(bucket_list_id, bucketlist, **kwargs):
     """
-    Route that gets, edits or deletes a given bucketlist with its id.
+    Route that gets, edits or deletes a given bucketlist with its id. A GET takes the fields
+    argument of the bucket list endpoint.
     :param bucket_list_id: id of the bucket list in question
+    :param bucketlist: the bucket list, loaded by owned_by_user
     :param kwargs: used when editing the given bucket list
     :return: either the bucket list if it is a GET request, Success message if deletion is
     successful or if editing has been successful
     :rtype: dict
     """
-    bucket_list = BucketList.query.get(bucket_list_id)
-
-    # if we can not get a bucket list, return an error message
-    if not bucket_list:
-        raise NullBucketListException()
-
     if request.method == "DELETE":
-        db.session.delete(bucket_list)
+        db.session.delete(bucketlist)
         db.session.commit()
         return jsonify({
             "message": "Bucketlist was deleted successfully"
@@ -108,44 +233,71 @@ def edit_bucketlist(bucket_list_id, **kwargs):
 
     if request.method == "PUT":
         name = request.values.get("name")
-        bucket_list.name = name
-        db.session.add(bucket_list)
+        bucketlist.name = name
+        db.session.add(bucketlist)
         db.session.commit()
 
         return jsonify({
             "message": "Bucketlist edited successfully!"
         }), 200
 
-    # else we return the bucket list item
-    return jsonify(**bucket_list.to_json()), 200
+    # else we return the bucket list item, unless the client already has it
+    projection = BUCKETLIST_JSON.requested()
+    validators = Validators.for_rows(bucketlist)
+    if validators.is_fresh():
+        return validators.not_modified()
+    return validators.apply(jsonify(**projection.as_dict(bucketlist))), 200
 
 
 @bucketlist.route("<int:bucket_list_id>/items", methods=["POST", "GET"])
 @login_required
 @auth_required
 @owned_by_user
-def create_or_get_bucketlist_items(bucket_list_id):
+@response_cache.cached
+def create_or_get_bucketlist_items(bucket_list_id, bucketlist):
     """
     Gets bucket list items for a particular bucket given its id. Handles POST and GET
      requests,
      POST requests will handle updating of a bucket list items and GET will handle the
-     retrieval of bucket list items
+     retrieval of bucket list items. Every item is returned unless the limit or cursor
+     argument is given, which pages the items, stream=1 returns every item in a single response
+     that is written as it is read and fields, such as fields=id,done, limits the fields of
+     every item
     :param bucket_list_id: id of the bucket list to retrieve
+    :param bucketlist: the bucket list, loaded by owned_by_user
     :return: Bucket list items as a JSON response
     :rtype: dict
     """
-    bucketlist = BucketList.query.get(bucket_list_id)
-
-    if bucketlist is None:
-        raise NullBucketListException()
-
-    bucket_list_items = bucketlist.items
-
     if request.method == "GET":
-        return jsonify({
-            "message": "{} bucket list items".format(bucketlist.name),
-            "items": [item.to_json() for item in bucket_list_items]
-        }), 200
+        projection = ITEM_JSON.requested(keep=ITEM_SORT_KEY)
+        validators = Validators.for_query(bucketlist.items, BucketListItem, bucketlist)
+        if validators.is_fresh():
+            return validators.not_modified()
+
+        message = "{} bucket list items".format(bucketlist.name)
+
+        if request.args.get("stream") == "1":
+            return validators.apply(Response(stream_with_context(stream_items(bucketlist, message, projection)),
+                                             mimetype="application/json"))
+
+        cursor = request.args.get("cursor")
+        # without limit or cursor every item is sent, as before the items were paged
+        if cursor is None and "limit" not in request.args:
+            rows = projection.query(bucketlist.items).order_by(*ITEM_SORT_KEY)
+            return validators.apply(json_response({
+                "message": message,
+                "items": projection.dump_all(rows)
+            })), 200
+
+        limit = parse_limit(request.args)
+        last_key = decode_cursor(cursor, int) if cursor else None
+        page_items, next_key = keyset_page(projection.query(bucketlist.items), ITEM_SORT_KEY, limit, last_key)
+
+        return validators.apply(json_response({
+            "message": message,
+            "items": projection.dump_all(page_items),
+            "next_cursor": encode_cursor(*next_key) if next_key else None
+        })), 200
 
     if request.method == "POST":
         name = request.values.get("name")
@@ -159,12 +311,33 @@ def create_or_get_bucketlist_items(bucket_list_id):
         }), 201
 
 
+@bucketlist.route("<int:bucket_list_id>/items/batch", methods=["POST"])
+@login_required
+@auth_required
+@owned_by_user
+def batch_bucketlist_items(bucket_list_id, bucketlist):
+    """
+    Creates, updates and deletes many items of a bucket list at once. The request body is a JSON
+    array of operations such as {"op": "create", "name": "Buy a car"},
+    {"op": "update", "id": 1, "done": true} or {"op": "delete", "id": 2}. The whole batch is
+    applied in one transaction, or not at all if any operation is invalid
+    :param bucket_list_id: id of the bucket list whose items to change
+    :param bucketlist: the bucket list, loaded by owned_by_user
+    :return: outcome of every operation
+    :rtype: dict
+    """
+    operations = request.get_json(silent=True)
+    result = apply_item_operations(bucket_list_id, operations,
+                                   current_app.config.get("ITEM_BATCH_MAX_OPERATIONS"))
+    return jsonify(result.to_json()), result.status
+
+
 @bucketlist.route("<int:bucket_list_id>/items/<int:item_id>", methods=["GET", "PUT",
                                                                        "DELETE"])
 @login_required
 @owned_by_user
 @owned_by_bucketlist
-def get_modify_bucket_list_item(bucket_list_id, item_id, **kwargs):
+def get_modify_bucket_list_item(bucket_list_id, item_id, bucketlist, item):
     """
     Route handling modification of a bucketlist item for a given bucket list
     Has decorators that ensure only logged in uses can access this route, that only users
@@ -172,26 +345,31 @@ def get_modify_bucket_list_item(bucket_list_id, item_id, **kwargs):
     bucketlist.
     :param bucket_list_id: Bucketlist id
     :param item_id: Item id for a given bucket list item
+    :param bucketlist: the bucket list, loaded by owned_by_user
+    :param item: the bucket list item, loaded by owned_by_bucketlist
     :return: Response for operation
     :rtype: dict
     """
-    bucket_list_item = BucketListItem.query.get(int(item_id))
-    bucketlist = BucketList.query.get(bucket_list_id)
+    bucket_list_item = item
 
     if bucket_list_item is None:
         raise NullReferenceException()
 
     if request.method == "GET":
-        return jsonify({
+        # fields applies to the item, the bucket list is always sent whole
+        projection = ITEM_JSON.requested()
+        validators = Validators.for_rows(bucketlist, bucket_list_item)
+        if validators.is_fresh():
+            return validators.not_modified()
+        return validators.apply(jsonify({
             "bucketlist": bucketlist.to_json(),
-            "bucketlist_item": bucket_list_item.to_json()
-        })
+            "bucketlist_item": projection.as_dict(bucket_list_item)
+        }))
 
     # editing a given bucket list item
     if request.method == "PUT":
-        name = request.values.get("name")
         done = request.values.get("done")
-        bucket_list_item.done = done
+        bucket_list_item.done = done in ("True", "true", "1")
 
         db.session.add(bucket_list_item)
         db.session.commit()
@@ -1,6 +1,7 @@
 from abc import ABCMeta, abstractmethod
+from datetime import datetime
 
-from sqlalchemy import Column, Integer, DateTime, func
+from sqlalchemy import Column, Integer, DateTime
 from app.utils import makecls
 from . import db
 
@@ -12,8 +13,10 @@ class Base(db.Model):
     __metaclass__ = makecls(ABCMeta)
     __abstract__ = True
     id = Column(Integer, primary_key=True, autoincrement=True)
-    date_created = Column(DateTime, default=func.current_timestamp())
-    date_modified = Column(DateTime, default=func.current_timestamp(), onupdate=func.current_timestamp())
+    # timestamps are set by the application rather than the database so they are stored with the
+    # same precision and format on every backend, which keeps them usable as pagination keys
+    date_created = Column(DateTime, default=datetime.utcnow)
+    date_modified = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
 
     @abstractmethod
     def __repr__(self):
@@ -0,0 +1,298 @@
+"""
+Outbox of the emails the application sends.
+Sending an email inside a request holds the request for as long as the SMTP server takes to
+answer, up to its timeout when the server stalls. Emails are written to the mail_outbox table
+instead, in the transaction of the request, and a worker sends them in batches over one SMTP
+connection per batch. A failed attempt is retried with an exponentially growing delay, and a
+message that is refused outright or has used up its attempts is kept as a dead letter with its
+last error.
+Workers claim a batch by stamping it with their token and a lease, so several workers can
+share the outbox. A message is sent at least once, one whose worker died after the server
+accepted it is sent again when the lease runs out
+"""
+import json
+import os
+import smtplib
+import threading
+import uuid
+from datetime import datetime, timedelta
+
+from flask import current_app
+from flask_mail import Message
+from sqlalchemy import and_, bindparam, select
+
+from app import db, mail, app_logger
+from .models import OutboxMessage
+
+
+class _OutboxState(object):
+    """
+    Per application state of the outbox
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self.batch_size = app.config["MAIL_OUTBOX_BATCH_SIZE"]
+        self.max_attempts = app.config["MAIL_OUTBOX_MAX_ATTEMPTS"]
+        self.retry_delay = app.config["MAIL_OUTBOX_RETRY_DELAY"]
+        self.max_retry_delay = app.config["MAIL_OUTBOX_MAX_RETRY_DELAY"]
+        self.lease = timedelta(seconds=app.config["MAIL_OUTBOX_LEASE"])
+        self.interval = app.config["MAIL_OUTBOX_POLL_INTERVAL"]
+        self.lock = threading.Lock()
+        self.worker = None
+        self.stopped = threading.Event()
+        self.pid = None
+        self.batches = 0
+        self.sent = 0
+        self.retried = 0
+        self.dead = 0
+
+
+def _connection_lost(error):
+    """
+    Checks whether an error means the SMTP connection can not be used any more, as opposed to
+    the server turning down a single message
+    """
+    if isinstance(error, smtplib.SMTPServerDisconnected):
+        return True
+    return isinstance(error, OSError) and not isinstance(error, smtplib.SMTPException)
+
+
+def _permanent(error):
+    """
+    Checks whether an error will happen again however often the message is retried, a 5xx
+    answer of the server or a message that can not be built
+    """
+    if isinstance(error, smtplib.SMTPRecipientsRefused):
+        return all(code >= 500 for code, _ in error.recipients.values())
+    if isinstance(error, smtplib.SMTPResponseException):
+        return error.smtp_code >= 500
+    return not isinstance(error, OSError)
+
+
+class MailOutbox(object):
+    """
+    Queues emails in the database and sends them from a worker. With MAIL_OUTBOX_POLL_INTERVAL
+    above 0 every application process runs a worker thread, started on its first enqueued
+    email. Setting it to 0 leaves sending to manage.py mail_worker or to calls of send_batch
+    """
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """
+        Registers the outbox with the given application
+        :param app: current flask app
+        """
+        app.config.setdefault("MAIL_OUTBOX_BATCH_SIZE", 50)
+        app.config.setdefault("MAIL_OUTBOX_MAX_ATTEMPTS", 8)
+        app.config.setdefault("MAIL_OUTBOX_RETRY_DELAY", 30)
+        app.config.setdefault("MAIL_OUTBOX_MAX_RETRY_DELAY", 3600)
+        app.config.setdefault("MAIL_OUTBOX_LEASE", 300)
+        app.config.setdefault("MAIL_OUTBOX_POLL_INTERVAL", 5)
+        app.extensions["mail_outbox"] = _OutboxState(app)
+
+    @staticmethod
+    def _state(app=None):
+        return (app or current_app).extensions["mail_outbox"]
+
+    def enqueue(self, recipients, subject, body=None, html=None, sender=None):
+        """
+        Queues an email. It is added to the session of the request and written with the rest
+        of the request's changes, an email of a request that fails is never sent
+        :param recipients: address or list of addresses
+        :param subject: subject of the email
+        :param body: plain text body
+        :param html: html body
+        :param sender: sender address, MAIL_DEFAULT_SENDER if not given
+        :return: the queued message
+        :rtype: OutboxMessage
+        """
+        if isinstance(recipients, str):
+            recipients = [recipients]
+        message = OutboxMessage(recipients=json.dumps(list(recipients)), sender=sender,
+                                subject=subject, body=body, html=html,
+                                status=OutboxMessage.PENDING, attempts=0,
+                                next_attempt_at=datetime.utcnow())
+        db.session.add(message)
+
+        state = self._state()
+        if state.interval > 0:
+            self._ensure_worker(state)
+        return message
+
+    def retry_delay(self, attempts, app=None):
+        """
+        Time to wait before the next attempt, doubling with every failed one
+        :param attempts: number of failed attempts so far
+        :param app: flask app, defaults to the current app
+        :return: delay in seconds
+        :rtype: float
+        """
+        state = self._state(app)
+        return min(state.retry_delay * 2 ** (attempts - 1), state.max_retry_delay)
+
+    def _claim(self, state, connection, now):
+        """
+        Claims the messages that are due, the oldest first, by stamping them with a new token
+        :return: the token and the claimed rows
+        :rtype: tuple
+        """
+        table = OutboxMessage.__table__
+        due = and_(table.c.status.in_([OutboxMessage.PENDING, OutboxMessage.SENDING]),
+                   table.c.next_attempt_at <= now)
+        batch = select([table.c.id]).where(due).order_by(table.c.next_attempt_at, table.c.id) \
+            .limit(state.batch_size)
+        token = uuid.uuid4().hex
+        # the condition is repeated so a message claimed by another worker meanwhile is left alone
+        connection.execute(table.update().where(and_(table.c.id.in_(batch), due)).values(
+            status=OutboxMessage.SENDING, claimed_by=token, next_attempt_at=now + state.lease))
+        rows = connection.execute(select([table]).where(table.c.claimed_by == token)
+                                  .order_by(table.c.id)).fetchall()
+        return token, rows
+
+    def send_batch(self, app=None):
+        """
+        Sends one batch of the messages that are due over a single SMTP connection and records
+        the outcome of every message
+        :param app: flask app, defaults to the current app
+        :return: number of messages in the batch
+        :rtype: int
+        """
+        app = app or current_app._get_current_object()
+        state = self._state(app)
+        engine = db.get_engine(app)
+
+        with engine.begin() as connection:
+            token, rows = self._claim(state, connection, datetime.utcnow())
+        if not rows:
+            return 0
+
+        sent, failed = [], []
+        with app.app_context():
+            try:
+                with mail.connect() as smtp:
+                    for row in rows:
+                        try:
+                            smtp.send(Message(subject=row.subject,
+                                              recipients=json.loads(row.recipients),
+                                              body=row.body, html=row.html, sender=row.sender))
+                        except Exception as e:
+                            if _connection_lost(e):
+                                raise
+                            failed.append((row, e))
+                        else:
+                            sent.append(row.id)
+            except Exception as e:
+                # no connection or a connection lost half way, the rest of the batch is retried
+                handled = set(sent) | set(row.id for row, _ in failed)
+                failed.extend((row, e) for row in rows if row.id not in handled)
+
+        self._record(state, engine, token, sent, failed)
+        return len(rows)
+
+    def _record(self, state, engine, token, sent, failed):
+        """
+        Deletes the messages that were sent and schedules the failed ones for another attempt
+        or turns them into dead letters
+        """
+        table = OutboxMessage.__table__
+        now = datetime.utcnow()
+        updates, dead = [], 0
+        for row, error in failed:
+            attempts = row.attempts + 1
+            if _permanent(error) or attempts >= state.max_attempts:
+                dead += 1
+                status, due = OutboxMessage.DEAD, now
+                app_logger.error("Giving up on email {} to {} after {} attempts. Error => {}".format(
+                    row.id, row.recipients, attempts, error))
+            else:
+                status = OutboxMessage.PENDING
+                due = now + timedelta(seconds=self.retry_delay(attempts, state.app))
+            updates.append(dict(message_id=row.id, new_status=status, new_attempts=attempts,
+                                due=due, error="{}: {}".format(type(error).__name__, error)))
+
+        with engine.begin() as connection:
+            if sent:
+                connection.execute(table.delete().where(
+                    and_(table.c.id.in_(sent), table.c.claimed_by == token)))
+            if updates:
+                connection.execute(
+                    table.update().where(and_(table.c.id == bindparam("message_id"),
+                                              table.c.claimed_by == token))
+                    .values(status=bindparam("new_status"), attempts=bindparam("new_attempts"),
+                            next_attempt_at=bindparam("due"), last_error=bindparam("error"),
+                            claimed_by=None),
+                    updates)
+
+        with state.lock:
+            state.batches += 1
+            state.sent += len(sent)
+            state.retried += len(updates) - dead
+            state.dead += dead
+
+    def requeue(self, app=None):
+        """
+        Gives the dead letters a new set of attempts
+        :param app: flask app, defaults to the current app
+        :return: number of messages queued again
+        :rtype: int
+        """
+        app = app or current_app._get_current_object()
+        table = OutboxMessage.__table__
+        with db.get_engine(app).begin() as connection:
+            return connection.execute(table.update().where(table.c.status == OutboxMessage.DEAD).values(
+                status=OutboxMessage.PENDING, attempts=0, next_attempt_at=datetime.utcnow(),
+                claimed_by=None)).rowcount
+
+    def metrics(self):
+        """
+        Counters of the outbox of the current application
+        :return: batches sent, messages sent, retried and turned into dead letters
+        :rtype: dict
+        """
+        state = self._state()
+        with state.lock:
+            return dict(batches=state.batches, sent=state.sent, retried=state.retried,
+                        dead=state.dead)
+
+    def work(self, app, interval, stopped=None):
+        """
+        Sends the messages that are due until stopped, waiting interval seconds whenever the
+        outbox has been drained
+        :param app: flask app
+        :param interval: seconds between polls of the outbox
+        :param stopped: event that ends the loop, runs forever if not given
+        """
+        stopped = stopped or threading.Event()
+        state = self._state(app)
+        while True:
+            try:
+                while self.send_batch(app) == state.batch_size:
+                    pass
+            except Exception as e:
+                app_logger.exception("Failed to send the outbox. Error => {}".format(e))
+            if stopped.wait(interval):
+                return
+
+    def _ensure_worker(self, state):
+        """
+        Starts the worker thread of this process, a worker forked from a parent that had
+        already started it gets its own thread
+        """
+        if state.worker is not None and state.pid == os.getpid():
+            return
+        with state.lock:
+            if state.worker is not None and state.pid == os.getpid():
+                return
+            state.pid = os.getpid()
+            state.worker = threading.Thread(target=self.work,
+                                            args=(state.app, state.interval, state.stopped),
+                                            name="mail-outbox-worker")
+            state.worker.daemon = True
+            state.worker.start()
+
+
+outbox = MailOutbox()
@@ -0,0 +1,53 @@
+from sqlalchemy import Column, String, Integer, Text, DateTime, Index
+from app.models import Base
+import json
+
+
+class OutboxMessage(Base):
+    """
+    Email waiting in the outbox to be sent by the outbox worker
+    :cvar recipients: JSON list of the recipients' addresses
+    :cvar sender: sender address, the default sender of the mail settings when empty
+    :cvar status: pending until it is sent, sending while a worker holds it and dead once it
+    has failed for good. Sent messages are deleted
+    :cvar attempts: number of times sending it has failed
+    :cvar next_attempt_at: time it is due, for a message being sent the time its worker's lease
+    runs out and another worker may pick it up again
+    :cvar claimed_by: token of the worker holding it
+    :cvar last_error: error of the last failed attempt
+    """
+    __tablename__ = "mail_outbox"
+    # serves the worker picking the messages that are due
+    __table_args__ = (
+        Index("ix_mail_outbox_status_next_attempt_at", "status", "next_attempt_at"),
+    )
+    recipients = Column(Text, nullable=False)
+    sender = Column(String(250))
+    subject = Column(String(500), nullable=False)
+    body = Column(Text)
+    html = Column(Text)
+    status = Column(String(20), nullable=False)
+    attempts = Column(Integer, nullable=False, default=0)
+    next_attempt_at = Column(DateTime, nullable=False)
+    claimed_by = Column(String(32))
+    last_error = Column(Text)
+
+    PENDING, SENDING, DEAD = "pending", "sending", "dead"
+
+    def __repr__(self):
+        return "OutboxMessage: {} to {} [{}, attempts: {}]".format(self.subject, self.recipients,
+                                                                   self.status, self.attempts)
+
+    def to_json(self):
+        return dict(id=self.id, recipients=json.loads(self.recipients), sender=self.sender,
+                    subject=self.subject, status=self.status, attempts=self.attempts,
+                    next_attempt_at=self.next_attempt_at, last_error=self.last_error,
+                    date_created=self.date_created)
+
+    def from_json(self, message):
+        message = json.loads(message)
+        self.recipients = json.dumps(message["recipients"])
+        self.sender = message.get("sender")
+        self.subject = message["subject"]
+        self.body = message.get("body")
+        self.html = message.get("html")
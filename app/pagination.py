@@ -0,0 +1,109 @@
+"""
+Keyset (cursor) pagination helpers shared by the list endpoints.
+A cursor is an opaque, url safe token that encodes the sort key of the last row a client has
+seen. The next page is fetched with a range condition on that key, which lets the database
+walk an index instead of counting rows or skipping over them with OFFSET
+"""
+import base64
+import json
+from datetime import datetime
+
+from sqlalchemy import and_, or_
+
+from app.exceptions.handler import InvalidCursor, InvalidLimit
+
+DEFAULT_PAGE_LIMIT = 20
+MAX_PAGE_LIMIT = 100
+
+_DATETIME_FORMAT = "%Y-%m-%dT%H:%M:%S.%f"
+
+
+def parse_limit(args, default=DEFAULT_PAGE_LIMIT, maximum=MAX_PAGE_LIMIT):
+    """
+    Reads the limit request argument, negative limits are converted to positive ones and the
+    limit is capped at the given maximum
+    :param args: request arguments
+    :param default: limit to use when none is given
+    :param maximum: largest page size a client may request
+    :raises: ValueError if the limit is not an integer
+    :raises: InvalidLimit if the limit is 0
+    :return: page size
+    :rtype: int
+    """
+    limit = int(args.get("limit", default))
+    if limit < 0:
+        limit *= -1
+    if limit == 0:
+        raise InvalidLimit()
+    return maximum if limit > maximum else limit
+
+
+def encode_cursor(*values):
+    """
+    Encodes sort key values into an opaque cursor token
+    :param values: sort key values of the last row in a page, datetimes and integers
+    :return: url safe cursor
+    :rtype: str
+    """
+    key = [v.strftime(_DATETIME_FORMAT) if isinstance(v, datetime) else v for v in values]
+    token = base64.urlsafe_b64encode(json.dumps(key, separators=(",", ":")).encode("utf-8"))
+    return token.decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor, *types):
+    """
+    Decodes a cursor created by encode_cursor
+    :param cursor: cursor token sent by the client
+    :param types: expected type of every value in the cursor, either datetime or int
+    :raises: InvalidCursor if the cursor was tampered with or was not issued for this key
+    :return: tuple of sort key values
+    :rtype: tuple
+    """
+    try:
+        padding = "=" * (-len(cursor) % 4)
+        key = json.loads(base64.urlsafe_b64decode((cursor + padding).encode("ascii")).decode("utf-8"))
+        if not isinstance(key, list) or len(key) != len(types):
+            raise ValueError("Cursor has the wrong number of values")
+        return tuple(datetime.strptime(v, _DATETIME_FORMAT) if t is datetime else t(v)
+                     for v, t in zip(key, types))
+    except (TypeError, ValueError, UnicodeError):
+        raise InvalidCursor()
+
+
+def after_key(columns, values):
+    """
+    Builds the range condition selecting rows that sort after the given key. This is the
+    expanded form of (a, b) > (x, y) which every backend can match against a composite index
+    :param columns: columns making up the sort key, most significant first
+    :param values: sort key values of the last row already seen
+    :return: SQL expression
+    """
+    column, value = columns[0], values[0]
+    if len(columns) == 1:
+        return column > value
+    return or_(column > value, and_(column == value, after_key(columns[1:], values[1:])))
+
+
+def keyset_page(query, columns, limit, cursor=None):
+    """
+    Fetches a single page of a query ordered by the given key columns
+    :param query: query to page through
+    :param columns: unique sort key, most significant column first
+    :param limit: page size, at least 1
+    :param cursor: decoded cursor values of the last row of the previous page
+    :raises: ValueError if the limit is less than 1
+    :return: rows of this page and the key values of the last row if there is a next page
+    :rtype: tuple
+    """
+    if limit < 1:
+        raise ValueError("A page holds at least one row, got a limit of {}".format(limit))
+    if cursor is not None:
+        query = query.filter(after_key(columns, cursor))
+    rows = query.order_by(*columns).limit(limit + 1).all()
+
+    if len(rows) <= limit:
+        return rows, None
+
+    rows = rows[:limit]
+    last = rows[-1]
+    return rows, tuple(getattr(last, column.key) for column in columns)
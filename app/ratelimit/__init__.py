@@ -0,0 +1,186 @@
+"""
+Token bucket rate limiting of the writes of the app.
+RATELIMIT_LIMITS maps an endpoint, such as auth.login, or a whole blueprint, such as bucketlist,
+to its limits, each written as "<count>/<second|minute|hour|day> per <ip|user>". A limit is a
+token bucket of count tokens refilled over the period, so a client may make count requests at
+once and then one every period / count. An ip limit counts the requests of an address. A user
+limit counts the requests of the logged in user, or those naming the same username while logging
+in, so guessing the password of one account is slowed down whatever the number of addresses.
+Only writes are limited, the reads are cheap and cached. A request over a limit gets a 429 with
+a Retry-After header. RATELIMIT_BACKEND picks memory, buckets in each process, or redis, shared by
+all processes. Leaving it empty turns the limiter off
+"""
+import math
+import threading
+from collections import namedtuple
+
+from flask import current_app, jsonify, request
+from flask_login import current_user
+
+from app import app_logger
+from app.exceptions.handler import RateLimitExceeded
+from .backends import MemoryBackend, RedisBackend
+
+WRITE_METHODS = ("POST", "PUT", "PATCH", "DELETE")
+PERIODS = dict(second=1, minute=60, hour=3600, day=86400)
+SCOPES = ("ip", "user")
+
+
+class Limit(namedtuple("Limit", "target count period scope")):
+    """
+    A limit of an endpoint or blueprint
+    :ivar target: endpoint or blueprint the limit applies to
+    :ivar count: requests allowed per period, also the burst allowed
+    :ivar period: length of the period in seconds
+    :ivar scope: ip or user
+    """
+
+    @property
+    def rate(self):
+        return self.count / self.period
+
+
+def parse_limit(target, text):
+    """
+    Reads a limit such as 10/minute per ip
+    :param target: endpoint or blueprint the limit applies to
+    :param text: the limit
+    :raises: ValueError if the limit can not be read
+    :rtype: Limit
+    """
+    try:
+        rate, per, scope = text.split()
+        count, period = rate.split("/")
+        limit = Limit(target, int(count), PERIODS[period], scope)
+    except (KeyError, ValueError):
+        raise ValueError("Can not read the rate limit {!r} of {}, write it as "
+                         "<count>/<second|minute|hour|day> per <ip|user>".format(text, target))
+    if per != "per" or scope not in SCOPES or limit.count < 1:
+        raise ValueError("Can not read the rate limit {!r} of {}".format(text, target))
+    return limit
+
+
+class _LimiterState(object):
+    """
+    Per application state of the rate limiter
+    :ivar limits: endpoint or blueprint to its limits
+    """
+
+    def __init__(self, backend, limits):
+        self.backend = backend
+        self.limits = limits
+        self.lock = threading.Lock()
+        self.allowed = 0
+        self.limited = 0
+        self.errors = 0
+
+    def count(self, counter):
+        with self.lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+
+class RateLimiter(object):
+    """
+    Rate limiter extension
+    """
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """
+        Creates the backend of the given application and registers the check of every request
+        :param app: current flask app
+        """
+        app.config.setdefault("RATELIMIT_BACKEND", "memory")
+        app.config.setdefault("RATELIMIT_LIMITS", {})
+        app.config.setdefault("RATELIMIT_SIZE", 100000)
+        app.config.setdefault("RATELIMIT_REDIS_URL", "redis://localhost:6379/0")
+
+        name = app.config["RATELIMIT_BACKEND"]
+        if not name:
+            backend = None
+        elif name == "memory":
+            backend = MemoryBackend(app.config["RATELIMIT_SIZE"])
+        elif name == "redis":
+            backend = RedisBackend(app.config["RATELIMIT_REDIS_URL"])
+        else:
+            raise ValueError("No rate limiter backend named {}".format(name))
+
+        limits = {}
+        for target, texts in app.config["RATELIMIT_LIMITS"].items():
+            limits[target] = tuple(parse_limit(target, text) for text in texts)
+        app.extensions["rate_limiter"] = _LimiterState(backend, limits)
+        app.before_request(self._check)
+        app.register_error_handler(RateLimitExceeded, self._too_many_requests)
+
+    @staticmethod
+    def _state():
+        return current_app.extensions["rate_limiter"]
+
+    @staticmethod
+    def _client(limit):
+        """
+        Key of the client a limit counts the current request against
+        :return: the key, None if the request can not be attributed to a user
+        :rtype: str
+        """
+        if limit.scope == "ip":
+            return "ip:{}".format(request.remote_addr)
+        # a logged in client is counted as itself whatever username it sends
+        username = current_user.username if current_user.is_authenticated else request.values.get("username")
+        return "user:{}".format(username.lower()) if username else None
+
+    def _check(self):
+        state = self._state()
+        if state.backend is None or request.method not in WRITE_METHODS:
+            return
+        limits = state.limits.get(request.endpoint, ()) + state.limits.get(request.blueprint, ())
+        if not limits:
+            return
+
+        # limits are checked in order and the first one used up refuses the request, without
+        # taking tokens from the limits after it
+        retry_after = 0
+        for limit in limits:
+            client = self._client(limit)
+            if client is None:
+                continue
+            try:
+                allowed, wait = state.backend.take("{}:{}".format(limit.target, client),
+                                                   limit.count, limit.rate)
+            except Exception as e:
+                # a limiter that can not reach its backend lets requests through
+                state.count("errors")
+                app_logger.exception("Failed to check the rate limit. Error => {}".format(e))
+                return
+            if not allowed:
+                retry_after = wait
+                break
+
+        if retry_after:
+            state.count("limited")
+            raise RateLimitExceeded(max(1, int(math.ceil(retry_after))))
+        state.count("allowed")
+
+    @staticmethod
+    def _too_many_requests(error):
+        response = jsonify({"message": error.detail, "retry_after": error.retry_after})
+        response.status_code = error.status_code
+        response.headers["Retry-After"] = str(error.retry_after)
+        return response
+
+    def metrics(self):
+        """
+        Counters of the limiter of the current application
+        :return: writes let through, writes turned away and failed checks
+        :rtype: dict
+        """
+        state = self._state()
+        with state.lock:
+            return dict(backend=current_app.config["RATELIMIT_BACKEND"] or None,
+                        allowed=state.allowed, limited=state.limited, errors=state.errors)
+
+
+rate_limiter = RateLimiter()
@@ -0,0 +1,106 @@
+"""
+Storage backends of the rate limiter. A backend keeps a token bucket per key, holding up to
+capacity tokens and refilled at rate tokens a second. Every request takes one token and a request
+that finds the bucket empty is turned away until the next token is due
+"""
+import threading
+import time
+from abc import ABCMeta, abstractmethod
+from collections import OrderedDict
+
+
+class RateLimitBackend(object):
+    """
+    Base class of the rate limiter backends
+    """
+    __metaclass__ = ABCMeta
+
+    @abstractmethod
+    def take(self, key, capacity, rate):
+        """
+        Takes a token from a bucket, a bucket seen for the first time starts full
+        :param key: key of the bucket
+        :param capacity: most tokens the bucket holds, the burst it allows
+        :param rate: tokens added to the bucket a second
+        :return: whether a token was taken and the seconds until the next token is due if not
+        :rtype: tuple
+        """
+        pass
+
+
+def _take(tokens, updated, now, capacity, rate):
+    """
+    Token bucket arithmetic shared by the backends
+    :return: tokens left, whether a token was taken and the seconds until the next one is due
+    :rtype: tuple
+    """
+    tokens = min(capacity, tokens + (now - updated) * rate)
+    if tokens >= 1:
+        return tokens - 1, True, 0
+    return tokens, False, (1 - tokens) / rate
+
+
+class MemoryBackend(RateLimitBackend):
+    """
+    Buckets in the memory of the process. Every worker process counts its own requests, so with
+    several workers a client gets the limit once per worker. The least recently used buckets are
+    dropped beyond size, a dropped bucket starts full again
+    """
+
+    def __init__(self, size):
+        self.size = size
+        self.lock = threading.Lock()
+        self.buckets = OrderedDict()
+
+    def take(self, key, capacity, rate):
+        now = time.monotonic()
+        with self.lock:
+            tokens, updated = self.buckets.get(key, (capacity, now))
+            tokens, allowed, retry_after = _take(tokens, updated, now, capacity, rate)
+            self.buckets[key] = (tokens, now)
+            self.buckets.move_to_end(key)
+            while len(self.buckets) > self.size:
+                self.buckets.popitem(last=False)
+        return allowed, retry_after
+
+
+# the bucket is read, refilled and written in one script, so concurrent workers never both take
+# the last token. The clock of the server is used, the clocks of the workers may disagree. The
+# bucket expires once it would be full again, an absent bucket is a full one
+_TAKE_SCRIPT = """
+redis.replicate_commands()
+local capacity, rate = tonumber(ARGV[1]), tonumber(ARGV[2])
+local clock = redis.call("TIME")
+local now = tonumber(clock[1]) + tonumber(clock[2]) / 1000000
+local bucket = redis.call("HMGET", KEYS[1], "tokens", "updated")
+local tokens, updated = tonumber(bucket[1]) or capacity, tonumber(bucket[2]) or now
+tokens = math.min(capacity, tokens + math.max(0, now - updated) * rate)
+local allowed, retry_after = 0, (1 - tokens) / rate
+if tokens >= 1 then
+    tokens, allowed, retry_after = tokens - 1, 1, 0
+end
+redis.call("HSET", KEYS[1], "tokens", tostring(tokens), "updated", tostring(now))
+redis.call("PEXPIRE", KEYS[1], math.ceil((capacity - tokens) / rate * 1000) + 1000)
+return {allowed, tostring(retry_after)}
+"""
+
+
+class RedisBackend(RateLimitBackend):
+    """
+    Buckets in Redis or a server speaking its protocol, shared by every worker process so a
+    client gets the limit once whatever process handles it. Needs the redis package
+    """
+
+    def __init__(self, url, prefix="bucketlist:ratelimit:"):
+        try:
+            import redis
+        except ImportError:
+            raise RuntimeError("The redis rate limiter backend needs the redis package, "
+                               "pip install redis")
+        self.client = redis.StrictRedis.from_url(url)
+        self.prefix = prefix
+        self.script = self.client.register_script(_TAKE_SCRIPT)
+
+    def take(self, key, capacity, rate):
+        allowed, retry_after = self.script(keys=[self.prefix + key], args=[capacity, rate])
+        return bool(allowed), float(retry_after)
@@ -0,0 +1,64 @@
+"""
+Search over the names of bucket lists and their items. The backend is picked from the database
+in use, Postgres gets the tsvector and trigram backend and SQLite the FTS5 one. SEARCH_BACKEND
+can be set to postgresql or sqlite to pick one explicitly
+"""
+from flask import current_app
+from sqlalchemy.engine.url import make_url
+
+from app import db
+from .backends import SqliteFtsSearchBackend, PostgresSearchBackend, SearchResult
+
+BACKENDS = {
+    "sqlite": SqliteFtsSearchBackend,
+    "postgresql": PostgresSearchBackend,
+}
+
+
+class Search(object):
+    """
+    Search extension, gives access to the search backend of the current application
+    """
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """
+        Picks the search backend of the given application
+        :param app: current flask app
+        """
+        name = app.config.get("SEARCH_BACKEND")
+        if not name:
+            name = make_url(app.config.get("SQLALCHEMY_DATABASE_URI") or "sqlite://").get_backend_name()
+        if name not in BACKENDS:
+            raise ValueError("No search backend for database {}".format(name))
+        app.extensions["search"] = BACKENDS[name]()
+
+    @property
+    def backend(self):
+        return current_app.extensions["search"]
+
+    def bucketlist_filter(self, query):
+        """
+        Condition selecting the bucket lists whose name matches a search query
+        :param query: search query
+        :return: SQL expression
+        """
+        return self.backend.bucketlist_filter(query)
+
+    def search(self, user_id, query, limit, after=None):
+        """
+        Ranked search over the names of a user's bucket lists and items
+        :param user_id: id of the user whose data to search
+        :param query: search query
+        :param limit: page size
+        :param after: key of the last result of the previous page
+        :return: results of the page and the key of its last result if there is a next page
+        :rtype: tuple
+        """
+        return self.backend.search(db.session, user_id, query, limit, after)
+
+
+search = Search()
@@ -0,0 +1,227 @@
+"""
+Search backends for bucket list and item names.
+Both backends keep their index up to date inside the database itself, the SQLite backend with
+FTS5 tables maintained by triggers and the Postgres backend with expression indexes, so the
+index follows every change to the models, bulk statements included.
+Results are ordered by rank, best match first, then by kind and id which makes the order total
+and lets results be paged with a cursor on (rank, kind, id)
+"""
+import re
+from abc import ABCMeta, abstractmethod
+
+from sqlalchemy import text, event, column, DDL, Integer
+
+from app.mod_bucketlist.models import BucketList, BucketListItem
+
+_WORD = re.compile(r"\w+", re.UNICODE)
+
+
+def _sqlite_ddl(table, fts):
+    """
+    FTS5 table indexing the names of a table and the triggers keeping it in step with the table
+    """
+    create = [
+        "CREATE VIRTUAL TABLE IF NOT EXISTS {fts} USING fts5(name, content='{table}', "
+        "content_rowid='id')",
+        "CREATE TRIGGER IF NOT EXISTS {fts}_ai AFTER INSERT ON {table} BEGIN "
+        "INSERT INTO {fts}(rowid, name) VALUES (new.id, new.name); END",
+        "CREATE TRIGGER IF NOT EXISTS {fts}_ad AFTER DELETE ON {table} BEGIN "
+        "INSERT INTO {fts}({fts}, rowid, name) VALUES ('delete', old.id, old.name); END",
+        "CREATE TRIGGER IF NOT EXISTS {fts}_au AFTER UPDATE OF name ON {table} BEGIN "
+        "INSERT INTO {fts}({fts}, rowid, name) VALUES ('delete', old.id, old.name); "
+        "INSERT INTO {fts}(rowid, name) VALUES (new.id, new.name); END",
+    ]
+    drop = ["DROP TABLE IF EXISTS {fts}"]
+    return [s.format(table=table, fts=fts) for s in create], [s.format(fts=fts) for s in drop]
+
+
+def _postgres_ddl(table):
+    """
+    Full text and trigram indexes on the names of a table
+    """
+    create = [
+        "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+        "CREATE INDEX IF NOT EXISTS ix_{table}_name_tsv ON {table} "
+        "USING gin (to_tsvector('simple', name))",
+        "CREATE INDEX IF NOT EXISTS ix_{table}_name_trgm ON {table} USING gin (name gin_trgm_ops)",
+    ]
+    return [s.format(table=table) for s in create]
+
+
+def _register_ddl():
+    """
+    Creates the search indexes whenever the tables are created with create_all and drops the
+    SQLite full text tables with them
+    """
+    for table in (BucketList.__table__, BucketListItem.__table__):
+        create, drop = _sqlite_ddl(table.name, table.name + "_fts")
+        for statement in create:
+            event.listen(table, "after_create", DDL(statement).execute_if(dialect="sqlite"))
+        for statement in drop:
+            event.listen(table, "before_drop", DDL(statement).execute_if(dialect="sqlite"))
+        for statement in _postgres_ddl(table.name):
+            event.listen(table, "after_create", DDL(statement).execute_if(dialect="postgresql"))
+
+
+_register_ddl()
+
+
+class SearchResult(object):
+    """
+    A bucket list or item matching a search
+    :ivar kind: either bucketlist or item
+    :ivar rank: rank of the match, lower is better
+    """
+
+    def __init__(self, kind, id, bucketlist_id, name, rank):
+        self.kind = kind
+        self.id = id
+        self.bucketlist_id = bucketlist_id
+        self.name = name
+        self.rank = rank
+
+    def to_json(self):
+        return dict(type=self.kind, id=self.id, bucketlist_id=self.bucketlist_id,
+                    name=self.name)
+
+
+class SearchBackend(object):
+    """
+    Base class of the search backends
+    """
+    __metaclass__ = ABCMeta
+
+    @staticmethod
+    def words(query):
+        """
+        Splits a search query into words, everything but letters and digits is dropped
+        :param query: search query sent by the client
+        :rtype: list
+        """
+        return _WORD.findall(query or "")
+
+    @abstractmethod
+    def bucketlist_filter(self, query):
+        """
+        Condition selecting the bucket lists whose name matches the query
+        :param query: search query
+        :return: SQL expression on the bucket lists table
+        """
+        pass
+
+    @abstractmethod
+    def _ranked_sql(self):
+        """
+        SQL selecting kind, id, bucketlist_id, name and rank of every match of the user :uid,
+        bound with the parameters of _params
+        """
+        pass
+
+    @abstractmethod
+    def _params(self, query):
+        """
+        Parameters binding a search query to the ranked SQL
+        """
+        pass
+
+    def search(self, session, user_id, query, limit, after=None):
+        """
+        Ranked search over the names of a user's bucket lists and items
+        :param session: database session
+        :param user_id: id of the user whose data to search
+        :param query: search query
+        :param limit: page size
+        :param after: (rank, kind, id) of the last result of the previous page
+        :return: results of this page and the key of its last result if there is a next page
+        :rtype: tuple
+        """
+        if not self.words(query):
+            return [], None
+
+        params = dict(self._params(query), uid=user_id, limit=limit + 1)
+        keyset = ""
+        if after is not None:
+            keyset = "WHERE rank > :rank OR (rank = :rank AND (kind > :kind OR " \
+                     "(kind = :kind AND id > :id)))"
+            params.update(rank=after[0], kind=after[1], id=after[2])
+
+        sql = "SELECT kind, id, bucketlist_id, name, rank FROM ({ranked}) AS results {keyset} " \
+              "ORDER BY rank, kind, id LIMIT :limit".format(ranked=self._ranked_sql(), keyset=keyset)
+        results = [SearchResult(*row) for row in session.execute(text(sql), params)]
+
+        if len(results) <= limit:
+            return results, None
+        results = results[:limit]
+        last = results[-1]
+        return results, (last.rank, last.kind, last.id)
+
+
+class SqliteFtsSearchBackend(SearchBackend):
+    """
+    SQLite FTS5 backend, used in development and tests. Every word of the query has to match
+    the start of a word of the name and matches are ranked with bm25
+    """
+
+    def _match(self, query):
+        return " ".join('"{}"*'.format(word) for word in self.words(query))
+
+    def bucketlist_filter(self, query):
+        if not self.words(query):
+            # an empty MATCH is a syntax error, a query of punctuation only is matched as a
+            # substring, as the Postgres backend does
+            return BucketList.name.contains(query or "", autoescape=True)
+        return BucketList.id.in_(
+            text("SELECT rowid FROM bucketlists_fts WHERE bucketlists_fts MATCH :match")
+            .bindparams(match=self._match(query)).columns(column("rowid", Integer)))
+
+    def _params(self, query):
+        return dict(match=self._match(query))
+
+    def _ranked_sql(self):
+        return "SELECT 'bucketlist' AS kind, b.id AS id, b.id AS bucketlist_id, b.name AS name, " \
+               "bm25(bucketlists_fts) AS rank " \
+               "FROM bucketlists_fts JOIN bucketlists b ON b.id = bucketlists_fts.rowid " \
+               "WHERE bucketlists_fts MATCH :match AND b.created_by = :uid " \
+               "UNION ALL " \
+               "SELECT 'item', i.id, i.bucketlist_id, i.name, bm25(bucketlist_items_fts) " \
+               "FROM bucketlist_items_fts JOIN bucketlist_items i ON i.id = bucketlist_items_fts.rowid " \
+               "JOIN bucketlists b ON b.id = i.bucketlist_id " \
+               "WHERE bucketlist_items_fts MATCH :match AND b.created_by = :uid"
+
+
+class PostgresSearchBackend(SearchBackend):
+    """
+    Postgres backend. A name matches if it contains every word of the query as a word prefix,
+    through a tsvector index, or contains the query as a substring, through a trigram index.
+    Matches are ranked by ts_rank plus trigram similarity
+    """
+
+    def _tsquery(self, query):
+        return " & ".join("{}:*".format(word) for word in self.words(query))
+
+    def bucketlist_filter(self, query):
+        return text("(to_tsvector('simple', bucketlists.name) @@ to_tsquery('simple', :tsquery) "
+                    "OR bucketlists.name ILIKE :like)") \
+            .bindparams(tsquery=self._tsquery(query), like=self._like(query))
+
+    @staticmethod
+    def _like(query):
+        escaped = query.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+        return "%{}%".format(escaped)
+
+    def _params(self, query):
+        return dict(tsquery=self._tsquery(query), like=self._like(query), query=query)
+
+    def _ranked_sql(self):
+        return "SELECT 'bucketlist' AS kind, b.id AS id, b.id AS bucketlist_id, b.name AS name, " \
+               "-(ts_rank(to_tsvector('simple', b.name), to_tsquery('simple', :tsquery)) " \
+               "+ similarity(b.name, :query)) AS rank " \
+               "FROM bucketlists b WHERE b.created_by = :uid AND " \
+               "(to_tsvector('simple', b.name) @@ to_tsquery('simple', :tsquery) OR b.name ILIKE :like) " \
+               "UNION ALL " \
+               "SELECT 'item', i.id, i.bucketlist_id, i.name, " \
+               "-(ts_rank(to_tsvector('simple', i.name), to_tsquery('simple', :tsquery)) " \
+               "+ similarity(i.name, :query)) " \
+               "FROM bucketlist_items i JOIN bucketlists b ON b.id = i.bucketlist_id " \
+               "WHERE b.created_by = :uid AND " \
+               "(to_tsvector('simple', i.name) @@ to_tsquery('simple', :tsquery) OR i.name ILIKE :like)"
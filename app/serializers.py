@@ -0,0 +1,247 @@
+"""
+JSON serialization of model rows.
+A Projection is the list of columns a model is serialized with, compiled once per model. The list
+endpoints query those columns only, so rows come back as plain tuples rather than ORM objects, and
+turn every tuple into a dict with converters chosen per column when the projection is built, so no
+value is inspected while encoding. Datetimes are written as HTTP dates, as jsonify writes them.
+Responses are encoded by the backend named in JSON_BACKEND. The default, auto, uses orjson or
+ujson when one is installed and the json module of the standard library otherwise, all three write
+the same documents, non-ASCII characters as UTF-8. A backend is tried on a sample document when it
+is created and one whose installed release writes it differently, such as ujson before 2.0, which
+has no default argument, is passed over
+"""
+import json
+from datetime import datetime
+
+from flask import current_app, request
+from sqlalchemy import DateTime
+from werkzeug.http import http_date
+
+from app.exceptions.handler import InvalidFields
+
+BACKENDS = ("orjson", "ujson", "json")
+# document every backend must encode as the json module does, with a value left to default
+_TRIAL = {"name": "Caf\u00e9 / \u2603", "date": datetime(2000, 1, 1), "values": [1, 2.5, None, True]}
+
+
+def _http_date(value):
+    return None if value is None else http_date(value)
+
+
+def _default(value):
+    """
+    Encodes the values the backends do not know, the way jsonify does
+    """
+    if hasattr(value, "isoformat"):
+        return http_date(value)
+    raise TypeError("{!r} is not JSON serializable".format(value))
+
+
+class Projection(object):
+    """
+    Columns a model is serialized with
+    :ivar fields: names of the fields in the serialized dicts
+    :ivar columns: mapped columns, in the order of fields
+    :ivar extra: columns selected by query but left out of the dicts, such as a sort key
+    """
+
+    def __init__(self, *columns, **kwargs):
+        """
+        :param columns: mapped columns, or (field, column) pairs for fields named differently
+        from their column
+        :param extra: columns to select without serializing them
+        """
+        pairs = [c if isinstance(c, tuple) else (c.key, c) for c in columns]
+        self.pairs = tuple(pairs)
+        self.fields = tuple(field for field, _ in pairs)
+        self.columns = tuple(column for _, column in pairs)
+        self.keys = tuple(column.key for column in self.columns)
+        self.converters = tuple(_http_date if isinstance(column.type, DateTime) else None
+                                for column in self.columns)
+        self.extra = tuple(column for column in kwargs.get("extra", ()) if column.key not in self.keys)
+
+    def only(self, fields, keep=()):
+        """
+        Projection narrowed to some of the fields, in the order of this projection
+        :param fields: names of the fields to keep, None for all of them
+        :param keep: columns the narrowed query must still select, such as the sort key of a page
+        :raises: InvalidFields if a name is not a field of this projection
+        :rtype: Projection
+        """
+        if fields is None:
+            return Projection(*self.pairs, extra=keep) if keep else self
+        unknown = [field for field in fields if field not in self.fields]
+        if unknown:
+            raise InvalidFields("Unknown fields {}. Use any of {}".format(
+                ", ".join(unknown), ", ".join(self.fields)))
+        return Projection(*[pair for pair in self.pairs if pair[0] in fields], extra=keep)
+
+    def requested(self, keep=()):
+        """
+        Projection narrowed to the fields the current request asks for in its fields argument,
+        a comma separated list of field names. Without the argument every field is kept
+        :param keep: columns the narrowed query must still select, such as the sort key of a page
+        :raises: InvalidFields for unknown or missing field names
+        :rtype: Projection
+        """
+        value = request.args.get("fields")
+        if value is None:
+            return self.only(None, keep)
+        fields = [field.strip() for field in value.split(",") if field.strip()]
+        if not fields:
+            raise InvalidFields()
+        return self.only(fields, keep)
+
+    def query(self, query):
+        """
+        Narrows a query of the model to the columns of the projection, only these columns are
+        read from the database
+        :param query: query of the model
+        :return: query returning tuples, whose values can also be read by column key
+        """
+        return query.with_entities(*(self.columns + self.extra))
+
+    def as_dict(self, obj):
+        """
+        Fields of a model instance, values left as they are
+        :param obj: model instance
+        :rtype: dict
+        """
+        return dict((field, getattr(obj, key)) for field, key in zip(self.fields, self.keys))
+
+    def dump(self, row):
+        """
+        Serializable dict of a row returned by a projected query
+        :param row: tuple of column values, in the order of the projection, the values of the
+        extra columns last
+        :rtype: dict
+        """
+        return dict((field, value if convert is None else convert(value))
+                    for field, convert, value in zip(self.fields, self.converters, row))
+
+    def dump_all(self, rows):
+        """
+        Serializable dicts of the rows returned by a projected query
+        :param rows: iterable of tuples
+        :rtype: list
+        """
+        return [self.dump(row) for row in rows]
+
+
+class JsonBackend(object):
+    """
+    Encoder of response documents
+    """
+    name = "json"
+
+    def __init__(self, sort_keys):
+        self.sort_keys = sort_keys
+
+    def dumps(self, obj):
+        """
+        :param obj: document of dicts, lists and plain values
+        :return: UTF-8 encoded JSON
+        :rtype: bytes
+        """
+        return json.dumps(obj, separators=(",", ":"), sort_keys=self.sort_keys, ensure_ascii=False,
+                          default=_default).encode("utf-8")
+
+    def _try(self):
+        """
+        Encodes the trial document, so a release of the package that writes other documents
+        than the json module is found before it serves a response
+        :raises: ImportError if the document is not encoded as the json module encodes it
+        """
+        try:
+            encoded = self.dumps(_TRIAL)
+        except (TypeError, ValueError, OverflowError) as e:
+            raise ImportError("the installed {} can not encode responses, {}".format(self.name, e))
+        if encoded != JsonBackend.dumps(self, _TRIAL):
+            raise ImportError("the installed {} encodes responses differently".format(self.name))
+
+
+class OrjsonBackend(JsonBackend):
+    name = "orjson"
+
+    def __init__(self, sort_keys):
+        JsonBackend.__init__(self, sort_keys)
+        import orjson
+        self.orjson = orjson
+        self.option = orjson.OPT_SORT_KEYS if sort_keys else 0
+        # orjson writes datetimes itself, as ISO 8601, unless told to pass them to default
+        self.option |= orjson.OPT_PASSTHROUGH_DATETIME
+        self._try()
+
+    def dumps(self, obj):
+        return self.orjson.dumps(obj, default=_default, option=self.option)
+
+
+class UjsonBackend(JsonBackend):
+    name = "ujson"
+
+    def __init__(self, sort_keys):
+        JsonBackend.__init__(self, sort_keys)
+        import ujson
+        self.ujson = ujson
+        self._try()
+
+    def dumps(self, obj):
+        return self.ujson.dumps(obj, sort_keys=self.sort_keys, ensure_ascii=False,
+                                escape_forward_slashes=False, default=_default).encode("utf-8")
+
+
+_BACKEND_CLASSES = dict(orjson=OrjsonBackend, ujson=UjsonBackend, json=JsonBackend)
+
+
+def load_backend(name, sort_keys=True):
+    """
+    Creates the named backend
+    :param name: orjson, ujson, json or auto for the fastest one installed
+    :param sort_keys: whether keys of dicts are written in sorted order
+    :raises: RuntimeError if the named backend is not installed or its release can not be used
+    :rtype: JsonBackend
+    """
+    if name == "auto":
+        for candidate in BACKENDS:
+            try:
+                return _BACKEND_CLASSES[candidate](sort_keys)
+            except ImportError:
+                continue
+    if name not in _BACKEND_CLASSES:
+        raise RuntimeError("Unknown JSON backend {}, use one of auto, {}".format(name, ", ".join(BACKENDS)))
+    try:
+        return _BACKEND_CLASSES[name](sort_keys)
+    except ImportError as e:
+        raise RuntimeError("The {0} JSON backend needs a recent {0} package, pip install -U {0} ({1})"
+                           .format(name, e))
+
+
+def _backend():
+    backend = current_app.extensions.get("json_backend")
+    if backend is None:
+        backend = current_app.extensions["json_backend"] = load_backend(
+            current_app.config.get("JSON_BACKEND", "auto"), current_app.config.get("JSON_SORT_KEYS", True))
+    return backend
+
+
+def dumps(obj):
+    """
+    Encodes a document with the JSON backend of the current app
+    :param obj: document of dicts, lists and plain values
+    :rtype: bytes
+    """
+    return _backend().dumps(obj)
+
+
+def json_response(obj, status=200):
+    """
+    Compact JSON response, the replacement of jsonify for documents of projected rows. The
+    document is kept on the response, so it can be encoded again in another format without
+    decoding the JSON
+    :param obj: document of dicts, lists and plain values
+    :param status: status code of the response
+    :rtype: flask.Response
+    """
+    response = current_app.response_class(dumps(obj), status=status, mimetype="application/json")
+    response.document = obj
+    return response
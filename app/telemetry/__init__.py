@@ -0,0 +1,4 @@
+"""
+Instrumentation of the application, measurements of what a request costs that are reported
+alongside the request itself
+"""
@@ -0,0 +1,263 @@
+"""
+Non blocking logging pipeline.
+The handlers that write log records to files, syslog or email do I/O, and attached to the
+loggers directly they do it on the thread that logs, which for an error is a request thread
+waiting on disk or on the SMTP server. The pipeline puts a QueueHandler on the loggers instead,
+the request thread only enqueues the record and a QueueListener thread hands it to the real
+handlers. Records are written as JSON lines carrying the id of the request that logged them.
+Error emails are deduplicated, an error with the same fingerprint, logger, place in the code and
+exception type, as one already emailed within LOG_MAIL_WINDOW seconds is only counted and the
+count is reported with its next email. At most LOG_MAIL_LIMIT emails go out per window, so an
+error storm does not turn into an SMTP storm
+"""
+import atexit
+import copy
+import hashlib
+import json
+import queue
+import re
+import threading
+import time
+import traceback
+import uuid
+from collections import deque
+from datetime import datetime
+from logging import Filter, Formatter
+from logging.handlers import QueueHandler, QueueListener, SMTPHandler
+
+from flask import current_app, has_request_context, request
+
+from app import app_logger
+
+REQUEST_ID_HEADER = "X-Request-ID"
+# request ids accepted from a proxy, anything else is replaced by a generated one
+_VALID_REQUEST_ID = re.compile(r"^[A-Za-z0-9._:-]{1,128}$")
+_ENVIRON_KEY = "bucketlist.request_id"
+
+
+def request_id():
+    """
+    Id of the current request, the X-Request-ID header set by a proxy in front of the app if
+    there is one and a generated id otherwise
+    :return: the id, None outside of a request
+    :rtype: str
+    """
+    if not has_request_context():
+        return None
+    rid = request.environ.get(_ENVIRON_KEY)
+    if rid is None:
+        rid = request.headers.get(REQUEST_ID_HEADER, "")
+        if not _VALID_REQUEST_ID.match(rid):
+            rid = uuid.uuid4().hex
+        request.environ[_ENVIRON_KEY] = rid
+    return rid
+
+
+class JsonFormatter(Formatter):
+    """
+    Formats a record as one line of JSON
+    """
+
+    def format(self, record):
+        line = dict(time=datetime.utcfromtimestamp(record.created).isoformat() + "Z",
+                    level=record.levelname, logger=record.name, message=record.getMessage(),
+                    request_id=getattr(record, "request_id", None),
+                    location="{}:{}".format(record.pathname, record.lineno))
+        if getattr(record, "path", None) is not None:
+            line.update(method=record.method, path=record.path)
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            line["exception"] = record.exc_text
+        return json.dumps(line, default=str)
+
+
+class ErrorMailFilter(Filter):
+    """
+    Lets through the first record of every fingerprint within a window and at most limit
+    records per window. Runs on the listener thread only
+    """
+
+    def __init__(self, limit, window):
+        Filter.__init__(self)
+        self.limit = limit
+        self.window = window
+        self.seen = {}
+        self.sent = deque()
+        self.suppressed = 0
+
+    def filter(self, record):
+        now = time.time()
+        fingerprint = getattr(record, "fingerprint", None) or (record.name, record.pathname, record.lineno)
+        last = self.seen.get(fingerprint)
+        if last is not None and now - last[0] < self.window:
+            last[1] += 1
+            self.suppressed += 1
+            return False
+
+        while self.sent and now - self.sent[0] >= self.window:
+            self.sent.popleft()
+        if len(self.sent) >= self.limit:
+            self.suppressed += 1
+            return False
+
+        record.repeated = last[1] if last is not None else 0
+        self.seen[fingerprint] = [now, 0]
+        self.sent.append(now)
+        if len(self.seen) > 1000:
+            self.seen = dict((k, v) for k, v in self.seen.items() if now - v[0] < self.window)
+        return True
+
+
+class _PipelineHandler(QueueHandler):
+    """
+    Queue handler that captures what the listener thread can not know about a record, the
+    request it was logged in and its formatted exception. A full queue drops the record rather
+    than blocking the logging thread
+    """
+
+    def __init__(self, records, state):
+        QueueHandler.__init__(self, records)
+        self.state = state
+
+    def prepare(self, record):
+        # the record goes on to the other handlers of the logger, they get it untouched
+        record = copy.copy(record)
+        message = record.getMessage()
+        record.message, record.msg, record.args = message, message, None
+        exc_type = None
+        if record.exc_info:
+            exc_type = record.exc_info[0].__name__
+            record.exc_text = "".join(traceback.format_exception(*record.exc_info)).rstrip()
+            record.exc_info = None
+        record.fingerprint = hashlib.sha1(repr((record.name, record.pathname, record.lineno, exc_type))
+                                          .encode("utf-8")).hexdigest()
+        record.request_id = request_id()
+        record.method = record.path = None
+        if has_request_context():
+            record.method, record.path = request.method, request.path
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            with self.state.lock:
+                self.state.dropped += 1
+
+
+class _PipelineState(object):
+    """
+    Per application state of the pipeline
+    :ivar handlers: handlers the listener thread hands records to
+    """
+
+    def __init__(self):
+        self.handlers = []
+        self.listener = None
+        self.queue = None
+        self.queue_handler = None
+        self.mail_filter = None
+        self.lock = threading.Lock()
+        self.dropped = 0
+
+
+class LogPipeline(object):
+    """
+    Puts the log handlers of an application behind a queue. Handlers are registered with
+    add_handler while the application is configured, init_app then starts the listener
+    """
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    @staticmethod
+    def _state(app):
+        return app.extensions.setdefault("log_pipeline", _PipelineState())
+
+    def add_handler(self, app, handler):
+        """
+        Registers a handler to run on the listener thread of the given application. Handlers
+        without a formatter write JSON lines, email handlers get a plain text formatter and
+        the rate limit
+        :param app: flask app being configured
+        :param handler: logging handler
+        """
+        self._state(app).handlers.append(handler)
+
+    def init_app(self, app):
+        """
+        Starts the pipeline of the given application. Responses carry the id of their request
+        :param app: current flask app
+        """
+        app.config.setdefault("LOG_QUEUE_SIZE", 10000)
+        app.config.setdefault("LOG_MAIL_LIMIT", 10)
+        app.config.setdefault("LOG_MAIL_WINDOW", 300)
+        app.after_request(self._tag_response)
+        self.start(app)
+
+    def start(self, app):
+        """
+        Starts the listener thread of the given application with the registered handlers and
+        puts its queue handler on the loggers of the application. Nothing is started when no
+        handler was registered
+        :param app: flask app
+        """
+        state = self._state(app)
+        if not state.handlers or state.listener is not None:
+            return
+
+        for handler in state.handlers:
+            if isinstance(handler, SMTPHandler):
+                state.mail_filter = ErrorMailFilter(app.config["LOG_MAIL_LIMIT"], app.config["LOG_MAIL_WINDOW"])
+                handler.addFilter(state.mail_filter)
+                handler.setFormatter(Formatter(
+                    "%(asctime)s %(levelname)s in %(pathname)s:%(lineno)d\n"
+                    "Request: %(request_id)s %(method)s %(path)s\n"
+                    "Repeated %(repeated)s times since the last email\n\n%(message)s"))
+            elif handler.formatter is None:
+                handler.setFormatter(JsonFormatter())
+
+        state.queue = queue.Queue(app.config["LOG_QUEUE_SIZE"])
+        state.queue_handler = _PipelineHandler(state.queue, state)
+        for logger in (app.logger, app_logger):
+            logger.addHandler(state.queue_handler)
+        state.listener = QueueListener(state.queue, *state.handlers, respect_handler_level=True)
+        state.listener.start()
+        atexit.register(self.stop, app)
+
+    @staticmethod
+    def _tag_response(response):
+        rid = request_id()
+        if rid is not None:
+            response.headers[REQUEST_ID_HEADER] = rid
+        return response
+
+    def stop(self, app):
+        """
+        Writes the records still in the queue and stops the listener of the given application
+        :param app: flask app
+        """
+        state = self._state(app)
+        if state.listener is not None:
+            for logger in (app.logger, app_logger):
+                logger.removeHandler(state.queue_handler)
+            state.listener.stop()
+            state.listener = None
+
+    def metrics(self):
+        """
+        Counters of the pipeline of the current application
+        :return: records waiting in the queue, records dropped because the queue was full and
+        error emails held back by deduplication or the rate limit
+        :rtype: dict
+        """
+        state = self._state(current_app)
+        with state.lock:
+            return dict(queued=state.queue.qsize() if state.queue is not None else 0,
+                        dropped=state.dropped,
+                        mails_suppressed=state.mail_filter.suppressed if state.mail_filter else 0)
+
+
+log_pipeline = LogPipeline()
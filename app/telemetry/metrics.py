@@ -0,0 +1,407 @@
+"""
+Runtime metrics in the Prometheus text format, served at METRICS_PATH.
+Every request is counted per blueprint, endpoint, method and status and its latency is added to
+a histogram per blueprint, endpoint and method. Requests turned away by authentication are
+counted separately. A scrape adds the state of the database pool and the counters of the
+caches, the password hasher, the mail outbox and the log pipeline.
+Recording is lock free, every thread records into its own shard and a scrape sums the shards.
+Under a pre forking server every worker process is a separate registry, with METRICS_DIR set
+each process writes a snapshot of its registry to that directory every METRICS_DUMP_INTERVAL
+seconds and a scrape, whichever worker serves it, adds up the snapshots of all of them. Counters
+of workers that have exited are kept, gauges only count live processes. With
+METRICS_REQUIRE_TOKEN, as in production, the endpoint is only served when METRICS_TOKEN is set
+"""
+import atexit
+import bisect
+import glob
+import hmac
+import json
+import os
+import threading
+import time
+import weakref
+
+from flask import current_app, request, _request_ctx_stack
+from flask_api.exceptions import AuthenticationFailed, NotAuthenticated, PermissionDenied
+
+from app import db, app_logger
+from .queries import query_counter
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+AUTH_FAILURES = (AuthenticationFailed, NotAuthenticated, PermissionDenied)
+
+# type and help text of every metric, in the order they are exposed
+METRICS = (
+    ("bucketlist_http_requests_total", "counter", "Requests handled"),
+    ("bucketlist_http_request_duration_seconds", "histogram", "Time taken to handle a request"),
+    ("bucketlist_auth_failures_total", "counter", "Requests turned away by authentication"),
+    ("bucketlist_db_queries_total", "counter", "SQL statements run by requests"),
+    ("bucketlist_db_query_seconds_total", "counter", "Time requests spent running SQL statements"),
+    ("bucketlist_db_pool_connections", "gauge", "Connections of the database pool by state"),
+    ("bucketlist_response_cache_total", "counter", "Response cache lookups and writes by outcome"),
+    ("bucketlist_token_cache_total", "counter", "Token cache lookups by outcome"),
+    ("bucketlist_password_hashes_total", "counter", "Password hashes by outcome"),
+    ("bucketlist_password_hash_seconds_total", "counter", "Time spent waiting on password hashes"),
+    ("bucketlist_password_hashes_in_flight", "gauge", "Password hashes running or waiting"),
+    ("bucketlist_mail_outbox_total", "counter", "Outbox emails and batches by outcome"),
+    ("bucketlist_log_records_dropped_total", "counter", "Log records dropped on a full queue"),
+    ("bucketlist_log_mails_suppressed_total", "counter", "Error emails held back"),
+    ("bucketlist_log_queue_size", "gauge", "Log records waiting for the listener"),
+    ("bucketlist_rate_limit_total", "counter", "Rate limited writes by outcome"),
+)
+
+
+class _Shard(object):
+    """
+    Measurements recorded by one thread
+    :ivar requests: (blueprint, endpoint, method, status) to the number of requests
+    :ivar latency: (blueprint, endpoint, method) to the request count of every bucket, followed
+    by the sum and the count of the latencies
+    :ivar auth_failures: (endpoint, reason) to the number of failures
+    :ivar queries: (blueprint, endpoint) to the number of SQL statements and their total time
+    """
+
+    def __init__(self, thread=None):
+        self.thread = weakref.ref(thread) if thread is not None else None
+        self.requests = {}
+        self.latency = {}
+        self.auth_failures = {}
+        self.queries = {}
+
+    def alive(self):
+        return self.thread is not None and self.thread() is not None and self.thread().is_alive()
+
+    def merge(self, other):
+        for key, count in dict(other.requests).items():
+            self.requests[key] = self.requests.get(key, 0) + count
+        for key, count in dict(other.auth_failures).items():
+            self.auth_failures[key] = self.auth_failures.get(key, 0) + count
+        for totals, others in ((self.latency, other.latency), (self.queries, other.queries)):
+            for key, values in dict(others).items():
+                mine = totals.setdefault(key, [0] * len(values))
+                for n, value in enumerate(list(values)):
+                    mine[n] += value
+
+
+class _MetricsState(object):
+    """
+    Per application state of the registry
+    :ivar retired: measurements of threads that have exited
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self.buckets = tuple(app.config["METRICS_BUCKETS"])
+        self.directory = app.config["METRICS_DIR"]
+        self.interval = app.config["METRICS_DUMP_INTERVAL"]
+        self.token = app.config["METRICS_TOKEN"]
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        self.shards = []
+        self.retired = _Shard()
+        self.dumper = None
+        self.pid = None
+        self.stopped = threading.Event()
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join('{}="{}"'.format(name, _escape(value)) for name, value in labels) + "}"
+
+
+def _format(value):
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+def _alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class Metrics(object):
+    """
+    Metrics registry extension. METRICS_ENABLED turns it off
+    """
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """
+        Registers the request hooks and the metrics endpoint with the given application
+        :param app: current flask app
+        """
+        app.config.setdefault("METRICS_ENABLED", True)
+        app.config.setdefault("METRICS_PATH", "/metrics")
+        app.config.setdefault("METRICS_BUCKETS", DEFAULT_BUCKETS)
+        app.config.setdefault("METRICS_DIR", None)
+        app.config.setdefault("METRICS_DUMP_INTERVAL", 5)
+        app.config.setdefault("METRICS_TOKEN", None)
+        app.config.setdefault("METRICS_REQUIRE_TOKEN", False)
+        if not app.config["METRICS_ENABLED"]:
+            return
+
+        state = _MetricsState(app)
+        app.extensions["metrics"] = state
+        # the clock starts before any other before_request handler runs
+        app.before_request_funcs.setdefault(None, []).insert(0, self._start)
+        app.after_request(self._status)
+        app.teardown_request(self._finish)
+        if state.token or not app.config["METRICS_REQUIRE_TOKEN"]:
+            app.add_url_rule(app.config["METRICS_PATH"], "metrics", self._view)
+        else:
+            app_logger.warning("METRICS_TOKEN is not set, the metrics are not served")
+        if state.directory:
+            os.makedirs(state.directory, exist_ok=True)
+            atexit.register(self._dump, state)
+
+    @staticmethod
+    def _state(app=None):
+        return (app or current_app).extensions["metrics"]
+
+    def _shard(self, state):
+        shard = getattr(state.local, "shard", None)
+        if shard is None:
+            shard = state.local.shard = _Shard(threading.current_thread())
+            with state.lock:
+                state.shards.append(shard)
+        return shard
+
+    def _start(self):
+        state = self._state()
+        _request_ctx_stack.top.metrics_started = time.time()
+        if state.directory and (state.dumper is None or state.pid != os.getpid()):
+            self._ensure_dumper(state)
+
+    @staticmethod
+    def _status(response):
+        _request_ctx_stack.top.metrics_status = response.status_code
+        return response
+
+    def _finish(self, exc):
+        ctx = _request_ctx_stack.top
+        started = getattr(ctx, "metrics_started", None)
+        if started is None or request.endpoint == "metrics":
+            return
+        seconds = time.time() - started
+        state = self._state()
+
+        status = getattr(ctx, "metrics_status", None)
+        if exc is not None:
+            # an exception that propagates past the handlers never reaches after_request
+            status = getattr(exc, "status_code", None) or getattr(exc, "code", None) or 500
+        rule = request.url_rule
+        endpoint = rule.endpoint if rule is not None else "unmatched"
+        blueprint = request.blueprint or ""
+
+        shard = self._shard(state)
+        key = (blueprint, endpoint, request.method, str(status))
+        shard.requests[key] = shard.requests.get(key, 0) + 1
+
+        latency = shard.latency.get(key[:3])
+        if latency is None:
+            latency = shard.latency[key[:3]] = [0] * (len(state.buckets) + 3)
+        latency[bisect.bisect_left(state.buckets, seconds)] += 1
+        latency[-2] += seconds
+        latency[-1] += 1
+
+        stats = query_counter.stats()
+        if stats is not None and stats.count:
+            queries = shard.queries.get(key[:2])
+            if queries is None:
+                queries = shard.queries[key[:2]] = [0, 0.0]
+            queries[0] += stats.count
+            queries[1] += stats.seconds
+
+        if isinstance(exc, AUTH_FAILURES) or (exc is None and status in (401, 403)):
+            reason = type(exc).__name__ if exc is not None else str(status)
+            failure = (endpoint, reason)
+            shard.auth_failures[failure] = shard.auth_failures.get(failure, 0) + 1
+
+    def _requests(self, state):
+        """
+        Sums the shards of every thread, folding the shards of exited threads into one
+        """
+        with state.lock:
+            retired = [shard for shard in state.shards if not shard.alive()]
+            for shard in retired:
+                state.retired.merge(shard)
+                state.shards.remove(shard)
+            total = _Shard()
+            total.merge(state.retired)
+            shards = list(state.shards)
+        for shard in shards:
+            total.merge(shard)
+        return total
+
+    def snapshot(self, app=None):
+        """
+        Measurements of this process
+        :param app: flask app, defaults to the current app
+        :return: counters, gauges and histograms as lists of [name, labels, value]
+        :rtype: dict
+        """
+        from app.cache import response_cache
+        from app.mod_auth.hashing import password_hasher
+        from app.mod_auth.token_cache import token_cache
+        from app.outbox import outbox
+        from app.ratelimit import rate_limiter
+        from app.telemetry.logs import log_pipeline
+
+        app = app or current_app._get_current_object()
+        state = self._state(app)
+        counters, gauges = [], []
+        total = self._requests(state)
+
+        for (blueprint, endpoint, method, status), count in total.requests.items():
+            counters.append(["bucketlist_http_requests_total", [["blueprint", blueprint], ["endpoint", endpoint],
+                             ["method", method], ["status", status]], count])
+        for (endpoint, reason), count in total.auth_failures.items():
+            counters.append(["bucketlist_auth_failures_total", [["endpoint", endpoint], ["reason", reason]], count])
+        for (blueprint, endpoint), (count, seconds) in total.queries.items():
+            labels = [["blueprint", blueprint], ["endpoint", endpoint]]
+            counters.append(["bucketlist_db_queries_total", labels, count])
+            counters.append(["bucketlist_db_query_seconds_total", labels, seconds])
+        histograms = [["bucketlist_http_request_duration_seconds",
+                       [["blueprint", blueprint], ["endpoint", endpoint], ["method", method]], values]
+                      for (blueprint, endpoint, method), values in total.latency.items()]
+
+        with app.app_context():
+            pool = db.get_engine(app).pool
+            for name in ("size", "checkedin", "checkedout", "overflow"):
+                if hasattr(pool, name):
+                    gauges.append(["bucketlist_db_pool_connections", [["state", name]], getattr(pool, name)()])
+
+            cache = response_cache.metrics()
+            for outcome in ("hits", "misses", "stores", "invalidations"):
+                counters.append(["bucketlist_response_cache_total", [["outcome", outcome]], cache[outcome]])
+            tokens = token_cache.metrics()
+            for outcome in ("hits", "misses"):
+                counters.append(["bucketlist_token_cache_total", [["outcome", outcome]], tokens[outcome]])
+            hasher = password_hasher.metrics()
+            for outcome in ("submitted", "completed", "failed", "rejected"):
+                counters.append(["bucketlist_password_hashes_total", [["outcome", outcome]], hasher[outcome]])
+            counters.append(["bucketlist_password_hash_seconds_total", [], hasher["seconds"]])
+            gauges.append(["bucketlist_password_hashes_in_flight", [], hasher["in_flight"]])
+            mails = outbox.metrics()
+            for outcome in ("batches", "sent", "retried", "dead"):
+                counters.append(["bucketlist_mail_outbox_total", [["outcome", outcome]], mails[outcome]])
+            logs = log_pipeline.metrics()
+            counters.append(["bucketlist_log_records_dropped_total", [], logs["dropped"]])
+            counters.append(["bucketlist_log_mails_suppressed_total", [], logs["mails_suppressed"]])
+            gauges.append(["bucketlist_log_queue_size", [], logs["queued"]])
+            limits = rate_limiter.metrics()
+            for outcome in ("allowed", "limited", "errors"):
+                counters.append(["bucketlist_rate_limit_total", [["outcome", outcome]], limits[outcome]])
+
+        return dict(pid=os.getpid(), counters=counters, gauges=gauges, histograms=histograms)
+
+    def _snapshots(self, state):
+        """
+        Snapshot of this process and the last snapshots written by the other processes
+        """
+        snapshots = [self.snapshot(state.app)]
+        if not state.directory:
+            return snapshots
+        for path in glob.glob(os.path.join(state.directory, "*.json")):
+            try:
+                with open(path) as f:
+                    snapshot = json.load(f)
+            except (OSError, ValueError):
+                continue
+            if snapshot["pid"] != os.getpid():
+                snapshot["alive"] = _alive(snapshot["pid"])
+                snapshots.append(snapshot)
+        return snapshots
+
+    def render(self, app=None):
+        """
+        Metrics of every process in the Prometheus text format
+        :param app: flask app, defaults to the current app
+        :rtype: str
+        """
+        state = self._state(app)
+        samples = {}
+        buckets = state.buckets
+        for snapshot in self._snapshots(state):
+            for kind in ("counters", "gauges", "histograms"):
+                if kind == "gauges" and not snapshot.get("alive", True):
+                    continue
+                for name, labels, value in snapshot[kind]:
+                    key = tuple(tuple(label) for label in labels)
+                    series = samples.setdefault(name, {})
+                    if kind == "histograms":
+                        current = series.setdefault(key, [0] * len(value))
+                        series[key] = [a + b for a, b in zip(current, value)]
+                    else:
+                        series[key] = series.get(key, 0) + value
+
+        lines = []
+        for name, kind, help_text in METRICS:
+            lines.append("# HELP {} {}".format(name, help_text))
+            lines.append("# TYPE {} {}".format(name, kind))
+            for labels, value in sorted(samples.get(name, {}).items()):
+                if kind != "histogram":
+                    lines.append("{}{} {}".format(name, _labels(labels), _format(value)))
+                    continue
+                cumulative = 0
+                for bound, count in zip(buckets + (float("inf"),), value):
+                    cumulative += count
+                    le = "+Inf" if bound == float("inf") else repr(float(bound))
+                    lines.append("{}_bucket{} {}".format(name, _labels(labels + (("le", le),)), cumulative))
+                lines.append("{}_sum{} {}".format(name, _labels(labels), _format(float(value[-2]))))
+                lines.append("{}_count{} {}".format(name, _labels(labels), value[-1]))
+        return "\n".join(lines) + "\n"
+
+    def _view(self):
+        state = self._state()
+        if state.token and not hmac.compare_digest(
+                request.headers.get("Authorization", "").encode("utf-8"),
+                ("Bearer " + state.token).encode("utf-8")):
+            raise PermissionDenied()
+        return current_app.response_class(self.render(), mimetype=None, content_type=CONTENT_TYPE)
+
+    def _dump(self, state):
+        """
+        Writes the snapshot of this process to the metrics directory, replacing its last one
+        """
+        path = os.path.join(state.directory, "{}.json".format(os.getpid()))
+        try:
+            snapshot = self.snapshot(state.app)
+            with open(path + ".tmp", "w") as f:
+                json.dump(snapshot, f)
+            os.replace(path + ".tmp", path)
+        except Exception as e:
+            app_logger.exception("Failed to write the metrics snapshot. Error => {}".format(e))
+
+    def _ensure_dumper(self, state):
+        """
+        Starts the thread writing the snapshots of this process, a worker forked from a parent
+        that had already started it gets its own thread
+        """
+        with state.lock:
+            if state.dumper is not None and state.pid == os.getpid():
+                return
+            state.pid = os.getpid()
+            state.dumper = threading.Thread(target=self._run, args=(state,), name="metrics-dumper")
+            state.dumper.daemon = True
+            state.dumper.start()
+
+    def _run(self, state):
+        while not state.stopped.wait(state.interval):
+            self._dump(state)
+
+
+metrics = Metrics()
@@ -0,0 +1,265 @@
+"""
+Sampling profiler for live traffic.
+A request is profiled when it sends an X-Profile header with PROFILER_TOKEN, when it sends
+X-Profile: 1 from the session of an admin, or when it is picked for the sampled fraction
+PROFILER_SAMPLE_RATE of the traffic. While profiled requests are running, a sampler thread reads
+the stacks of their threads every PROFILER_INTERVAL seconds and counts every distinct stack per
+endpoint. Nothing is traced, a profiled request runs at full speed and a request that is not
+profiled only pays for the header lookup.
+The counts are written every PROFILER_FLUSH_INTERVAL seconds to one file per endpoint and process
+in PROFILER_DIR, in the collapsed format of flamegraph.pl and speedscope, one
+"frame;frame;frame count" line per stack, root first
+"""
+import hmac
+import os
+import random
+import re
+import sys
+import threading
+import time
+
+from flask import current_app, request, _request_ctx_stack
+from flask_login import current_user
+
+from app import app_logger
+
+PROFILE_HEADER = "X-Profile"
+SAMPLES_HEADER = "X-Profile-Samples"
+_UNSAFE = re.compile(r"[^A-Za-z0-9_.-]")
+
+
+class _ProfiledRequest(object):
+    """
+    A request being profiled, samples counts the stacks taken of its thread
+    """
+
+    def __init__(self, endpoint):
+        self.endpoint = endpoint
+        self.samples = 0
+
+
+class _ProfilerState(object):
+    """
+    Per application state of the profiler
+    :ivar active: thread id to the profiled request the thread is handling
+    :ivar stacks: endpoint to the number of samples of every collapsed stack
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self.token = app.config["PROFILER_TOKEN"]
+        self.sample_rate = app.config["PROFILER_SAMPLE_RATE"]
+        self.interval = app.config["PROFILER_INTERVAL"]
+        self.flush_interval = app.config["PROFILER_FLUSH_INTERVAL"]
+        self.directory = app.config["PROFILER_DIR"]
+        self.lock = threading.Lock()
+        self.active = {}
+        self.stacks = {}
+        self.dirty = set()
+        self.labels = {}
+        self.wake = threading.Event()
+        self.stopped = threading.Event()
+        self.sampler = None
+        self.pid = None
+
+
+class Profiler(object):
+    """
+    Sampling profiler extension. With PROFILER_ENABLED off no request hook is registered at all
+    """
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """
+        Registers the profiler with the given application
+        :param app: current flask app
+        """
+        app.config.setdefault("PROFILER_ENABLED", True)
+        app.config.setdefault("PROFILER_TOKEN", None)
+        app.config.setdefault("PROFILER_SAMPLE_RATE", 0.0)
+        app.config.setdefault("PROFILER_INTERVAL", 0.005)
+        app.config.setdefault("PROFILER_FLUSH_INTERVAL", 10)
+        app.config.setdefault("PROFILER_DIR", os.path.join("tmp", "profiles"))
+        if not app.config["PROFILER_ENABLED"]:
+            return
+
+        app.extensions["profiler"] = _ProfilerState(app)
+        app.before_request(self._start)
+        app.after_request(self._tag_response)
+        app.teardown_request(self._finish)
+
+    @staticmethod
+    def _state(app=None):
+        return (app or current_app).extensions["profiler"]
+
+    def configure(self, app, sample_rate=None, directory=None):
+        """
+        Changes the sampled fraction of the traffic or the output directory of a running
+        application
+        :param app: flask app
+        :param sample_rate: fraction of the requests to profile, 1 for every request
+        :param directory: directory the collapsed stacks are written to
+        :raises: RuntimeError if the profiler of the application is turned off
+        """
+        if "profiler" not in app.extensions:
+            raise RuntimeError("The profiler is turned off, set PROFILER_ENABLED to profile requests")
+        state = self._state(app)
+        if sample_rate is not None:
+            state.sample_rate = sample_rate
+        if directory is not None:
+            state.directory = directory
+
+    @staticmethod
+    def _wanted(state):
+        header = request.headers.get(PROFILE_HEADER)
+        if header is not None:
+            if state.token and hmac.compare_digest(header.encode("utf-8"), state.token.encode("utf-8")):
+                return True
+            if header == "1" and current_user.is_authenticated and current_user.admin:
+                return True
+        return state.sample_rate > 0 and random.random() < state.sample_rate
+
+    def _start(self):
+        state = self._state()
+        if not self._wanted(state):
+            return
+        rule = request.url_rule
+        profiled = _ProfiledRequest(rule.endpoint if rule is not None else "unmatched")
+        _request_ctx_stack.top.profiled = profiled
+        with state.lock:
+            state.active[threading.get_ident()] = profiled
+        self._ensure_sampler(state)
+        state.wake.set()
+
+    @staticmethod
+    def _tag_response(response):
+        profiled = getattr(_request_ctx_stack.top, "profiled", None)
+        if profiled is not None:
+            response.headers[SAMPLES_HEADER] = str(profiled.samples)
+        return response
+
+    def _finish(self, exc):
+        profiled = getattr(_request_ctx_stack.top, "profiled", None)
+        if profiled is not None:
+            state = self._state()
+            with state.lock:
+                state.active.pop(threading.get_ident(), None)
+
+    def _label(self, state, frame):
+        code = frame.f_code
+        label = state.labels.get(code)
+        if label is None:
+            label = state.labels[code] = "{}:{}".format(frame.f_globals.get("__name__", "?"), code.co_name)
+        return label
+
+    def sample(self, app=None):
+        """
+        Takes one sample of the stacks of the threads handling profiled requests
+        :param app: flask app, defaults to the current app
+        :return: number of stacks sampled
+        :rtype: int
+        """
+        state = self._state(app)
+        with state.lock:
+            active = list(state.active.items())
+        if not active:
+            return 0
+        frames = sys._current_frames()
+        taken = 0
+        for ident, profiled in active:
+            frame = frames.get(ident)
+            if frame is None:
+                continue
+            labels = []
+            while frame is not None:
+                labels.append(self._label(state, frame))
+                frame = frame.f_back
+            stack = ";".join(reversed(labels))
+            with state.lock:
+                counts = state.stacks.setdefault(profiled.endpoint, {})
+                counts[stack] = counts.get(stack, 0) + 1
+                state.dirty.add(profiled.endpoint)
+            profiled.samples += 1
+            taken += 1
+        return taken
+
+    def flush(self, app=None):
+        """
+        Writes the collapsed stacks of the endpoints sampled since the last flush, each file
+        holds every sample of its endpoint taken by this process
+        :param app: flask app, defaults to the current app
+        :return: paths of the files written
+        :rtype: list
+        """
+        state = self._state(app)
+        with state.lock:
+            endpoints, state.dirty = state.dirty, set()
+            stacks = dict((endpoint, dict(state.stacks[endpoint])) for endpoint in endpoints)
+        if not stacks:
+            return []
+
+        os.makedirs(state.directory, exist_ok=True)
+        paths = []
+        for endpoint, counts in stacks.items():
+            path = os.path.join(state.directory, "{}.{}.folded".format(_UNSAFE.sub("_", endpoint), os.getpid()))
+            with open(path + ".tmp", "w") as f:
+                for stack, count in sorted(counts.items()):
+                    f.write("{} {}\n".format(stack, count))
+            os.replace(path + ".tmp", path)
+            paths.append(path)
+        return paths
+
+    def _ensure_sampler(self, state):
+        """
+        Starts the sampler thread of this process, a worker forked from a parent that had
+        already started it gets its own thread
+        """
+        if state.sampler is not None and state.pid == os.getpid():
+            return
+        with state.lock:
+            if state.sampler is not None and state.pid == os.getpid():
+                return
+            state.pid = os.getpid()
+            state.sampler = threading.Thread(target=self._run, args=(state,), name="profiler-sampler")
+            state.sampler.daemon = True
+            state.sampler.start()
+
+    def _run(self, state):
+        flushed = time.time()
+        while not state.stopped.is_set():
+            if not state.active:
+                # idle until a profiled request starts, writing what is left first
+                self._safe_flush(state)
+                state.wake.wait(state.flush_interval)
+                state.wake.clear()
+                continue
+            self.sample(state.app)
+            if time.time() - flushed >= state.flush_interval:
+                self._safe_flush(state)
+                flushed = time.time()
+            time.sleep(state.interval)
+        self._safe_flush(state)
+
+    def _safe_flush(self, state):
+        try:
+            self.flush(state.app)
+        except Exception as e:
+            app_logger.exception("Failed to write the profiles. Error => {}".format(e))
+
+    def stop(self, app):
+        """
+        Stops the sampler thread of the given application, writing the samples it has taken
+        :param app: flask app
+        """
+        state = self._state(app)
+        if state.sampler is not None:
+            state.stopped.set()
+            state.wake.set()
+            state.sampler.join()
+            state.sampler = None
+
+
+profiler = Profiler()
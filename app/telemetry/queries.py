@@ -0,0 +1,152 @@
+"""
+Per request SQL query counter.
+Every statement sent to the database while a request is handled is counted and timed through
+the engine events of SQLAlchemy. Statements that run more than once in the same request are
+flagged, they are usually a row fetched again by a decorator and a view or a loop loading rows
+one at a time (N+1). In debug mode the figures are sent back as response headers, otherwise they
+are written as one JSON log line per request.
+Statements run by a streamed response after its headers were sent are not counted
+"""
+import json
+import threading
+import time
+
+from flask import current_app, g, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from app import app_logger
+
+_listening = threading.Lock()
+_registered = False
+
+
+class QueryStats(object):
+    """
+    Statements run during a single request
+    :ivar count: number of statements executed
+    :ivar seconds: total time spent executing them
+    :ivar statements: SQL text to the parameters of every run of it
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0.0
+        self.statements = {}
+
+    def record(self, statement, parameters, seconds):
+        self.count += 1
+        self.seconds += seconds
+        runs = self.statements.setdefault(statement, [])
+        runs.append(repr(parameters))
+
+    def repeated(self, threshold):
+        """
+        Statements that ran at least threshold times, most repeated first
+        :param threshold: number of runs from which a statement is flagged
+        :return: the statement, how many times it ran and how many of those runs had the exact
+        same parameters as an earlier one
+        :rtype: list
+        """
+        flagged = [dict(statement=statement, count=len(runs), duplicates=len(runs) - len(set(runs)))
+                   for statement, runs in self.statements.items() if len(runs) >= threshold]
+        return sorted(flagged, key=lambda r: r["count"], reverse=True)
+
+
+class QueryCounter(object):
+    """
+    Counts the SQL statements of every request. QUERY_COUNTER_ENABLED turns it off and
+    QUERY_REPEAT_THRESHOLD sets how many runs of the same statement are flagged
+    """
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """
+        Registers the query counter with the given application
+        :param app: current flask app
+        """
+        app.config.setdefault("QUERY_COUNTER_ENABLED", True)
+        app.config.setdefault("QUERY_REPEAT_THRESHOLD", 2)
+        app.extensions["query_counter"] = app.config["QUERY_COUNTER_ENABLED"]
+
+        if app.config["QUERY_COUNTER_ENABLED"]:
+            self._listen()
+            app.before_request(self._start)
+            app.after_request(self._report)
+
+    @staticmethod
+    def _listen():
+        """
+        Hooks into the execution of every engine, once per process
+        """
+        global _registered
+        with _listening:
+            if not _registered:
+                event.listen(Engine, "before_cursor_execute", _before_cursor_execute)
+                event.listen(Engine, "after_cursor_execute", _after_cursor_execute)
+                _registered = True
+
+    @staticmethod
+    def stats():
+        """
+        Statements of the current request so far
+        :return: the query stats of the request or None outside of a request
+        :rtype: QueryStats
+        """
+        if not has_request_context():
+            return None
+        return g.get("_query_stats")
+
+    @staticmethod
+    def _start():
+        # g outlives the request when the app context was pushed beforehand, as in the tests
+        g._query_stats = QueryStats()
+
+    def _report(self, response):
+        stats = self.stats() or QueryStats()
+        repeated = stats.repeated(current_app.config["QUERY_REPEAT_THRESHOLD"])
+
+        if current_app.debug:
+            response.headers["X-Query-Count"] = str(stats.count)
+            response.headers["X-Query-Time"] = "{:.2f}".format(stats.seconds * 1000)
+            response.headers["X-Query-Repeated"] = str(len(repeated))
+            for r in repeated:
+                app_logger.debug("Statement ran {count} times in {path}: {statement}".format(
+                    path=request.path, **r))
+            return response
+
+        line = json.dumps(dict(event="sql_queries", method=request.method, path=request.path,
+                               endpoint=request.endpoint, status=response.status_code,
+                               queries=stats.count, db_ms=round(stats.seconds * 1000, 2),
+                               repeated=repeated))
+        if repeated:
+            app_logger.warning(line)
+        else:
+            app_logger.info(line)
+        return response
+
+
+def _counting():
+    return has_request_context() and current_app.extensions.get("query_counter")
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if _counting():
+        conn.info.setdefault("query_started", []).append(time.time())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started = conn.info.get("query_started")
+    if not started or not _counting():
+        return
+    seconds = time.time() - started.pop()
+    stats = g.get("_query_stats")
+    if stats is None:
+        stats = g._query_stats = QueryStats()
+    stats.record(statement, parameters, seconds)
+
+
+query_counter = QueryCounter()
@@ -44,8 +44,123 @@ class Config(object):
     SQLALCHEMY_MIGRATE_REPO = os.path.join(basedir, 'db_repository')
     SQLALCHEMY_TRACK_MODIFICATIONS = True
     SQLALCHEMY_DATABASE_URI = os.environ.get("DATABASE_URL")
+    # passed to the DBAPI connect call of every connection, e.g. {"connect_timeout": 5}
     DATABASE_CONNECT_OPTIONS = {}
 
+    # connection pool of every worker process, per database. Up to POOL_SIZE connections are kept
+    # open and MAX_OVERFLOW more are opened under load, a request waits at most POOL_TIMEOUT
+    # seconds for one. Connections are replaced after POOL_RECYCLE seconds and tested before use
+    # with PRE_PING, so connections dropped by the server or a proxy are not handed out. SQLite
+    # ignores the sizes
+    SQLALCHEMY_POOL_SIZE = 5
+    SQLALCHEMY_MAX_OVERFLOW = 10
+    SQLALCHEMY_POOL_TIMEOUT = 10
+    SQLALCHEMY_POOL_RECYCLE = 1800
+    SQLALCHEMY_POOL_PRE_PING = True
+
+    # read replicas of the primary, comma separated in DATABASE_REPLICA_URLS. GET requests to the
+    # bucket list endpoints read from one of them, except for clients that wrote within the last
+    # STICKY_SECONDS, which read from the primary to see their own writes
+    SQLALCHEMY_REPLICA_URIS = [uri for uri in os.environ.get("DATABASE_REPLICA_URLS", "").split(",") if uri]
+    SQLALCHEMY_REPLICA_STICKY_SECONDS = 10
+
+    # last seen tracking, repeat sightings within the window are dropped and the remaining ones
+    # are written in bulk every flush interval (seconds)
+    LAST_SEEN_UPDATE_WINDOW = 60
+    LAST_SEEN_FLUSH_INTERVAL = 30
+
+    # verified bearer tokens are cached per process, a token revoked by logging out in one worker
+    # process is still accepted by the others for at most the TTL (seconds)
+    AUTH_TOKEN_CACHE_SIZE = 1024
+    AUTH_TOKEN_CACHE_TTL = 60
+
+    # password hashing, the method sets the cost of key stretching. Hashes run in a pool of
+    # PASSWORD_HASH_WORKERS processes (0 hashes on the request thread) and at most
+    # PASSWORD_HASH_MAX_PENDING may wait for a worker before logins are turned away with a 503
+    PASSWORD_HASH_METHOD = os.environ.get("PASSWORD_HASH_METHOD") or "pbkdf2:sha256:150000"
+    PASSWORD_HASH_SALT_LENGTH = 8
+    PASSWORD_HASH_WORKERS = int(os.environ.get("PASSWORD_HASH_WORKERS", 2))
+    PASSWORD_HASH_MAX_PENDING = 64
+    PASSWORD_HASH_TIMEOUT = 10
+
+    # statements of every request are counted and timed, a statement running this many times in
+    # one request is flagged as a likely N+1 pattern. Reported as X-Query-* response headers in
+    # debug mode and as a JSON log line per request otherwise
+    QUERY_COUNTER_ENABLED = True
+    QUERY_REPEAT_THRESHOLD = 2
+
+    # list reads are cached per user and dropped whenever that user writes. The memory backend
+    # is local to every process, so with several worker processes a write only invalidates the
+    # cache of the process that handled it and the others serve stale lists for up to the TTL
+    # (seconds), use redis (needs the redis package) to share the cache. Empty turns it off
+    RESPONSE_CACHE_BACKEND = os.environ.get("RESPONSE_CACHE_BACKEND", "memory")
+    RESPONSE_CACHE_SIZE = 1024
+    RESPONSE_CACHE_TTL = 60
+    RESPONSE_CACHE_REDIS_URL = os.environ.get("RESPONSE_CACHE_REDIS_URL") or "redis://localhost:6379/0"
+
+    # writes are limited per address and per user with token buckets, a client may make count
+    # requests at once and then one every period / count. Limits are given per endpoint or per
+    # blueprint, as "<count>/<second|minute|hour|day> per <ip|user>". The memory backend counts
+    # in each process, so with several workers a client gets the limit once per worker, use redis
+    # (needs the redis package) to share the buckets. Empty turns the limiter off
+    RATELIMIT_BACKEND = os.environ.get("RATELIMIT_BACKEND", "memory")
+    RATELIMIT_REDIS_URL = os.environ.get("RATELIMIT_REDIS_URL") or "redis://localhost:6379/0"
+    RATELIMIT_LIMITS = {
+        # logging in and registering hash a password, the most expensive thing the app does
+        "auth.login": ["10/minute per ip", "5/minute per user"],
+        "auth.register": ["5/minute per ip"],
+        "bucketlist": ["120/minute per user"],
+    }
+
+    # number of reverse proxies in front of the app. The address, scheme and host of the client
+    # are read from the X-Forwarded-For, -Proto and -Host headers the proxies add, so the limits
+    # per ip count clients rather than the proxy. Keep it 0 when clients connect directly, they
+    # could otherwise send any address they like
+    PROXY_COUNT = int(os.environ.get("PROXY_COUNT", 0))
+
+    # encoder of the list responses, orjson, ujson or json. auto takes the first one installed
+    JSON_BACKEND = os.environ.get("JSON_BACKEND", "auto")
+
+    # JSON responses are sent as MessagePack to clients that prefer application/msgpack in their
+    # Accept header, needs the msgpack package
+    RESPONSE_MSGPACK = True
+    # responses are compressed with brotli (needs the brotli package) or gzip, as the client
+    # accepts. Bodies under COMPRESSION_MIN_SIZE bytes are sent as they are, they would barely
+    # shrink, streamed bodies are always compressed. Turn it off when a proxy compresses
+    COMPRESSION_ENABLED = True
+    COMPRESSION_MIN_SIZE = 1024
+    COMPRESSION_LEVEL = 6
+
+    # request counts, latency histograms and the counters of the caches, pool and workers are
+    # served at METRICS_PATH, behind a bearer token when METRICS_TOKEN is set. With
+    # METRICS_REQUIRE_TOKEN they are not served at all without a token. Under a pre forking
+    # server set METRICS_DIR to a directory of its own, emptied whenever the server starts, where
+    # every worker writes its counters every METRICS_DUMP_INTERVAL seconds for the others to add up
+    METRICS_ENABLED = True
+    METRICS_PATH = "/metrics"
+    METRICS_DIR = os.environ.get("METRICS_DIR")
+    METRICS_DUMP_INTERVAL = 5
+    METRICS_TOKEN = os.environ.get("METRICS_TOKEN")
+    METRICS_REQUIRE_TOKEN = False
+
+    # sampling profiler, a request is profiled when its X-Profile header holds PROFILER_TOKEN, when
+    # an admin sends X-Profile: 1 or when it falls in the PROFILER_SAMPLE_RATE fraction of the
+    # traffic. Stacks are sampled every PROFILER_INTERVAL seconds and written as collapsed stacks
+    # per endpoint to PROFILER_DIR every PROFILER_FLUSH_INTERVAL seconds
+    PROFILER_ENABLED = True
+    PROFILER_TOKEN = os.environ.get("PROFILER_TOKEN")
+    PROFILER_SAMPLE_RATE = float(os.environ.get("PROFILER_SAMPLE_RATE", 0))
+    PROFILER_INTERVAL = 0.005
+    PROFILER_FLUSH_INTERVAL = 10
+    PROFILER_DIR = os.environ.get("PROFILER_DIR") or os.path.join("tmp", "profiles")
+
+    # delta sync leaves out changes younger than this (seconds), giving the transactions that
+    # stamped them time to commit before a client's sync token moves past them
+    SYNC_SETTLE_SECONDS = 1
+
+    # largest number of operations accepted by the bucket list item batch endpoint
+    ITEM_BATCH_MAX_OPERATIONS = 1000
+
     SECURITY_PASSWORD_SALT = os.environ.get("SECURITY_PASSWORD_SALT") or 'precious_arco'
 
     ROOT_DIR = APP_ROOT
@@ -66,6 +181,27 @@ class Config(object):
     MAIL_SENDER = 'Admin <arcoadmin@arco.com>'
     MAIL_DEFAULT_SENDER = os.environ.get("MAIL_DEFAULT_SENDER")
 
+    # emails are queued in the mail_outbox table and sent in batches of MAIL_OUTBOX_BATCH_SIZE
+    # over one SMTP connection. A failed email is retried after MAIL_OUTBOX_RETRY_DELAY seconds,
+    # doubled on every further failure up to MAIL_OUTBOX_MAX_RETRY_DELAY, and kept as a dead
+    # letter after MAIL_OUTBOX_MAX_ATTEMPTS. A worker holding a batch for longer than the lease
+    # (seconds) is presumed dead. Every process polls the outbox from a thread every
+    # MAIL_OUTBOX_POLL_INTERVAL seconds, 0 leaves sending to manage.py mail_worker
+    MAIL_OUTBOX_BATCH_SIZE = 50
+    MAIL_OUTBOX_MAX_ATTEMPTS = 8
+    MAIL_OUTBOX_RETRY_DELAY = 30
+    MAIL_OUTBOX_MAX_RETRY_DELAY = 3600
+    MAIL_OUTBOX_LEASE = 300
+    MAIL_OUTBOX_POLL_INTERVAL = float(os.environ.get("MAIL_OUTBOX_POLL_INTERVAL", 5))
+
+    # log records are handed to the file, syslog and email handlers through a queue of at most
+    # LOG_QUEUE_SIZE records, records logged while it is full are dropped. At most LOG_MAIL_LIMIT
+    # error emails are sent per LOG_MAIL_WINDOW seconds and an error already emailed within the
+    # window is only counted
+    LOG_QUEUE_SIZE = 10000
+    LOG_MAIL_LIMIT = 10
+    LOG_MAIL_WINDOW = 300
+
     # # credentials for external service accounts
     # OAUTH_CREDENTIALS = {
     #     "facebook": {
@@ -81,7 +217,11 @@ class Config(object):
     @staticmethod
     def init_app(app):
         """Initializes the current application"""
-        pass
+        # handle proxy server headers
+        count = app.config["PROXY_COUNT"]
+        if count:
+            from werkzeug.middleware.proxy_fix import ProxyFix
+            app.wsgi_app = ProxyFix(app.wsgi_app, x_for=count, x_proto=count, x_host=count)
 
 
 class DevelopmentConfig(Config):
@@ -89,6 +229,8 @@ class DevelopmentConfig(Config):
 
     DEBUG = True
     SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URL')
+    SQLALCHEMY_POOL_SIZE = 2
+    SQLALCHEMY_MAX_OVERFLOW = 2
 
 
 class TestingConfig(Config):
@@ -102,6 +244,13 @@ class TestingConfig(Config):
     WTF_CSRF_ENABLED = False
     CSRF_ENABLED = False
     PRESERVE_CONTEXT_ON_EXCEPTION = False
+    LAST_SEEN_FLUSH_INTERVAL = 0
+    PASSWORD_HASH_METHOD = "pbkdf2:sha256:1000"
+    PASSWORD_HASH_WORKERS = 0
+    SYNC_SETTLE_SECONDS = 0
+    MAIL_OUTBOX_POLL_INTERVAL = 0
+    SQLALCHEMY_REPLICA_URIS = []
+    RATELIMIT_BACKEND = ""
 
 
 class ProductionConfig(Config):
@@ -111,14 +260,30 @@ class ProductionConfig(Config):
 
     SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URL')
     ADMINS = [os.environ.get("ADMIN_EMAIL_1")]
+    # sized for the threads of a worker process, keep POOL_SIZE + MAX_OVERFLOW times the number of
+    # worker processes below the connection limit of the database
+    SQLALCHEMY_POOL_SIZE = int(os.environ.get("DATABASE_POOL_SIZE", 10))
+    SQLALCHEMY_MAX_OVERFLOW = int(os.environ.get("DATABASE_MAX_OVERFLOW", 20))
+    SQLALCHEMY_POOL_RECYCLE = 600
+    # production servers run several worker processes, where the memory cache of one process
+    # serves a user's lists from before their writes in the others. The cache is only on by
+    # default when it is shared through redis
+    RESPONSE_CACHE_BACKEND = os.environ.get(
+        "RESPONSE_CACHE_BACKEND", "redis" if os.environ.get("RESPONSE_CACHE_REDIS_URL") else "")
+    # production servers run behind a reverse proxy or load balancer
+    PROXY_COUNT = int(os.environ.get("PROXY_COUNT", 1))
+    # the metrics name every endpoint and count authentication failures, they are only served to
+    # a scraper holding METRICS_TOKEN
+    METRICS_REQUIRE_TOKEN = True
 
     @classmethod
     def init_app(cls, app):
         Config.init_app(app)
 
-        # email errors to the administrators
+        # email errors to the administrators, from the thread of the log pipeline
         import logging
         from logging.handlers import SMTPHandler
+        from app.telemetry.logs import log_pipeline
         credentials = None
         secure = None
         if getattr(cls, 'MAIL_USERNAME', None) is not None:
@@ -128,12 +293,12 @@ class ProductionConfig(Config):
         mail_handler = SMTPHandler(
             mailhost=(cls.MAIL_SERVER, cls.MAIL_PORT),
             fromaddr=cls.MAIL_SENDER,
-            toaddrs=[cls.ADMINS],
+            toaddrs=cls.ADMINS,
             subject=cls.MAIL_SUBJECT_PREFIX + ' Application Error',
             credentials=credentials,
             secure=secure)
         mail_handler.setLevel(logging.ERROR)
-        app.logger.addHandler(mail_handler)
+        log_pipeline.add_handler(app, mail_handler)
 
 
 class HerokuConfig(ProductionConfig):
@@ -143,16 +308,13 @@ class HerokuConfig(ProductionConfig):
     def init_app(cls, app):
         ProductionConfig.init_app(app)
 
-        # handle proxy server headers
-        from werkzeug.contrib.fixers import ProxyFix
-        app.wsgi_app = ProxyFix(app.wsgi_app)
-
         # log to stderr
         import logging
         from logging import StreamHandler
+        from app.telemetry.logs import log_pipeline
         file_handler = StreamHandler()
         file_handler.setLevel(logging.WARNING)
-        app.logger.addHandler(file_handler)
+        log_pipeline.add_handler(app, file_handler)
 
 
 class UnixConfig(ProductionConfig):
@@ -163,9 +325,10 @@ class UnixConfig(ProductionConfig):
         # log to syslog
         import logging
         from logging.handlers import SysLogHandler
+        from app.telemetry.logs import log_pipeline
         syslog_handler = SysLogHandler()
         syslog_handler.setLevel(logging.WARNING)
-        app.logger.addHandler(syslog_handler)
+        log_pipeline.add_handler(app, syslog_handler)
 
 
 config = {
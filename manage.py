@@ -73,22 +73,116 @@ def test(cover=False):
         cov.erase()
 
 
-@manager.command
-def profile(length=25, profile_dir=None):
+@manager.option('-r', '--rate', type=float, default=1.0, help='fraction of the requests to profile')
+@manager.option('-d', '--profile-dir', dest='profile_dir', default=None,
+                help='directory the collapsed stacks are written to, PROFILER_DIR by default')
+def profile(rate, profile_dir):
     """
-    This module provides a simple WSGI profiler middleware for finding 
-    bottlenecks in web application. It uses the profile or cProfile 
-    module to do the profiling and writes the stats to the stream provided
-    
-    see: http://werkzeug.pocoo.org/docs/0.9/contrib/profiler/
+    Runs the development server with the sampling profiler on a fraction of the requests.
+    Stacks are written per endpoint in the collapsed format, render them with flamegraph.pl or
+    speedscope. The profiler runs on live servers as well, see the PROFILER settings
     """
-    from werkzeug.contrib.profiler import ProfilerMiddleware
+    from app.telemetry.profiler import profiler
 
-    app.config["PROFILE"] = True
-    app.wsgi_app = ProfilerMiddleware(app.wsgi_app, restrictions=[length], profile_dir=profile_dir)
+    try:
+        profiler.configure(app, sample_rate=rate, directory=profile_dir)
+    except RuntimeError as e:
+        raise SystemExit(str(e))
     app.run()
 
 
+@manager.option('-c', '--config', dest='config_name', default='testing',
+                help='configuration the benchmarked application is created with')
+@manager.option('-u', '--users', type=int, default=10, help='number of users to seed')
+@manager.option('-l', '--lists', type=int, default=5, help='number of bucket lists per user')
+@manager.option('-i', '--items', type=int, default=20, help='number of items per bucket list')
+@manager.option('-n', '--operations', type=int, default=1000,
+                help='number of operations to run per transport')
+@manager.option('-w', '--concurrency', type=int, default=4, help='number of concurrent clients')
+@manager.option('-t', '--transport', default='both', choices=['inprocess', 'socket', 'both'],
+                help='drive the app in process, over a local socket or both')
+@manager.option('-x', '--mix', default=None, help='operation weights, e.g. login=1,list=4,search=2,crud=3')
+@manager.option('-d', '--database', default=None,
+                help='database to benchmark against, its tables are dropped. Defaults to a temporary SQLite database')
+@manager.option('-s', '--seed', type=int, default=0, help='seed of the random generators')
+@manager.option('-o', '--output', default=None, help='file to write the JSON report to')
+def bench(config_name, users, lists, items, operations, concurrency, transport, mix, database, seed,
+          output):
+    """
+    Seeds a database and reports the latency percentiles and throughput of the app under a mix
+    of logins, listings, searches and item operations as JSON
+    """
+    import json
+    from app.commands.bench import run_benchmark, parse_mix, TRANSPORTS
+
+    report = run_benchmark(config_name=config_name, users=users, lists=lists, items=items,
+                           operations=operations, concurrency=concurrency,
+                           transports=TRANSPORTS if transport == 'both' else (transport,),
+                           mix=parse_mix(mix) if mix else None, database_url=database,
+                           seed_value=seed)
+    text = json.dumps(report, indent=2, default=str)
+    if output:
+        with open(output, 'w') as f:
+            f.write(text)
+    print(text)
+
+
+@manager.option('-i', '--items', type=int, default=5000, help='number of items in the encoded list')
+@manager.option('-r', '--repeat', type=int, default=20, help='number of times every measurement is repeated')
+@manager.option('-o', '--output', default=None, help='file to write the JSON report to')
+def bench_encoding(items, repeat, output):
+    """
+    Reports the payload size and CPU time of every response encoding and compression level as
+    JSON
+    """
+    import json
+    from app.commands.encoding_bench import run_encoding_benchmark
+
+    text = json.dumps(run_encoding_benchmark(items=items, repeat=repeat), indent=2)
+    if output:
+        with open(output, 'w') as f:
+            f.write(text)
+    print(text)
+
+
+@manager.option('-u', '--users', type=int, default=100, help='number of users to generate')
+@manager.option('-l', '--lists', type=int, default=10, help='number of bucket lists per user')
+@manager.option('-i', '--items', type=int, default=10, help='number of items per bucket list')
+@manager.option('-s', '--seed', type=int, default=0, help='seed of the generator, the same seed gives the same data')
+@manager.option('-p', '--password', default='password', help='password of every generated user')
+@manager.option('-b', '--batch-size', dest='batch_size', type=int, default=10000,
+                help='number of rows written per statement')
+def seed(users, lists, items, seed, password, batch_size):
+    """
+    Fills the database with generated users, profiles, bucket lists and items
+    """
+    import json
+    from app.commands.seed import seed_database
+
+    result = seed_database(users, lists, items, seed=seed, password=password, batch_size=batch_size)
+    print(json.dumps(result.to_json(), indent=2))
+
+
+@manager.option('-i', '--interval', type=float, default=5, help='seconds between polls of the outbox')
+@manager.option('-o', '--once', action='store_true', default=False,
+                help='send what is due and exit instead of polling')
+@manager.option('-r', '--requeue', action='store_true', default=False,
+                help='give the dead letters a new set of attempts first')
+def mail_worker(interval, once, requeue):
+    """
+    Sends the emails queued in the outbox
+    """
+    import threading
+    from app.outbox import outbox
+
+    if requeue:
+        app_logger.info("Requeued {} dead letters".format(outbox.requeue(app)))
+    stopped = threading.Event()
+    if once:
+        stopped.set()
+    outbox.work(app, interval, stopped)
+
+
 @manager.option('-m', '--migration', help='create database from migrations',
                 action='store_true', default=None)
 def init_db(migration):
@@ -103,7 +197,7 @@ def init_db(migration):
         # create database from model schema directly
         db.create_all()
         db.session.commit()
-        cfg = alembic.config.Config("app/migrations/alembic.ini")
+        cfg = alembic.config.Config("migrations/alembic.ini")
         alembic.command.stamp(cfg, "head")
 
 
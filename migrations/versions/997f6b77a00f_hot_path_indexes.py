@@ -0,0 +1,54 @@
+"""hot path indexes
+
+Revision ID: 997f6b77a00f
+Revises: 339b7167dfe3
+Create Date: 2026-10-18 19:54:32.719797
+
+"""
+import hashlib
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '997f6b77a00f'
+down_revision = '339b7167dfe3'
+branch_labels = None
+depends_on = None
+
+
+sessions = sa.table('sessions',
+                    sa.column('id', sa.Integer),
+                    sa.column('token', sa.String),
+                    sa.column('token_hash', sa.String))
+
+
+def upgrade():
+    op.create_index('ix_bucketlist_items_bucketlist_id_id', 'bucketlist_items', ['bucketlist_id', 'id'], unique=False)
+    op.create_index('ix_bucketlists_created_by_date_created_id', 'bucketlists', ['created_by', 'date_created', 'id'], unique=False)
+    op.add_column('sessions', sa.Column('token_hash', sa.String(length=64), nullable=True))
+
+    # backfill the digests of existing sessions, sessions repeating a token are dropped so the
+    # digest can be unique
+    connection = op.get_bind()
+    seen = set()
+    for session_id, token in connection.execute(sa.select([sessions.c.id, sessions.c.token]).order_by(sessions.c.id)):
+        token_hash = hashlib.sha256((token or '').encode('utf-8')).hexdigest()
+        if token_hash in seen:
+            connection.execute(sessions.delete().where(sessions.c.id == session_id))
+            continue
+        seen.add(token_hash)
+        connection.execute(sessions.update().where(sessions.c.id == session_id).values(token_hash=token_hash))
+
+    with op.batch_alter_table('sessions') as batch_op:
+        batch_op.alter_column('token_hash', existing_type=sa.String(length=64), nullable=False)
+    op.create_index('ix_sessions_token_hash', 'sessions', ['token_hash'], unique=True)
+
+
+def downgrade():
+    op.drop_index('ix_sessions_token_hash', table_name='sessions')
+    with op.batch_alter_table('sessions') as batch_op:
+        batch_op.drop_column('token_hash')
+    op.drop_index('ix_bucketlists_created_by_date_created_id', table_name='bucketlists')
+    op.drop_index('ix_bucketlist_items_bucketlist_id_id', table_name='bucketlist_items')
@@ -0,0 +1,65 @@
+"""search indexes
+
+Revision ID: d03cc52ba17e
+Revises: 997f6b77a00f
+Create Date: 2026-10-18 19:57:25.410303
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd03cc52ba17e'
+down_revision = '997f6b77a00f'
+branch_labels = None
+depends_on = None
+
+
+tables = ['bucketlists', 'bucketlist_items']
+
+
+def upgrade():
+    dialect = op.get_bind().dialect.name
+
+    if dialect == 'sqlite':
+        for table in tables:
+            fts = table + '_fts'
+            op.execute("CREATE VIRTUAL TABLE {fts} USING fts5(name, content='{table}', content_rowid='id')"
+                       .format(fts=fts, table=table))
+            op.execute("CREATE TRIGGER {fts}_ai AFTER INSERT ON {table} BEGIN "
+                       "INSERT INTO {fts}(rowid, name) VALUES (new.id, new.name); END"
+                       .format(fts=fts, table=table))
+            op.execute("CREATE TRIGGER {fts}_ad AFTER DELETE ON {table} BEGIN "
+                       "INSERT INTO {fts}({fts}, rowid, name) VALUES ('delete', old.id, old.name); END"
+                       .format(fts=fts, table=table))
+            op.execute("CREATE TRIGGER {fts}_au AFTER UPDATE OF name ON {table} BEGIN "
+                       "INSERT INTO {fts}({fts}, rowid, name) VALUES ('delete', old.id, old.name); "
+                       "INSERT INTO {fts}(rowid, name) VALUES (new.id, new.name); END"
+                       .format(fts=fts, table=table))
+            # index the rows that already exist
+            op.execute("INSERT INTO {fts}({fts}) VALUES ('rebuild')".format(fts=fts))
+
+    elif dialect == 'postgresql':
+        op.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+        for table in tables:
+            op.execute("CREATE INDEX ix_{table}_name_tsv ON {table} USING gin (to_tsvector('simple', name))"
+                       .format(table=table))
+            op.execute('CREATE INDEX ix_{table}_name_trgm ON {table} USING gin (name gin_trgm_ops)'
+                       .format(table=table))
+
+
+def downgrade():
+    dialect = op.get_bind().dialect.name
+
+    if dialect == 'sqlite':
+        for table in tables:
+            fts = table + '_fts'
+            for trigger in ('ai', 'ad', 'au'):
+                op.execute('DROP TRIGGER IF EXISTS {fts}_{trigger}'.format(fts=fts, trigger=trigger))
+            op.execute('DROP TABLE IF EXISTS {fts}'.format(fts=fts))
+
+    elif dialect == 'postgresql':
+        for table in tables:
+            op.execute('DROP INDEX IF EXISTS ix_{table}_name_tsv'.format(table=table))
+            op.execute('DROP INDEX IF EXISTS ix_{table}_name_trgm'.format(table=table))
@@ -1,10 +1,18 @@
 import json
+import threading
 import unittest
+from datetime import datetime, timedelta
 
+from flask import g
 from flask_api.exceptions import AuthenticationFailed
 from flask_login import current_user
 
-from app.exceptions.handler import UserAlreadyExists, CredentialsRequired
+from app.exceptions.handler import UserAlreadyExists, CredentialsRequired, HashingQueueFull
+from app.mod_auth.hashing import password_hasher
+from app.mod_auth.last_seen import last_seen
+from app.mod_auth.models import UserAccount, Session
+from app.mod_auth.token_cache import token_cache
+from app.mod_auth.security_utils import generate_auth_token
 from tests import BaseTestCase
 
 
@@ -95,5 +103,142 @@ class LoginTestCases(BaseTestCase):
         self.assertIsNone(jwt_token)
 
 
+class TokenAuthenticationTestCases(BaseTestCase):
+    """Tests for the token authentication pipeline"""
+
+    def test_malformed_token_raises_error(self):
+        """Test that a token that is not a valid JWT is rejected"""
+        self.login()
+        with self.assertRaises(AuthenticationFailed):
+            self.client.get("/bucketlists/", headers={"Authorization": "Bearer not.a.token"})
+
+    def test_token_without_session_raises_error(self):
+        """Test that a correctly signed token without a login session is rejected"""
+        self.login()
+        with self.app.test_request_context():
+            token = generate_auth_token("user1", "not_the_session_password")
+        with self.assertRaises(AuthenticationFailed):
+            self.client.get("/bucketlists/", headers={"Authorization": "Bearer {0}".format(token)})
+
+    def test_authenticated_user_and_session_are_attached_to_request(self):
+        """Test the resolved user account and session are available on flask.g"""
+        with self.client:
+            headers = {"Authorization": "Bearer {0}".format(self.get_jwt_token())}
+            self.client.get("/bucketlists/", headers=headers)
+            self.assertEqual(g.auth_user.username, "user1")
+            self.assertIsNotNone(g.auth_session_id)
+
+    def test_repeat_requests_are_served_from_token_cache(self):
+        """Test a verified token is cached and reused by later requests"""
+        headers = {"Authorization": "Bearer {0}".format(self.get_jwt_token())}
+        store = self.app.extensions["token_cache"]
+
+        self.client.get("/bucketlists/", headers=headers)
+        self.assertEqual(len(store.entries), 1)
+        hits = store.hits
+
+        self.client.get("/bucketlists/", headers=headers)
+        self.assertEqual(store.hits, hits + 1)
+
+    def test_logout_invalidates_token(self):
+        """Test logging out drops the token from the cache and deletes its session"""
+        with self.client:
+            token = self.get_jwt_token()
+            headers = {"Authorization": "Bearer {0}".format(token)}
+            self.client.get("/bucketlists/", headers=headers)
+            self.client.get("/auth/logout/", headers=headers)
+
+            self.assertIsNone(token_cache.get(token))
+            self.assertIsNone(Session.query.filter_by(token=token).first())
+
+
+class PasswordHashingTestCases(BaseTestCase):
+    """Tests for the password hashing executor"""
+
+    def test_passwords_are_hashed_with_configured_method(self):
+        """Test that password hashes use the configured method and cost"""
+        user = UserAccount.query.filter_by(username="user1").first()
+        self.assertTrue(user.password_hash.startswith("pbkdf2:sha256:1000$"))
+        self.assertTrue(user.verify_password("user1_pass"))
+        self.assertFalse(user.verify_password("user2_pass"))
+
+    def test_hashing_in_worker_processes(self):
+        """Test hashing round trips through the process pool"""
+        self.app.extensions["password_hasher"].workers = 1
+        completed = password_hasher.metrics()["completed"]
+        try:
+            password_hash = password_hasher.hash("process_pool_pass")
+            self.assertTrue(password_hasher.verify(password_hash, "process_pool_pass"))
+            self.assertEqual(password_hasher.metrics()["completed"], completed + 2)
+        finally:
+            password_hasher.shutdown(self.app)
+
+    def test_full_queue_rejects_hashing(self):
+        """Test hashing is turned away once the pending queue is full"""
+        state = self.app.extensions["password_hasher"]
+        state.slots = threading.BoundedSemaphore(1)
+        state.slots.acquire()
+        with self.assertRaises(HashingQueueFull):
+            password_hasher.hash("rejected_pass")
+        self.assertEqual(password_hasher.metrics()["rejected"], 1)
+
+    def test_timed_out_hash_is_turned_away_and_keeps_its_slot(self):
+        """Test a hash outlasting the timeout is a 503 that holds its slot until it finishes"""
+        state = self.app.extensions["password_hasher"]
+        state.workers = 1
+        state.timeout = 0.01
+        state.method = "pbkdf2:sha256:2000000"
+        state.slots = threading.BoundedSemaphore(1)
+        completed = password_hasher.metrics()["completed"]
+        try:
+            with self.assertRaises(HashingQueueFull):
+                password_hasher.hash("slow_pass")
+            metrics = password_hasher.metrics()
+            self.assertEqual((metrics["failed"], metrics["completed"], metrics["in_flight"]),
+                             (1, completed, 1))
+            with self.assertRaises(HashingQueueFull):
+                password_hasher.hash("another_pass")
+            self.assertEqual(password_hasher.metrics()["rejected"], 1)
+        finally:
+            password_hasher.shutdown(self.app)
+        self.assertEqual(password_hasher.metrics()["in_flight"], 0)
+        self.assertTrue(state.slots.acquire(False))
+
+
+class LastSeenTestCases(BaseTestCase):
+    """Tests for the write behind last seen tracker"""
+
+    def test_authenticated_request_updates_last_seen(self):
+        """Test that an authenticated request records when the user was last seen"""
+        headers = {"Authorization": "Bearer {0}".format(self.get_jwt_token())}
+        self.client.get("/bucketlists/", headers=headers)
+        self.db.session.expire_all()
+        user = UserAccount.query.filter_by(username="user1").first()
+        self.assertIsNotNone(user.last_seen)
+
+    def test_repeat_sightings_within_window_are_coalesced(self):
+        """Test that sightings within the update window are not written again"""
+        user = UserAccount.query.filter_by(username="user1").first()
+        now = datetime.now()
+        self.assertTrue(last_seen.touch(user.id, now))
+        self.assertFalse(last_seen.touch(user.id, now + timedelta(seconds=5)))
+        self.assertTrue(last_seen.touch(user.id, now + timedelta(minutes=5)))
+
+    def test_pending_sightings_are_flushed_in_bulk(self):
+        """Test that pending sightings of several users are written by a single flush"""
+        self.app.extensions["last_seen"].interval = 3600
+        users = UserAccount.query.all()
+        seen_at = datetime(2017, 1, 1, 12, 0, 0)
+        for user in users:
+            self.app.extensions["last_seen"].pending[user.id] = seen_at
+
+        self.assertEqual(last_seen.flush(), len(users))
+        self.assertEqual(last_seen.flush(), 0)
+
+        self.db.session.expire_all()
+        for user in UserAccount.query.all():
+            self.assertEqual(user.last_seen, seen_at)
+
+
 if __name__ == "__main__":
     unittest.main()
@@ -1,9 +1,16 @@
 import json
 import unittest
+from datetime import datetime, timedelta
 from flask_api.exceptions import PermissionDenied, NotFound
 from faker import Faker
+from werkzeug.http import http_date
+from app.exceptions.handler import InvalidCursor, InvalidLimit
 from app.mod_bucketlist.exceptions import NullBucketListException, NullReferenceException
-from app.mod_bucketlist.models import BucketListItem, BucketList
+from app.mod_bucketlist.loaders import load_bucketlist, load_item
+from app.mod_auth.models import UserAccount
+from app.mod_bucketlist.models import BucketListItem, BucketList, Tombstone
+from app.mod_bucketlist.sync import changes_since
+from app.telemetry.queries import query_counter
 from tests import BaseTestCase
 
 
@@ -164,6 +171,39 @@ class BucketListTestCase(BaseTestCase):
         # Return a maximum of 100 bucketlist items if limit > 100
         self.assertEqual(rv_length, 100)
 
+    def test_cursor_pagination_walks_all_bucketlists(self):
+        """Test following next_cursor returns every bucketlist exactly once"""
+        headers = self.get_headers()
+        for i in range(0, 7):
+            self.client.post('/bucketlists/', data={'name': 'Cursor list {}'.format(i)},
+                             headers=headers)
+
+        seen, cursor = [], ""
+        while cursor is not None:
+            rv = self.client.get('/bucketlists/', headers=headers,
+                                 query_string={"limit": 3, "cursor": cursor})
+            self.assert200(rv)
+            rv_data = json.loads(rv.data.decode("utf-8"))
+            self.assertLessEqual(len(rv_data["message"]), 3)
+            seen.extend(item["id"] for item in rv_data["message"])
+            cursor = rv_data["next_cursor"]
+
+        # user1 already owns one bucketlist from the fixtures
+        self.assertEqual(len(seen), 8)
+        self.assertEqual(len(set(seen)), 8)
+
+    def test_zero_limit_raises_error(self):
+        """Test that a limit of 0 is rejected, with or without a cursor"""
+        for query_string in ({"limit": 0, "cursor": ""}, {"limit": 0}):
+            with self.assertRaises(InvalidLimit):
+                self.client.get('/bucketlists/', headers=self.get_headers(), query_string=query_string)
+
+    def test_invalid_cursor_raises_error(self):
+        """Test that a tampered cursor is rejected"""
+        with self.assertRaises(InvalidCursor):
+            self.client.get('/bucketlists/', headers=self.get_headers(),
+                            query_string={"cursor": "not-a-cursor"})
+
 
 class BucketListByIdTestCases(BaseTestCase):
     """Test cases for bucketlist route by id"""
@@ -208,6 +248,12 @@ class BucketListByIdTestCases(BaseTestCase):
         results = self.client.get("/bucketlists/1", headers=self.get_headers())
         self.assertIn("Eat! Eat a lot of food", results.data.decode("utf-8"))
 
+    def test_user_can_not_access_bucketlist_of_another_user(self):
+        """Test that a bucket list of another user can not be read or deleted"""
+        with self.assertRaises(PermissionDenied):
+            self.client.delete("/bucketlists/2", headers=self.get_headers())
+        self.assertIsNotNone(BucketList.query.get(2))
+
 
 class BucketListItemTestCases(BaseTestCase):
     """Tests for a single bucketlist item"""
@@ -220,6 +266,49 @@ class BucketListItemTestCases(BaseTestCase):
         self.assertIn("User1 Bucketlist Item 2", response.data.decode("utf-8"))
         self.assert200(response)
 
+    def test_bucketlist_items_are_paginated_with_cursor(self):
+        """Test that bucket list items are paged with limit and next_cursor"""
+        headers = self.get_headers()
+        response = self.client.get("/bucketlists/1/items", headers=headers,
+                                   query_string={"limit": 2})
+        first_page = json.loads(response.data.decode("utf-8"))
+        self.assertEqual(len(first_page["items"]), 2)
+        self.assertIsNotNone(first_page["next_cursor"])
+
+        response = self.client.get("/bucketlists/1/items", headers=headers,
+                                   query_string={"limit": 2, "cursor": first_page["next_cursor"]})
+        second_page = json.loads(response.data.decode("utf-8"))
+        self.assertEqual([item["name"] for item in second_page["items"]],
+                         ["User1 Bucketlist Item 2"])
+        self.assertIsNone(second_page["next_cursor"])
+
+    def test_bucketlist_items_are_not_paged_without_limit_or_cursor(self):
+        """Test that every item is returned when neither limit nor cursor is given"""
+        for n in range(25):
+            self.db.session.add(BucketListItem(1, "Extra item {}".format(n)))
+        self.db.session.commit()
+
+        response = self.client.get("/bucketlists/1/items", headers=self.get_headers())
+        data = json.loads(response.data.decode("utf-8"))
+        self.assertEqual(len(data["items"]), 28)
+        self.assertNotIn("next_cursor", data)
+
+        response = self.client.get("/bucketlists/1/items", headers=self.get_headers(),
+                                   query_string={"cursor": ""})
+        data = json.loads(response.data.decode("utf-8"))
+        self.assertEqual(len(data["items"]), 20)
+        self.assertIsNotNone(data["next_cursor"])
+
+    def test_bucketlist_items_can_be_streamed(self):
+        """Test that stream=1 returns every item as one JSON document"""
+        response = self.client.get("/bucketlists/1/items", headers=self.get_headers(),
+                                   query_string={"stream": 1})
+        self.assert200(response)
+        data = json.loads(response.data.decode("utf-8"))
+        self.assertEqual(data["message"], "User1 Bucketlist bucket list items")
+        self.assertEqual(len(data["items"]), 3)
+        self.assertEqual(set(data["items"][0]), {"id", "bucketlist_id", "name", "done"})
+
     def test_user_can_create_a_bucket_list_item(self):
         """Test that a user can create a bucketlist item for a single bucketlist"""
         data = {"name": "Buy a car"}
@@ -277,5 +366,309 @@ class BucketListItemTestCases(BaseTestCase):
             self.assert404(get_response)
 
 
+class BucketListItemBatchTestCases(BaseTestCase):
+    """Tests for batch operations on bucketlist items"""
+
+    def post_batch(self, operations):
+        return self.client.post("/bucketlists/1/items/batch", headers=self.get_headers(),
+                                data=json.dumps(operations), content_type="application/json")
+
+    def test_batch_operations_are_applied(self):
+        """Test that creates, updates and deletes of a batch are all applied"""
+        response = self.post_batch([
+            {"op": "create", "name": "Climb a mountain"},
+            {"op": "create", "name": "Learn to sail", "done": True},
+            {"op": "update", "id": 1, "name": "Renamed item", "done": "true"},
+            {"op": "delete", "id": 3},
+        ])
+        self.assert200(response)
+        results = json.loads(response.data.decode("utf-8"))["results"]
+        self.assertEqual([r["status"] for r in results], [201, 201, 200, 200])
+
+        created = BucketListItem.query.get(results[0]["id"])
+        self.assertEqual(created.name, "Climb a mountain")
+        self.assertEqual(created.bucketlist_id, 1)
+        self.assertTrue(BucketListItem.query.get(results[1]["id"]).done)
+
+        updated = BucketListItem.query.get(1)
+        self.assertEqual(updated.name, "Renamed item")
+        self.assertTrue(updated.done)
+        self.assertIsNone(BucketListItem.query.get(3))
+
+    def test_invalid_batch_is_not_applied(self):
+        """Test that nothing is applied when one operation is invalid"""
+        response = self.post_batch([
+            {"op": "create", "name": "Climb a mountain"},
+            {"op": "delete", "id": 2},
+        ])
+        self.assert400(response)
+        results = json.loads(response.data.decode("utf-8"))["results"]
+        self.assertNotIn("status", results[0])
+        self.assertEqual(results[1]["status"], 400)
+        self.assertIsNone(BucketListItem.query.filter_by(name="Climb a mountain").first())
+
+    def test_boolean_ids_are_rejected(self):
+        """Test that true is not taken for the id 1"""
+        response = self.post_batch([{"op": "delete", "id": True}])
+        self.assert400(response)
+        self.assertIsNotNone(BucketListItem.query.get(1))
+
+    def test_batch_with_duplicate_names_is_rolled_back(self):
+        """Test that a constraint violation rolls the whole batch back"""
+        response = self.post_batch([
+            {"op": "delete", "id": 1},
+            {"op": "create", "name": "User2 Bucketlist item 0"},
+        ])
+        self.assertEqual(response.status_code, 409)
+        self.assertIsNotNone(BucketListItem.query.get(1))
+
+
+class ResourceLoaderTestCases(BaseTestCase):
+    """Tests for loading bucket lists and items once per request"""
+
+    def test_item_and_bucketlist_are_loaded_in_one_query(self):
+        """Test that an item is fetched with its bucket list and both are cached"""
+        with self.app.test_request_context():
+            self.app.preprocess_request()
+            item = load_item(1, 1)
+            self.assertEqual(query_counter.stats().count, 1)
+
+            self.assertIs(load_item(1, 1), item)
+            self.assertEqual(load_bucketlist(1).id, item.bucketlist_id)
+            self.assertEqual(query_counter.stats().count, 1)
+
+    def test_item_of_another_bucketlist_is_not_loaded(self):
+        """Test that an item is only found through the bucket list it belongs to"""
+        with self.app.test_request_context():
+            self.assertIsNone(load_item(2, 1))
+            self.assertIsNotNone(load_item(1, 1))
+
+    def test_item_routes_do_not_repeat_queries(self):
+        """Test that the item routes fetch the bucket list and item only once"""
+        headers = self.get_headers()
+        for method in ("get", "put"):
+            response = getattr(self.client, method)("/bucketlists/1/items/1", headers=headers,
+                                                    data={"done": "true"})
+            self.assert200(response)
+            self.assertEqual(response.headers["X-Query-Repeated"], "0")
+
+    def test_missing_item_raises_error(self):
+        """Test that an item that is not in the bucket list is not found"""
+        with self.assertRaises(NullReferenceException):
+            self.client.get("/bucketlists/1/items/2", headers=self.get_headers())
+
+
+class ConditionalGetTestCases(BaseTestCase):
+    """Tests for ETag and Last-Modified validation of the bucket list resources"""
+
+    def assertRevalidates(self, path, collection=False):
+        """Asserts that a second GET with the validators of the first gets a 304"""
+        headers = self.get_headers()
+        response = self.client.get(path, headers=headers)
+        self.assert200(response)
+        etag = response.headers["ETag"]
+        self.assertTrue(etag.startswith('W/"'))
+
+        cached = self.client.get(path, headers=dict(headers, **{"If-None-Match": etag}))
+        self.assertEqual(cached.status_code, 304)
+        self.assertEqual(cached.data, b"")
+        self.assertEqual(cached.headers["ETag"], etag)
+
+        if collection:
+            self.assertNotIn("Last-Modified", response.headers)
+        else:
+            since = self.client.get(path, headers=dict(
+                headers, **{"If-Modified-Since": response.headers["Last-Modified"]}))
+            self.assertEqual(since.status_code, 304)
+        return headers, etag
+
+    def test_bucketlists_revalidate(self):
+        """Test that an unchanged list of bucket lists is not sent again"""
+        headers, etag = self.assertRevalidates("/bucketlists/", collection=True)
+
+        self.client.post("/bucketlists/", headers=headers, data={"name": "Another one"})
+        response = self.client.get("/bucketlists/", headers=dict(headers, **{"If-None-Match": etag}))
+        self.assert200(response)
+        self.assertNotEqual(response.headers["ETag"], etag)
+
+    def test_pages_have_their_own_etag(self):
+        """Test that different pages of the same rows have different tags"""
+        headers = self.get_headers()
+        first = self.client.get("/bucketlists/", headers=headers, query_string={"limit": 1})
+        second = self.client.get("/bucketlists/", headers=headers, query_string={"limit": 2})
+        self.assertNotEqual(first.headers["ETag"], second.headers["ETag"])
+
+    def test_bucketlist_revalidates(self):
+        """Test that an unchanged bucket list is not sent again until it is edited"""
+        headers, etag = self.assertRevalidates("/bucketlists/1")
+
+        self.client.put("/bucketlists/1", headers=headers, data={"name": "Renamed"})
+        response = self.client.get("/bucketlists/1", headers=dict(headers, **{"If-None-Match": etag}))
+        self.assert200(response)
+
+    def test_items_revalidate(self):
+        """Test that unchanged items are not sent again until one is deleted"""
+        headers, etag = self.assertRevalidates("/bucketlists/1/items", collection=True)
+
+        self.client.delete("/bucketlists/1/items/3", headers=headers)
+        response = self.client.get("/bucketlists/1/items",
+                                   headers=dict(headers, **{"If-None-Match": etag}))
+        self.assert200(response)
+
+    def test_deletes_are_not_hidden_by_if_modified_since(self):
+        """Test that a list is sent again after a delete, whatever If-Modified-Since says"""
+        headers = self.get_headers()
+        created = self.client.post("/bucketlists/", headers=headers, data={"name": "Short lived"})
+        bucketlist_id = json.loads(created.data.decode("utf-8"))["bucketlist"]["id"]
+        since = {"If-Modified-Since": http_date(datetime.utcnow() + timedelta(hours=1))}
+        for path, deleted in (("/bucketlists/", "/bucketlists/{}".format(bucketlist_id)),
+                              ("/bucketlists/1/items", "/bucketlists/1/items/3")):
+            response = self.client.get(path, headers=headers)
+            self.assert200(response)
+            self.client.delete(deleted, headers=headers)
+
+            response = self.client.get(path, headers=dict(headers, **since))
+            self.assert200(response)
+            # served again from the response cache
+            response = self.client.get(path, headers=dict(headers, **since))
+            self.assert200(response)
+            self.assertEqual(response.headers["X-Cache"], "HIT")
+
+    def test_item_revalidates(self):
+        """Test that an unchanged item is not sent again until it is edited"""
+        headers, etag = self.assertRevalidates("/bucketlists/1/items/1")
+
+        self.client.put("/bucketlists/1/items/1", headers=headers, data={"done": "true"})
+        response = self.client.get("/bucketlists/1/items/1",
+                                   headers=dict(headers, **{"If-None-Match": etag}))
+        self.assert200(response)
+
+
+class DeltaSyncTestCases(BaseTestCase):
+    """Tests for the changes endpoint used for delta sync"""
+
+    def sync(self, headers, **params):
+        response = self.client.get("/bucketlists/changes", headers=headers, query_string=params)
+        self.assert200(response)
+        return json.loads(response.data.decode("utf-8"))
+
+    def test_first_sync_returns_everything_of_user(self):
+        """Test that a sync without a token returns every bucket list and item of the user"""
+        data = self.sync(self.get_headers())
+        self.assertFalse(data["has_more"])
+        self.assertEqual(sorted((c["type"], c["id"]) for c in data["changes"]),
+                         [("bucketlist", 1), ("item", 1), ("item", 3), ("item", 5)])
+        self.assertTrue(all(c["op"] == "upsert" for c in data["changes"]))
+
+    def test_sync_returns_only_changes_since_token(self):
+        """Test that a sync with a token returns the creates, updates and deletes after it"""
+        headers = self.get_headers()
+        token = self.sync(headers)["next_token"]
+        self.assertEqual(self.sync(headers, since=token)["changes"], [])
+
+        self.client.put("/bucketlists/1/items/1", headers=headers, data={"done": "true"})
+        self.client.post("/bucketlists/1/items", headers=headers, data={"name": "Buy a car"})
+        self.client.delete("/bucketlists/1/items/3", headers=headers)
+        self.client.post("/bucketlists/1/items/batch", headers=headers,
+                         data=json.dumps([{"op": "delete", "id": 5}]), content_type="application/json")
+
+        data = self.sync(headers, since=token)
+        changes = [(c["type"], c["op"], c.get("name")) for c in data["changes"]]
+        self.assertEqual(changes, [("item", "upsert", "User1 Bucketlist Item 0"),
+                                   ("item", "upsert", "Buy a car"),
+                                   ("item", "delete", None),
+                                   ("item", "delete", None)])
+        self.assertEqual([c["id"] for c in data["changes"] if c["op"] == "delete"], [3, 5])
+        self.assertEqual(self.sync(headers, since=data["next_token"])["changes"], [])
+
+    def test_deleted_bucketlist_is_synced(self):
+        """Test that deleting a bucket list leaves a tombstone for the owner only"""
+        headers = self.get_headers()
+        token = self.sync(headers)["next_token"]
+        self.client.delete("/bucketlists/1", headers=headers)
+
+        changes = self.sync(headers, since=token)["changes"]
+        self.assertEqual([(c["type"], c["op"], c["id"]) for c in changes],
+                         [("bucketlist", "delete", 1)])
+        self.assertEqual(Tombstone.query.count(), 1)
+        self.assertEqual(Tombstone.query.first().user_id, UserAccount.query.filter_by(username="user1").one().id)
+
+    def test_changes_are_paged(self):
+        """Test that changes are paged with the next token until none are left"""
+        headers = self.get_headers()
+        seen, token = [], None
+        for _ in range(5):
+            params = dict(limit=1, since=token) if token else dict(limit=1)
+            data = self.sync(headers, **params)
+            seen.extend((c["type"], c["id"]) for c in data["changes"])
+            token = data["next_token"]
+            if not data["has_more"]:
+                break
+        self.assertEqual(sorted(seen), [("bucketlist", 1), ("item", 1), ("item", 3), ("item", 5)])
+
+    def test_zero_limit_is_rejected(self):
+        """Test that a page of no changes is refused rather than skipping the pending ones"""
+        headers = self.get_headers()
+        with self.assertRaises(InvalidLimit):
+            self.client.get("/bucketlists/changes", headers=headers, query_string={"limit": 0})
+        with self.assertRaises(ValueError):
+            changes_since(1, None, 0, 0)
+        self.assertEqual(len(self.sync(headers, limit=1)["changes"]), 1)
+
+
+class SearchTestCases(BaseTestCase):
+    """Tests for searching bucket list and item names"""
+
+    def search(self, **params):
+        response = self.client.get("/bucketlists/search", headers=self.get_headers(),
+                                   query_string=params)
+        self.assert200(response)
+        return json.loads(response.data.decode("utf-8"))
+
+    def test_search_returns_bucketlists_and_items_of_user(self):
+        """Test search matches names of the user's bucket lists and items only"""
+        results = self.search(q="bucketlist")["message"]
+        self.assertEqual(len(results), 4)
+        self.assertEqual(set(r["type"] for r in results), {"bucketlist", "item"})
+        self.assertTrue(all(r["name"].startswith("User1") for r in results))
+
+    def test_search_matches_word_prefixes(self):
+        """Test search words match the start of words in names"""
+        results = self.search(q="bucket ite")["message"]
+        self.assertEqual(sorted(r["name"] for r in results),
+                         ["User1 Bucketlist Item 0", "User1 Bucketlist Item 1",
+                          "User1 Bucketlist Item 2"])
+
+    def test_bucketlist_filter_without_words(self):
+        """Test that a q of punctuation only filters bucket lists by substring instead of failing"""
+        headers = self.get_headers()
+        self.client.post("/bucketlists/", headers=headers, data={"name": "Party!!"})
+        for q, names in (("!!", ["Party!!"]), ('"', [])):
+            response = self.client.get("/bucketlists/", headers=headers, query_string={"q": q})
+            self.assert200(response)
+            self.assertEqual([b["name"] for b in json.loads(response.data.decode("utf-8"))["message"]],
+                             names)
+        self.assertEqual(self.search(q="!!")["message"], [])
+
+    def test_search_index_follows_changes(self):
+        """Test renamed and deleted items are found under their new names only"""
+        self.client.put("/bucketlists/1", data={"name": "Travel plans"},
+                        headers=self.get_headers())
+        self.client.delete("/bucketlists/1/items/1", headers=self.get_headers())
+
+        self.assertEqual([r["type"] for r in self.search(q="travel")["message"]], ["bucketlist"])
+        self.assertEqual(len(self.search(q="bucketlist")["message"]), 2)
+
+    def test_search_results_are_paged_with_cursor(self):
+        """Test following next_cursor returns every match exactly once"""
+        seen, cursor = [], ""
+        while cursor is not None:
+            data = self.search(q="user1", limit=3, cursor=cursor)
+            seen.extend((r["type"], r["id"]) for r in data["message"])
+            cursor = data["next_cursor"]
+        self.assertEqual(len(seen), 4)
+        self.assertEqual(len(set(seen)), 4)
+
+
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,107 @@
+import json
+import unittest
+
+from app.cache import response_cache
+from app.cache.backends import MemoryBackend
+from tests import BaseTestCase
+
+
+class ResponseCacheTestCases(BaseTestCase):
+    """Tests for the per user response cache of the list reads"""
+
+    def get(self, path, headers, **extra):
+        return self.client.get(path, headers=dict(headers, **extra))
+
+    def test_list_reads_are_served_from_cache(self):
+        """Test that a repeated list read is a cache hit with the same body"""
+        headers = self.get_headers()
+        first = self.get("/bucketlists/", headers)
+        second = self.get("/bucketlists/", headers)
+
+        self.assertEqual(first.headers["X-Cache"], "MISS")
+        self.assertEqual(second.headers["X-Cache"], "HIT")
+        self.assertEqual(first.data, second.data)
+        self.assertEqual(first.headers["ETag"], second.headers["ETag"])
+        metrics = response_cache.metrics()
+        self.assertEqual((metrics["hits"], metrics["misses"]), (1, 1))
+
+    def test_query_args_are_part_of_the_key(self):
+        """Test that different arguments are cached separately"""
+        headers = self.get_headers()
+        self.get("/bucketlists/1/items", headers)
+        response = self.client.get("/bucketlists/1/items", headers=headers, query_string={"limit": 1})
+        self.assertEqual(response.headers["X-Cache"], "MISS")
+        self.assertEqual(len(json.loads(response.data.decode("utf-8"))["items"]), 1)
+
+    def test_writes_invalidate_the_cache_of_the_user(self):
+        """Test that creating, editing and batch changes drop the cached reads"""
+        headers = self.get_headers()
+        self.get("/bucketlists/1/items", headers)
+
+        self.client.post("/bucketlists/1/items", headers=headers, data={"name": "Buy a car"})
+        response = self.get("/bucketlists/1/items", headers)
+        self.assertEqual(response.headers["X-Cache"], "MISS")
+        self.assertIn("Buy a car", response.data.decode("utf-8"))
+
+        self.client.post("/bucketlists/1/items/batch", headers=headers,
+                         data=json.dumps([{"op": "create", "name": "Sail"}]),
+                         content_type="application/json")
+        response = self.get("/bucketlists/1/items", headers)
+        self.assertEqual(response.headers["X-Cache"], "MISS")
+        self.assertIn("Sail", response.data.decode("utf-8"))
+
+    def test_failed_writes_keep_the_cache(self):
+        """Test that a rejected batch does not invalidate anything"""
+        headers = self.get_headers()
+        self.get("/bucketlists/1/items", headers)
+        self.client.post("/bucketlists/1/items/batch", headers=headers,
+                         data=json.dumps([{"op": "delete", "id": 999}]),
+                         content_type="application/json")
+        self.assertEqual(self.get("/bucketlists/1/items", headers).headers["X-Cache"], "HIT")
+
+    def test_writes_keep_the_cache_of_other_users(self):
+        """Test that a write of one user leaves the cache of another alone"""
+        other = self.app.test_client()
+        login = other.post("/auth/login/", data=dict(username="user2", password="user2_pass"))
+        other_headers = {"Authorization": "Bearer {}".format(
+            json.loads(login.data.decode("utf-8"))["token"])}
+        other.get("/bucketlists/", headers=other_headers)
+
+        self.client.post("/bucketlists/", headers=self.get_headers(), data={"name": "New list"})
+        response = other.get("/bucketlists/", headers=other_headers)
+        self.assertEqual(response.headers["X-Cache"], "HIT")
+
+    def test_cache_hits_are_revalidated(self):
+        """Test that a cache hit answers conditional requests with a 304"""
+        headers = self.get_headers()
+        etag = self.get("/bucketlists/", headers).headers["ETag"]
+        response = self.get("/bucketlists/", headers, **{"If-None-Match": etag})
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.headers["X-Cache"], "HIT")
+
+
+class MemoryBackendTestCases(unittest.TestCase):
+    """Tests for the in memory LRU backend"""
+
+    def test_least_recently_used_entry_is_evicted(self):
+        backend = MemoryBackend(size=2)
+        backend.set("a", dict(body=b"a"), 60)
+        backend.set("b", dict(body=b"b"), 60)
+        backend.get("a")
+        backend.set("c", dict(body=b"c"), 60)
+        self.assertIsNone(backend.get("b"))
+        self.assertIsNotNone(backend.get("a"))
+
+    def test_entries_expire(self):
+        backend = MemoryBackend(size=2)
+        backend.set("a", dict(body=b"a"), -1)
+        self.assertIsNone(backend.get("a"))
+
+    def test_versions_are_bumped_per_user(self):
+        backend = MemoryBackend(size=2)
+        backend.bump(1)
+        self.assertEqual((backend.version(1), backend.version(2)), (1, 0))
+
+
+if __name__ == "__main__":
+    unittest.main()
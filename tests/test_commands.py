@@ -0,0 +1,93 @@
+import json
+import unittest
+
+from app.commands.bench import run_benchmark, parse_mix, percentile, DEFAULT_MIX
+from app.commands.encoding_bench import run_encoding_benchmark
+from app.commands.seed import seed_database, _Generator
+from app.mod_auth.models import UserAccount, UserProfile
+from app.mod_bucketlist.models import BucketList, BucketListItem
+from tests import BaseTestCase
+
+
+class BenchCommandTestCases(unittest.TestCase):
+    """Tests for the load testing benchmark"""
+
+    def test_mix_is_parsed(self):
+        """Test that operation weights are read and unknown operations rejected"""
+        self.assertEqual(parse_mix("login=1, list=3"), dict(login=1, list=3))
+        with self.assertRaises(ValueError):
+            parse_mix("login=1,upload=2")
+        with self.assertRaises(ValueError):
+            parse_mix("login=0")
+
+    def test_percentiles_use_nearest_rank(self):
+        """Test the nearest rank percentiles of a list of latencies"""
+        values = list(range(1, 101))
+        self.assertEqual(percentile(values, 0.50), 50)
+        self.assertEqual(percentile(values, 0.95), 95)
+        self.assertEqual(percentile(values, 0.99), 99)
+        self.assertIsNone(percentile([], 0.5))
+
+    def test_benchmark_reports_every_transport_and_operation(self):
+        """Test that a small benchmark runs without errors over both transports"""
+        report = run_benchmark(users=2, lists=1, items=3, operations=12, concurrency=2)
+
+        self.assertEqual([run["transport"] for run in report["runs"]], ["inprocess", "socket"])
+        for run in report["runs"]:
+            self.assertEqual(run["errors"], 0)
+            self.assertGreater(run["requests_per_second"], 0)
+            self.assertLessEqual(run["p50"], run["p95"])
+            self.assertLessEqual(run["p95"], run["p99"])
+            self.assertTrue(set(run["operations"]) <= {"login", "list", "search", "item_create",
+                                                       "item_get", "item_update", "item_delete"})
+        self.assertEqual(report["mix"], DEFAULT_MIX)
+
+    def test_encoding_benchmark_reports_sizes_and_times(self):
+        """Test that every encoding and compression of both documents is measured"""
+        report = run_encoding_benchmark(items=200, repeat=1)
+
+        self.assertEqual(sorted(report["documents"]), ["bucketlists", "items"])
+        result = report["documents"]["items"]["json"]
+        for name in ("gzip-1", "gzip-6", "gzip-9"):
+            compressed = result["compressed"][name]
+            self.assertLess(compressed["bytes"], result["bytes"])
+            self.assertGreaterEqual(compressed["compress_ms"], 0)
+
+
+class SeedCommandTestCases(BaseTestCase):
+    """Tests for the synthetic data generator"""
+
+    def test_seed_adds_users_lists_and_items(self):
+        """Test that seeding adds rows after the existing ones and the users can log in"""
+        result = seed_database(users=3, lists=2, items=4, seed=7, password="seeded_pass", batch_size=5)
+
+        self.assertEqual(result.rows, dict(user_profile=3, user_account=3, bucketlists=6,
+                                           bucketlist_items=24))
+        self.assertEqual(UserAccount.query.count(), 5)
+        self.assertEqual(BucketList.query.count(), 8)
+        self.assertEqual(BucketListItem.query.count(), 30)
+
+        user = UserAccount.query.get(3)
+        self.assertEqual(user.user_profile_id, UserProfile.query.get(3).id)
+        self.assertEqual(BucketList.get_all(user.id).count(), 2)
+
+        response = self.client.post("/auth/login/", data=dict(username=user.username,
+                                                               password="seeded_pass"))
+        self.assert200(response)
+        self.assertIn("token", json.loads(response.data.decode("utf-8")))
+
+    def test_same_seed_generates_same_rows(self):
+        """Test that a dataset is reproducible from its seed"""
+        first_ids = dict(user_profile=1, user_account=1, bucketlists=1, bucketlist_items=1)
+
+        def rows(seed):
+            generator = _Generator(seed, 2, 2, 3, "hash", first_ids)
+            return (list(generator.profiles()), list(generator.accounts()),
+                    list(generator.bucketlists()), list(generator.bucketlist_items()))
+
+        self.assertEqual(rows(1), rows(1))
+        self.assertNotEqual(rows(1), rows(2))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,5 +1,7 @@
+import os
 import unittest
 from flask import current_app
+from config import ProductionConfig
 from tests import BaseTestCase
 
 
@@ -33,5 +35,12 @@ class TestConfigurationsCases(BaseTestCase):
         self.assertTrue(current_app.config.get("PRESERVE_CONTEXT_ON_EXCEPTION") is False)
 
 
+    @unittest.skipIf("RESPONSE_CACHE_BACKEND" in os.environ or "RESPONSE_CACHE_REDIS_URL" in os.environ,
+                     "the response cache is configured by the environment")
+    def test_production_has_no_process_local_response_cache(self):
+        """Test the response cache is off in production unless redis is configured"""
+        self.assertEqual(ProductionConfig.RESPONSE_CACHE_BACKEND, "")
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,142 @@
+import json
+import os
+import tempfile
+import unittest
+
+from app import create_app, db
+from app.mod_bucketlist.models import BucketList
+from config import config, TestingConfig
+from tests import BaseTestCase
+
+
+class ReplicaTestingConfig(TestingConfig):
+    """
+    Testing configuration with a SQLite file standing in for a read replica
+    """
+    REPLICA_PATH = os.path.join(tempfile.gettempdir(), "bucketlist-replica-{}.db".format(os.getpid()))
+    SQLALCHEMY_REPLICA_URIS = ["sqlite:///" + REPLICA_PATH]
+    # logging in is a write, the tests that need it turn stickiness on
+    SQLALCHEMY_REPLICA_STICKY_SECONDS = 0
+
+
+class ReadReplicaTestCases(BaseTestCase):
+    """Tests for the routing of reads to replicas"""
+
+    def _pre_setup(self):
+        config["testing_replica"] = ReplicaTestingConfig
+        self.app = create_app("testing_replica")
+        self.client = self.app.test_client()
+
+    def tearDown(self):
+        super(ReadReplicaTestCases, self).tearDown()
+        db.get_engine(self.app, "replica_0").dispose()
+        if os.path.exists(ReplicaTestingConfig.REPLICA_PATH):
+            os.remove(ReplicaTestingConfig.REPLICA_PATH)
+
+    def replicate(self):
+        """Copies the tables of the primary to the replica, as replication would, leaving out search"""
+        if os.path.exists(ReplicaTestingConfig.REPLICA_PATH):
+            os.remove(ReplicaTestingConfig.REPLICA_PATH)
+        primary = db.engine.raw_connection()
+        replica = db.get_engine(self.app, "replica_0").raw_connection()
+        try:
+            statements = [s for s in primary.connection.iterdump() if "_fts" not in s and "sqlite_master" not in s]
+            replica.connection.executescript(";\n".join(statements))
+        finally:
+            primary.close()
+            replica.close()
+
+    def rename_on_primary(self, name):
+        BucketList.query.get(1).name = name
+        db.session.commit()
+
+    def test_reads_go_to_the_replica(self):
+        """Test that the GET handlers read from the replica, which lags behind the primary"""
+        headers = self.get_headers()
+        self.replicate()
+        self.rename_on_primary("Not replicated yet")
+
+        response = self.client.get("/bucketlists/1", headers=headers)
+
+        self.assert200(response)
+        self.assertNotIn("Not replicated yet", response.data.decode("utf-8"))
+
+    def test_client_reads_its_own_writes(self):
+        """Test that a client that has written reads from the primary for a while"""
+        headers = self.get_headers()
+        reader = self.app.test_client()
+        reader.post("/auth/login/", data=dict(email="user1@example.com", username="user1",
+                                              password="user1_pass"))
+        self.replicate()
+
+        self.app.config["SQLALCHEMY_REPLICA_STICKY_SECONDS"] = 10
+        response = self.client.put("/bucketlists/1", headers=headers, data={"name": "Renamed"})
+        self.assert200(response)
+
+        response = self.client.get("/bucketlists/1", headers=headers)
+        self.assertIn("Renamed", response.data.decode("utf-8"))
+
+        # another client still reads from the replica
+        response = reader.get("/bucketlists/1", headers=headers)
+        self.assert200(response)
+        self.assertNotIn("Renamed", response.data.decode("utf-8"))
+
+        # and so does the writer once it is no longer sticky
+        self.app.config["SQLALCHEMY_REPLICA_STICKY_SECONDS"] = 0
+        self.client.put("/bucketlists/1", headers=headers, data={"name": "Renamed again"})
+        response = self.client.get("/bucketlists/1", headers=headers)
+        self.assertNotIn("Renamed", response.data.decode("utf-8"))
+
+    def test_replica_reads_are_not_cached(self):
+        """Test that a list read from a lagging replica is not cached for the writer to hit"""
+        headers = self.get_headers()
+        reader = self.app.test_client()
+        reader.post("/auth/login/", data=dict(email="user1@example.com", username="user1",
+                                              password="user1_pass"))
+        self.replicate()
+
+        self.app.config["SQLALCHEMY_REPLICA_STICKY_SECONDS"] = 10
+        self.client.put("/bucketlists/1", headers=headers, data={"name": "Renamed"})
+
+        # another session of the user reads the list from the replica
+        response = reader.get("/bucketlists/", headers=headers)
+        self.assertNotIn("Renamed", response.data.decode("utf-8"))
+        self.assertEqual(reader.get("/bucketlists/", headers=headers).headers["X-Cache"], "MISS")
+
+        response = self.client.get("/bucketlists/", headers=headers)
+        self.assertEqual(response.headers["X-Cache"], "MISS")
+        self.assertIn("Renamed", response.data.decode("utf-8"))
+        self.assertEqual(self.client.get("/bucketlists/", headers=headers).headers["X-Cache"], "HIT")
+
+    def test_delta_sync_reads_the_primary(self):
+        """Test that a change the replica has not received yet is not skipped by a sync"""
+        headers = self.get_headers()
+        response = self.client.get("/bucketlists/changes", headers=headers)
+        token = json.loads(response.data.decode("utf-8"))["next_token"]
+        self.replicate()
+        self.rename_on_primary("Not replicated yet")
+
+        response = self.client.get("/bucketlists/changes", headers=headers, query_string={"since": token})
+        changes = json.loads(response.data.decode("utf-8"))["changes"]
+        self.assertEqual([(c["type"], c["name"]) for c in changes], [("bucketlist", "Not replicated yet")])
+
+    def test_writes_go_to_the_primary(self):
+        """Test that writes are not sent to the replica"""
+        headers = self.get_headers()
+        self.replicate()
+        response = self.client.post("/bucketlists/", headers=headers, data={"name": "Written to the primary"})
+        self.assertEqual(response.status_code, 201)
+
+        self.assertIsNotNone(BucketList.query.filter_by(name="Written to the primary").first())
+        replica = db.get_engine(self.app, "replica_0")
+        self.assertEqual(replica.execute("SELECT count(*) FROM bucketlists WHERE name = 'Written to the primary'")
+                         .scalar(), 0)
+
+    def test_pool_options_are_applied(self):
+        """Test that connections are checked before use and SQLite skips the pool sizes"""
+        self.assertTrue(db.get_engine(self.app, "replica_0").pool._pre_ping)
+        self.assertTrue(db.engine.pool._pre_ping)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,96 @@
+import gzip
+import json
+import unittest
+import zlib
+
+from app.encoding import CompressionMiddleware, _import_msgpack
+from tests import BaseTestCase
+
+
+class CompressionTestCases(BaseTestCase):
+    """Tests for the compression middleware"""
+
+    def get(self, url, **headers):
+        self.login()
+        headers.update(self.get_headers())
+        return self.client.get(url, headers=headers)
+
+    def test_large_responses_are_gzipped(self):
+        """Test that a response over the size threshold is compressed when the client accepts it"""
+        self.app.wsgi_app.min_size = 0
+        plain = self.get("/bucketlists/1/items?limit=100")
+        compressed = self.get("/bucketlists/1/items?limit=100", **{"Accept-Encoding": "gzip, deflate"})
+
+        self.assertEqual(compressed.headers["Content-Encoding"], "gzip")
+        self.assertIn("Accept-Encoding", compressed.headers["Vary"])
+        self.assertEqual(int(compressed.headers["Content-Length"]), len(compressed.data))
+        self.assertEqual(json.loads(gzip.decompress(compressed.data).decode("utf-8")),
+                         json.loads(plain.data.decode("utf-8")))
+
+    def test_small_responses_are_sent_as_they_are(self):
+        """Test that responses under the size threshold and refused encodings are not compressed"""
+        response = self.get("/bucketlists/1/items?limit=100", **{"Accept-Encoding": "gzip"})
+        self.assertNotIn("Content-Encoding", response.headers)
+        json.loads(response.data.decode("utf-8"))
+
+        self.assertIsNone(self.app.wsgi_app.choose("gzip;q=0"))
+        self.assertIsNone(self.app.wsgi_app.choose("identity"))
+        self.assertEqual(self.app.wsgi_app.choose("br;q=0.5, gzip"), "gzip")
+
+    def test_streamed_responses_are_compressed_chunk_by_chunk(self):
+        """Test that every chunk of a streamed response can be decoded as soon as it arrives"""
+        chunks = [b'{"items":[', b'{"id":1}', b',{"id":2}', b"]}"]
+
+        def streaming_app(environ, start_response):
+            start_response("200 OK", [("Content-Type", "application/json")])
+            return iter(chunks)
+
+        middleware = CompressionMiddleware(streaming_app, mimetypes=("application/json",))
+        started = []
+        body = middleware({"REQUEST_METHOD": "GET", "HTTP_ACCEPT_ENCODING": "gzip"},
+                          lambda status, headers, exc_info=None: started.append(dict(headers)))
+
+        self.assertEqual(started[0]["Content-Encoding"], "gzip")
+        self.assertNotIn("Content-Length", started[0])
+        decompressor = zlib.decompressobj(zlib.MAX_WBITS | 16)
+        pieces = [decompressor.decompress(piece) for piece in body]
+        self.assertEqual(pieces[:len(chunks)], chunks)
+        self.assertEqual(b"".join(pieces), b"".join(chunks))
+        self.assertTrue(decompressor.eof)
+
+    def test_streamed_items_are_compressed(self):
+        """Test that the streamed items endpoint is compressed without a length"""
+        response = self.get("/bucketlists/1/items?stream=1", **{"Accept-Encoding": "gzip"})
+        self.assertEqual(response.headers["Content-Encoding"], "gzip")
+        self.assertIn("items", json.loads(gzip.decompress(response.data).decode("utf-8")))
+
+
+class MessagePackTestCases(BaseTestCase):
+    """Tests for MessagePack negotiation"""
+
+    def get(self, url, accept):
+        self.login()
+        return self.client.get(url, headers=dict(self.get_headers(), Accept=accept))
+
+    @unittest.skipIf(_import_msgpack() is None, "msgpack is not installed")
+    def test_msgpack_is_sent_to_clients_preferring_it(self):
+        """Test that a JSON response is packed when the client asks for MessagePack"""
+        msgpack = _import_msgpack()
+        plain = self.get("/bucketlists/?fields=id,name", "application/json")
+        packed = self.get("/bucketlists/?fields=id,name", "application/msgpack, application/json;q=0.5")
+
+        self.assertEqual(packed.mimetype, "application/msgpack")
+        self.assertIn("Accept", packed.headers["Vary"])
+        self.assertEqual(msgpack.unpackb(packed.data, raw=False), json.loads(plain.data.decode("utf-8")))
+
+    def test_json_is_sent_by_default(self):
+        """Test that clients accepting anything get JSON"""
+        response = self.get("/bucketlists/", "*/*")
+        self.assertEqual(response.mimetype, "application/json")
+        if _import_msgpack() is None:
+            response = self.get("/bucketlists/", "application/msgpack")
+            self.assertEqual(response.mimetype, "application/json")
+
+
+if __name__ == "__main__":
+    unittest.main()
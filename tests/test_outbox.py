@@ -0,0 +1,186 @@
+import asyncore
+import smtpd
+import socket
+import threading
+import unittest
+from datetime import datetime, timedelta
+
+from app import mail
+from app.mod_auth.security_utils import send_mail
+from app.outbox import outbox
+from app.outbox.models import OutboxMessage
+from tests import BaseTestCase
+
+
+class SmtpStandIn(smtpd.SMTPServer):
+    """
+    Local SMTP server recording the messages it receives, replies holds the answers to give to
+    the next messages instead of accepting them
+    """
+
+    def __init__(self):
+        smtpd.SMTPServer.__init__(self, ("127.0.0.1", 0), None, decode_data=True)
+        self.port = self.socket.getsockname()[1]
+        self.received = []
+        self.replies = []
+        self.connections = 0
+        self.thread = threading.Thread(target=asyncore.loop, kwargs=dict(timeout=0.05),
+                                       daemon=True)
+        self.thread.start()
+
+    def handle_accepted(self, conn, addr):
+        self.connections += 1
+        smtpd.SMTPServer.handle_accepted(self, conn, addr)
+
+    def process_message(self, peer, mailfrom, rcpttos, data, **kwargs):
+        if self.replies:
+            return self.replies.pop(0)
+        self.received.append((mailfrom, rcpttos, data))
+
+    def stop(self):
+        self.close()
+        self.thread.join(2)
+
+
+def _closed_port():
+    s = socket.socket()
+    s.bind(("127.0.0.1", 0))
+    port = s.getsockname()[1]
+    s.close()
+    return port
+
+
+class MailOutboxTestCases(BaseTestCase):
+    """Tests for the outbox of outgoing emails"""
+
+    def setUp(self):
+        super(MailOutboxTestCases, self).setUp()
+        self.smtp = SmtpStandIn()
+        self.use_smtp_port(self.smtp.port)
+
+    def tearDown(self):
+        self.smtp.stop()
+        super(MailOutboxTestCases, self).tearDown()
+
+    def use_smtp_port(self, port):
+        self.app.config.update(MAIL_SERVER="127.0.0.1", MAIL_PORT=port, MAIL_USE_TLS=False,
+                               MAIL_USE_SSL=False, MAIL_SUPPRESS_SEND=False,
+                               MAIL_DEFAULT_SENDER="noreply@example.com")
+        mail.init_app(self.app)
+
+    def queue(self, count):
+        for n in range(count):
+            send_mail("user{}@example.com".format(n), "Confirm your account", "<p>Welcome</p>")
+        self.db.session.commit()
+
+    def messages(self):
+        self.db.session.expire_all()
+        return OutboxMessage.query.order_by(OutboxMessage.id).all()
+
+    def test_send_mail_only_queues_the_email(self):
+        """Test that sending an email writes it to the outbox without talking to the server"""
+        self.queue(1)
+
+        message, = self.messages()
+        self.assertEqual(message.status, OutboxMessage.PENDING)
+        self.assertEqual(message.to_json()["recipients"], ["user0@example.com"])
+        self.assertEqual(self.smtp.connections, 0)
+
+    def test_batch_is_sent_over_one_connection(self):
+        """Test that a batch reuses one SMTP connection and sent emails leave the outbox"""
+        self.queue(3)
+
+        self.assertEqual(outbox.send_batch(), 3)
+
+        self.assertEqual(self.smtp.connections, 1)
+        self.assertEqual(sorted(rcpttos[0] for _, rcpttos, _ in self.smtp.received),
+                         ["user0@example.com", "user1@example.com", "user2@example.com"])
+        self.assertIn("Confirm your account", self.smtp.received[0][2])
+        self.assertEqual(self.messages(), [])
+        self.assertEqual(outbox.metrics()["sent"], 3)
+
+    def test_batches_are_limited_to_the_batch_size(self):
+        """Test that the oldest emails are sent first, a batch at a time"""
+        self.app.extensions["mail_outbox"].batch_size = 2
+        self.queue(3)
+
+        self.assertEqual(outbox.send_batch(), 2)
+        self.assertEqual([rcpttos for _, rcpttos, _ in self.smtp.received],
+                         [["user0@example.com"], ["user1@example.com"]])
+        self.assertEqual(outbox.send_batch(), 1)
+        self.assertEqual(outbox.send_batch(), 0)
+
+    def test_unreachable_server_is_retried_with_backoff(self):
+        """Test that emails are scheduled again when the server can not be reached"""
+        self.use_smtp_port(_closed_port())
+        self.queue(2)
+
+        self.assertEqual(outbox.send_batch(), 2)
+
+        for message in self.messages():
+            self.assertEqual(message.status, OutboxMessage.PENDING)
+            self.assertEqual(message.attempts, 1)
+            self.assertIsNone(message.claimed_by)
+            self.assertIn("ConnectionRefusedError", message.last_error)
+            self.assertGreater(message.next_attempt_at, datetime.utcnow() + timedelta(seconds=25))
+        # not due again until the delay has passed
+        self.assertEqual(outbox.send_batch(), 0)
+
+    def test_retry_delay_doubles_up_to_the_maximum(self):
+        """Test the exponential backoff of failed emails"""
+        self.assertEqual([outbox.retry_delay(n) for n in range(1, 5)], [30, 60, 120, 240])
+        self.assertEqual(outbox.retry_delay(20), 3600)
+
+    def test_refused_email_becomes_a_dead_letter(self):
+        """Test that a permanent refusal is not retried while the rest of the batch is sent"""
+        self.smtp.replies = ["550 mailbox unavailable"]
+        self.queue(2)
+
+        outbox.send_batch()
+
+        dead, = self.messages()
+        self.assertEqual(dead.status, OutboxMessage.DEAD)
+        self.assertIn("550", dead.last_error)
+        self.assertEqual(len(self.smtp.received), 1)
+        self.assertEqual(self.smtp.connections, 1)
+
+    def test_email_is_dead_after_its_last_attempt(self):
+        """Test that temporary failures are retried until the attempts run out"""
+        self.app.extensions["mail_outbox"].max_attempts = 2
+        self.smtp.replies = ["451 try again later", "451 try again later"]
+        self.queue(1)
+
+        outbox.send_batch()
+        message, = self.messages()
+        self.assertEqual((message.status, message.attempts), (OutboxMessage.PENDING, 1))
+
+        message.next_attempt_at = datetime.utcnow()
+        self.db.session.commit()
+        outbox.send_batch()
+        message, = self.messages()
+        self.assertEqual((message.status, message.attempts), (OutboxMessage.DEAD, 2))
+
+        self.assertEqual(outbox.requeue(), 1)
+        outbox.send_batch()
+        self.assertEqual(self.messages(), [])
+        self.assertEqual(len(self.smtp.received), 1)
+
+    def test_email_of_a_lost_worker_is_sent_after_its_lease(self):
+        """Test that an email held by a worker whose lease ran out is picked up again"""
+        self.queue(1)
+        message, = self.messages()
+        message.status = OutboxMessage.SENDING
+        message.claimed_by = "lost"
+        message.next_attempt_at = datetime.utcnow() + timedelta(minutes=5)
+        self.db.session.commit()
+
+        self.assertEqual(outbox.send_batch(), 0)
+
+        message.next_attempt_at = datetime.utcnow() - timedelta(seconds=1)
+        self.db.session.commit()
+        self.assertEqual(outbox.send_batch(), 1)
+        self.assertEqual(self.messages(), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,75 @@
+import re
+import unittest
+from datetime import datetime
+
+from app.mod_auth.models import UserAccount, Session
+from app.mod_auth.token_cache import token_digest
+from app.mod_bucketlist.models import BucketList, BucketListItem, Tombstone
+from app.pagination import after_key
+from tests import BaseTestCase
+
+# a plan step reading a whole table, as opposed to searching it or scanning one of its indexes
+FULL_SCAN = re.compile(r"^SCAN (TABLE )?(?P<table>\w+)$")
+
+
+class QueryPlanTestCases(BaseTestCase):
+    """
+    Query plan regression tests. These fail when a query on a hot path stops being served by
+    an index and turns into a sequential scan of its table
+    """
+
+    def explain(self, query):
+        """
+        Returns the steps of the query plan of the given query
+        :param query: ORM query to explain
+        :rtype: list
+        """
+        engine = self.db.get_engine(self.app)
+        compiled = query.statement.compile(dialect=engine.dialect)
+        params = [compiled.params[name] for name in compiled.positiontup]
+        rows = engine.execute("EXPLAIN QUERY PLAN " + str(compiled), params).fetchall()
+        return [row[-1] for row in rows]
+
+    def assertNoFullScan(self, query):
+        for step in self.explain(query):
+            match = FULL_SCAN.match(step)
+            self.assertIsNone(match, "Query plan scans a whole table: {}".format(step))
+
+    def test_listing_bucketlists_uses_index(self):
+        """Test that a keyset page of a user's bucket lists is served by an index"""
+        key = (BucketList.date_created, BucketList.id)
+        query = BucketList.get_all(1).filter(after_key(key, (datetime(2017, 1, 1), 1))) \
+            .order_by(*key).limit(21)
+        self.assertNoFullScan(query)
+        self.assertNoFullScan(BucketList.get_all(1).order_by(*key).limit(21))
+
+    def test_loading_bucketlist_items_uses_index(self):
+        """Test that a page of the items of a bucket list is served by an index"""
+        bucketlist = BucketList.query.get(1)
+        query = bucketlist.items.filter(BucketListItem.id > 1) \
+            .order_by(BucketListItem.id).limit(21)
+        self.assertNoFullScan(query)
+
+    def test_token_lookup_uses_index(self):
+        """Test that resolving a session and its user from a token is served by indexes"""
+        query = self.db.session.query(UserAccount, Session.id) \
+            .join(Session, Session.user_id == UserAccount.id) \
+            .filter(Session.token_hash == token_digest("token"))
+        self.assertNoFullScan(query)
+
+    def test_sync_changes_use_indexes(self):
+        """Test that the delta sync queries read changes through indexes"""
+        since = datetime(2017, 1, 1)
+        self.assertNoFullScan(BucketList.query.filter(BucketList.created_by == 1,
+                                                      BucketList.date_modified > since)
+                              .order_by(BucketList.date_modified, BucketList.id).limit(21))
+        self.assertNoFullScan(Tombstone.query.filter(Tombstone.user_id == 1,
+                                                     Tombstone.date_created > since)
+                              .order_by(Tombstone.date_created, Tombstone.id).limit(21))
+        self.assertNoFullScan(BucketListItem.query.join(BucketList, BucketList.id == BucketListItem.bucketlist_id)
+                              .filter(BucketList.created_by == 1, BucketListItem.date_modified > since)
+                              .order_by(BucketListItem.date_modified, BucketListItem.id).limit(21))
+
+
+if __name__ == "__main__":
+    unittest.main()
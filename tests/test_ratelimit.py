@@ -0,0 +1,126 @@
+import json
+import time
+import unittest
+
+from app import create_app
+from app.ratelimit import parse_limit, rate_limiter
+from app.ratelimit.backends import MemoryBackend
+from config import config, TestingConfig
+from tests import BaseTestCase
+
+
+class ProxiedTestingConfig(TestingConfig):
+    """
+    Testing configuration of an app behind one reverse proxy
+    """
+    PROXY_COUNT = 1
+
+
+class RateLimiterTestCases(BaseTestCase):
+    """Tests for the token bucket rate limiter"""
+
+    def setUp(self):
+        super(RateLimiterTestCases, self).setUp()
+        state = self.app.extensions["rate_limiter"]
+        state.backend = MemoryBackend(100)
+        state.limits = dict((target, tuple(parse_limit(target, text) for text in texts)) for target, texts in {
+            "auth.login": ["2/minute per ip", "3/minute per user"],
+            "bucketlist": ["1/minute per user"],
+        }.items())
+
+    def login_from(self, address, username="user1", password="user1_pass"):
+        return self.client.post("/auth/login/", data=dict(username=username, password=password),
+                                environ_base={"REMOTE_ADDR": address})
+
+    def test_limits_are_parsed(self):
+        """Test that limits are read and malformed ones refused"""
+        limit = parse_limit("auth.login", "10/minute per ip")
+        self.assertEqual((limit.count, limit.period, limit.scope), (10, 60, "ip"))
+        for text in ("10 per ip", "10/week per ip", "10/minute per host", "0/minute per ip"):
+            with self.assertRaises(ValueError):
+                parse_limit("auth.login", text)
+
+    def test_bucket_allows_a_burst_then_refills(self):
+        """Test that a bucket lets capacity requests through and refills at its rate"""
+        backend = MemoryBackend(10)
+        self.assertEqual([backend.take("key", 2, 50)[0] for _ in range(3)], [True, True, False])
+        allowed, retry_after = backend.take("key", 2, 50)
+        self.assertFalse(allowed)
+        self.assertGreater(retry_after, 0)
+        self.assertLessEqual(retry_after, 0.02)
+
+        time.sleep(0.03)
+        self.assertTrue(backend.take("key", 2, 50)[0])
+        self.assertTrue(backend.take("other", 2, 50)[0])
+
+    def test_address_over_its_limit_gets_429(self):
+        """Test that logins over the limit of an address are refused with Retry-After"""
+        self.assert200(self.login_from("10.0.0.1"))
+        self.assert200(self.login_from("10.0.0.1"))
+
+        response = self.login_from("10.0.0.1")
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response.headers["Retry-After"], "30")
+        self.assertEqual(json.loads(response.data.decode("utf-8"))["retry_after"], 30)
+
+        self.assert200(self.login_from("10.0.0.2"))
+        self.assertEqual(rate_limiter.metrics()["limited"], 1)
+
+    def test_user_is_limited_whatever_the_address(self):
+        """Test that logins naming the same user are counted together across addresses"""
+        for address in ("10.0.0.1", "10.0.0.2", "10.0.0.3"):
+            self.assert200(self.login_from(address))
+        self.assertEqual(self.login_from("10.0.0.4").status_code, 429)
+        self.assert200(self.login_from("10.0.0.5", "user2", "user2_pass"))
+
+    def test_blueprint_limits_apply_to_writes_only(self):
+        """Test that a blueprint limit counts the writes of the user and lets reads through"""
+        self.login()
+        headers = self.get_headers()
+        response = self.client.post("/bucketlists/", headers=headers, data={"name": "First"})
+        self.assertEqual(response.status_code, 201)
+        response = self.client.post("/bucketlists/", headers=headers, data={"name": "Second"})
+        self.assertEqual(response.status_code, 429)
+
+        for _ in range(3):
+            self.assert200(self.client.get("/bucketlists/", headers=headers))
+
+    def test_turned_off_without_a_backend(self):
+        """Test that the limiter lets everything through when it has no backend"""
+        self.app.extensions["rate_limiter"].backend = None
+        for _ in range(4):
+            self.assert200(self.login_from("10.0.0.1"))
+
+
+class ProxiedRateLimiterTestCases(RateLimiterTestCases):
+    """Tests for the rate limits per ip of an app behind a reverse proxy"""
+
+    def _pre_setup(self):
+        config["testing_proxied"] = ProxiedTestingConfig
+        self.app = create_app("testing_proxied")
+        self.client = self.app.test_client()
+
+    def login_through_proxy(self, forwarded_for, username="user1", password="user1_pass"):
+        return self.client.post("/auth/login/", data=dict(username=username, password=password),
+                                headers={"X-Forwarded-For": forwarded_for},
+                                environ_base={"REMOTE_ADDR": "10.0.0.100"})
+
+    def test_clients_behind_the_proxy_are_limited_apart(self):
+        """Test that the address forwarded by the proxy is counted, not the proxy's own"""
+        self.assert200(self.login_through_proxy("192.0.2.1"))
+        self.assert200(self.login_through_proxy("192.0.2.1", "user2", "user2_pass"))
+        self.assertEqual(self.login_through_proxy("192.0.2.1", "user2", "user2_pass").status_code, 429)
+
+        self.assert200(self.login_through_proxy("192.0.2.2", "user2", "user2_pass"))
+
+    def test_addresses_added_before_the_proxy_are_ignored(self):
+        """Test that a client can not pick its address by sending X-Forwarded-For itself"""
+        for forged in ("198.51.100.1", "198.51.100.2"):
+            response = self.login_through_proxy("{}, 192.0.2.1".format(forged), "user2", "user2_pass")
+            self.assert200(response)
+        response = self.login_through_proxy("198.51.100.3, 192.0.2.1", "user2", "user2_pass")
+        self.assertEqual(response.status_code, 429)
+
+
+if __name__ == "__main__":
+    unittest.main()
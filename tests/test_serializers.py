@@ -0,0 +1,115 @@
+import importlib.util
+import json
+import sys
+import types
+import unittest
+from unittest import mock
+
+from flask import jsonify
+
+from app.mod_bucketlist.models import BucketList, BUCKETLIST_JSON, ITEM_JSON
+from app.mod_auth.models import UserAccount, USER_ACCOUNT_JSON
+from app.exceptions.handler import InvalidFields
+from app.serializers import JsonBackend, load_backend, BACKENDS
+from tests import BaseTestCase
+
+
+class SerializerTestCases(BaseTestCase):
+    """Tests for the projections and JSON backends"""
+
+    def test_projected_rows_match_to_json(self):
+        """Test that a projected row serializes to the same document as its model"""
+        bucketlist = BucketList.query.get(1)
+        row = BUCKETLIST_JSON.query(BucketList.query.filter_by(id=1)).one()
+
+        self.assertNotIsInstance(row, BucketList)
+        with self.app.test_request_context():
+            expected = json.loads(jsonify(bucketlist.to_json()).data.decode("utf-8"))
+        self.assertEqual(json.loads(JsonBackend(True).dumps(BUCKETLIST_JSON.dump(row)).decode("utf-8")),
+                         expected)
+
+    def test_renamed_fields(self):
+        """Test that fields named differently from their column keep their names"""
+        document = USER_ACCOUNT_JSON.as_dict(UserAccount.query.get(2))
+        self.assertEqual(document["profile_id"], UserAccount.query.get(2).user_profile_id)
+        self.assertIn("registerd_on", document)
+
+    def test_list_endpoints_write_http_dates(self):
+        """Test that the list responses keep the date format of jsonify"""
+        self.login()
+        response = self.client.get("/bucketlists/", headers=self.get_headers())
+        self.assert200(response)
+        first = json.loads(response.data.decode("utf-8"))["message"][0]
+        self.assertTrue(first["date_created"].endswith(" GMT"))
+
+        streamed = self.client.get("/bucketlists/1/items?stream=1", headers=self.get_headers())
+        paged = self.client.get("/bucketlists/1/items?limit=100", headers=self.get_headers())
+        self.assertEqual(json.loads(streamed.data.decode("utf-8"))["items"],
+                         json.loads(paged.data.decode("utf-8"))["items"])
+        self.assertEqual(sorted(json.loads(paged.data.decode("utf-8"))["items"][0]), sorted(ITEM_JSON.fields))
+
+    def test_backend_selection(self):
+        """Test that auto falls back to the standard library and unknown backends are refused"""
+        self.assertIn(load_backend("auto").name, BACKENDS)
+        self.assertEqual(load_backend("json").name, "json")
+        self.assertRaises(RuntimeError, load_backend, "yaml")
+        for name in ("orjson", "ujson"):
+            if importlib.util.find_spec(name) is None:
+                self.assertRaises(RuntimeError, load_backend, name)
+
+    def test_backends_write_utf8(self):
+        """Test that the standard library backend writes non-ASCII characters as the others do"""
+        self.assertEqual(JsonBackend(True).dumps({"name": "Caf\u00e9"}), "{\"name\":\"Caf\u00e9\"}".encode("utf-8"))
+
+    def test_old_ujson_is_passed_over(self):
+        """Test that a ujson without the default argument is not used"""
+        old_ujson = types.ModuleType("ujson")
+        old_ujson.dumps = lambda obj, sort_keys=False, ensure_ascii=True, escape_forward_slashes=True: \
+            json.dumps(obj, sort_keys=sort_keys, ensure_ascii=ensure_ascii)
+        with mock.patch.dict(sys.modules, ujson=old_ujson):
+            self.assertRaises(RuntimeError, load_backend, "ujson")
+            self.assertNotEqual(load_backend("auto").name, "ujson")
+
+    def documents(self, url):
+        response = self.client.get(url, headers=self.get_headers())
+        self.assert200(response)
+        return json.loads(response.data.decode("utf-8"))
+
+    def test_sparse_fieldsets_of_lists(self):
+        """Test that fields limits the fields of every bucket list, with either kind of paging"""
+        self.login()
+        for url in ("/bucketlists/?fields=id,name", "/bucketlists/?fields=name,id&cursor="):
+            for bucketlist in self.documents(url)["message"]:
+                self.assertEqual(sorted(bucketlist), ["id", "name"])
+
+    def test_sparse_fieldsets_of_items(self):
+        """Test that paged and streamed items and single resources take fields"""
+        self.login()
+        for url in ("/bucketlists/1/items?fields=done", "/bucketlists/1/items?stream=1&fields=done"):
+            items = self.documents(url)["items"]
+            self.assertTrue(items)
+            self.assertEqual(set(tuple(item) for item in items), {("done",)})
+        self.assertEqual(sorted(self.documents("/bucketlists/1?fields=name")), ["name"])
+        document = self.documents("/bucketlists/1/items/1?fields=name,done")
+        self.assertEqual(sorted(document["bucketlist_item"]), ["done", "name"])
+
+    def test_sparse_fieldsets_select_only_the_fields(self):
+        """Test that only the requested columns and the sort key are read from the database"""
+        projection = BUCKETLIST_JSON.only(["name"], keep=(BucketList.date_created, BucketList.id))
+        sql = str(projection.query(BucketList.query))
+        self.assertNotIn("created_by", sql)
+        self.assertNotIn("date_modified", sql)
+        self.assertEqual(projection.dump(("a", None, 1)), {"name": "a"})
+
+    def test_unknown_fields_are_refused(self):
+        """Test that fields naming something a resource does not have is an error"""
+        self.login()
+        headers = self.get_headers()
+        with self.assertRaises(InvalidFields):
+            self.client.get("/bucketlists/?fields=name,password", headers=headers)
+        with self.assertRaises(InvalidFields):
+            self.client.get("/bucketlists/1/items?fields=", headers=headers)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,296 @@
+import json
+import logging
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+
+from flask_api.exceptions import PermissionDenied
+
+from app import app_logger, create_app
+from app.telemetry.logs import ErrorMailFilter, log_pipeline
+from app.telemetry.metrics import metrics
+from app.telemetry.profiler import profiler
+from app.mod_auth.models import UserAccount
+from app.telemetry.queries import QueryStats
+from config import config, TestingConfig
+from tests import BaseTestCase
+
+
+class MetricsTokenTestingConfig(TestingConfig):
+    """
+    Testing configuration requiring a metrics token without setting one, as production does
+    """
+    METRICS_REQUIRE_TOKEN = True
+    METRICS_TOKEN = None
+
+
+class ProfilerOffTestingConfig(TestingConfig):
+    """
+    Testing configuration with the profiler turned off
+    """
+    PROFILER_ENABLED = False
+
+
+class RecordingHandler(logging.Handler):
+    """Keeps the lines it is given and the threads it was called on"""
+
+    def __init__(self):
+        logging.Handler.__init__(self)
+        self.lines = []
+        self.threads = []
+
+    def emit(self, record):
+        self.lines.append(self.format(record))
+        self.threads.append(threading.current_thread())
+
+
+class QueryCounterTestCases(BaseTestCase):
+    """Tests for the per request SQL query counter"""
+
+    def test_query_figures_are_sent_as_headers_in_debug(self):
+        """Test that debug responses carry the number and time of their queries"""
+        response = self.client.get("/bucketlists/1/items/1", headers=self.get_headers())
+        self.assert200(response)
+        self.assertGreater(int(response.headers["X-Query-Count"]), 0)
+        self.assertGreaterEqual(float(response.headers["X-Query-Time"]), 0)
+        self.assertIn("X-Query-Repeated", response.headers)
+
+    def test_query_figures_are_logged_in_production(self):
+        """Test that a JSON log line is written per request when not in debug mode"""
+        headers = self.get_headers()
+        self.app.debug = False
+
+        with self.assertLogs(app_logger, level="INFO") as logs:
+            response = self.client.get("/bucketlists/1/items", headers=headers)
+
+        self.assertNotIn("X-Query-Count", response.headers)
+        line = json.loads(logs.records[-1].getMessage())
+        self.assertEqual(line["event"], "sql_queries")
+        self.assertEqual(line["path"], "/bucketlists/1/items")
+        self.assertEqual(line["status"], 200)
+        self.assertGreater(line["queries"], 0)
+
+    def test_repeated_statements_are_flagged(self):
+        """Test that statements run more than once are flagged with their duplicate runs"""
+        stats = QueryStats()
+        stats.record("SELECT * FROM bucketlists WHERE id = ?", (1,), 0.001)
+        stats.record("SELECT * FROM bucketlists WHERE id = ?", (1,), 0.001)
+        stats.record("SELECT * FROM bucketlists WHERE id = ?", (2,), 0.001)
+        stats.record("SELECT * FROM sessions", (), 0.001)
+
+        repeated = stats.repeated(2)
+        self.assertEqual(stats.count, 4)
+        self.assertEqual(repeated, [dict(statement="SELECT * FROM bucketlists WHERE id = ?",
+                                         count=3, duplicates=1)])
+
+
+class LogPipelineTestCases(BaseTestCase):
+    """Tests for the queued logging pipeline"""
+
+    def test_responses_carry_a_request_id(self):
+        """Test that a request id is generated, or taken from a proxy when it is valid"""
+        headers = self.get_headers()
+        generated = self.client.get("/bucketlists/", headers=headers).headers["X-Request-ID"]
+        self.assertEqual(len(generated), 32)
+
+        headers["X-Request-ID"] = "proxy-id.1"
+        response = self.client.get("/bucketlists/", headers=headers)
+        self.assertEqual(response.headers["X-Request-ID"], "proxy-id.1")
+
+        headers["X-Request-ID"] = "bad id"
+        response = self.client.get("/bucketlists/", headers=headers)
+        self.assertNotEqual(response.headers["X-Request-ID"], "bad id")
+
+    def test_records_are_written_as_json_by_the_listener_thread(self):
+        """Test that handlers run off the logging thread and get the request id"""
+        handler = RecordingHandler()
+        log_pipeline.add_handler(self.app, handler)
+        log_pipeline.start(self.app)
+        try:
+            with self.app.test_request_context("/bucketlists/", headers={"X-Request-ID": "abc"}):
+                try:
+                    raise ValueError("broken")
+                except ValueError:
+                    app_logger.exception("Failed %s", "badly")
+        finally:
+            log_pipeline.stop(self.app)
+
+        line, = [json.loads(l) for l in handler.lines]
+        self.assertEqual(line["message"], "Failed badly")
+        self.assertEqual(line["level"], "ERROR")
+        self.assertEqual((line["request_id"], line["method"], line["path"]), ("abc", "GET", "/bucketlists/"))
+        self.assertIn("ValueError: broken", line["exception"])
+        self.assertIsNot(handler.threads[0], threading.current_thread())
+        self.assertNotIn(handler, app_logger.handlers)
+
+    def test_error_emails_are_deduplicated_and_rate_limited(self):
+        """Test that repeats of an emailed error are counted and reported with its next email"""
+        mail_filter = ErrorMailFilter(limit=2, window=60)
+
+        def record(lineno):
+            return app_logger.makeRecord(app_logger.name, logging.ERROR, "views.py", lineno, "failed", (), None)
+
+        passed = [mail_filter.filter(record(line)) for line in (10, 10, 10, 20, 30)]
+        self.assertEqual(passed, [True, False, False, True, False])
+        self.assertEqual(mail_filter.suppressed, 3)
+
+        # once the window is over the error is emailed again with the number of its repeats
+        for entry in mail_filter.seen.values():
+            entry[0] -= 61
+        mail_filter.sent.clear()
+        again = record(10)
+        self.assertTrue(mail_filter.filter(again))
+        self.assertEqual(again.repeated, 2)
+
+
+class MetricsTestCases(BaseTestCase):
+    """Tests for the metrics endpoint"""
+
+    def scrape(self):
+        response = self.client.get("/metrics")
+        self.assert200(response)
+        self.assertTrue(response.content_type.startswith("text/plain; version=0.0.4"))
+        return response.data.decode("utf-8").splitlines()
+
+    def test_requests_are_counted_with_latency_histograms(self):
+        """Test that requests are counted per endpoint and status with their latencies"""
+        headers = self.get_headers()
+        for _ in range(2):
+            self.client.get("/bucketlists/", headers=headers)
+
+        lines = self.scrape()
+        labels = 'blueprint="bucketlist",endpoint="bucketlist.bucket_lists",method="GET"'
+        self.assertIn('bucketlist_http_requests_total{{{},status="200"}} 2'.format(labels), lines)
+        self.assertIn('bucketlist_http_request_duration_seconds_bucket{{{},le="+Inf"}} 2'.format(labels), lines)
+        self.assertIn('bucketlist_http_request_duration_seconds_count{{{}}} 2'.format(labels), lines)
+        self.assertIn('bucketlist_response_cache_total{outcome="hits"} 1', lines)
+        self.assertIn("# TYPE bucketlist_http_request_duration_seconds histogram", lines)
+        # the scrape does not count itself
+        self.assertFalse([line for line in lines if 'endpoint="metrics"' in line])
+
+    def test_authentication_failures_are_counted(self):
+        """Test that requests without a valid token are counted as authentication failures"""
+        self.login()
+        with self.assertRaises(PermissionDenied):
+            self.client.get("/bucketlists/")
+
+        self.assertIn('bucketlist_auth_failures_total{endpoint="bucketlist.bucket_lists",'
+                      'reason="PermissionDenied"} 1', self.scrape())
+
+    def test_endpoint_can_require_a_token(self):
+        """Test that the metrics are only served with the metrics token when one is set"""
+        self.app.extensions["metrics"].token = "scraper"
+
+        with self.assertRaises(PermissionDenied):
+            self.client.get("/metrics")
+        self.assert200(self.client.get("/metrics", headers={"Authorization": "Bearer scraper"}))
+        with self.assertRaises(PermissionDenied):
+            self.client.get("/metrics", headers={"Authorization": "Bearer scrapes"})
+
+    def test_endpoint_is_not_served_without_a_required_token(self):
+        """Test that the metrics are not served when a token is required and none is set"""
+        config["testing_metrics_token"] = MetricsTokenTestingConfig
+        app = create_app("testing_metrics_token")
+        self.assertNotIn("metrics", [rule.endpoint for rule in app.url_map.iter_rules()])
+
+    def test_snapshots_of_other_processes_are_added_up(self):
+        """Test that counters of every worker process are summed and gauges of dead ones dropped"""
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        self.app.extensions["metrics"].directory = directory
+        self.client.get("/bucketlists/", headers=self.get_headers())
+
+        # a worker that has exited, its pid can not be a live process
+        with open(os.path.join(directory, "4194400.json"), "w") as f:
+            json.dump(dict(pid=4194400, counters=[
+                ["bucketlist_http_requests_total", [["blueprint", "bucketlist"],
+                                                    ["endpoint", "bucketlist.bucket_lists"],
+                                                    ["method", "GET"], ["status", "200"]], 5]],
+                gauges=[["bucketlist_log_queue_size", [], 7]], histograms=[]), f)
+
+        lines = self.scrape()
+        self.assertIn('bucketlist_http_requests_total{blueprint="bucketlist",endpoint="bucketlist.bucket_lists",'
+                      'method="GET",status="200"} 6', lines)
+        self.assertIn("bucketlist_log_queue_size 0", lines)
+
+        metrics._dump(self.app.extensions["metrics"])
+        with open(os.path.join(directory, "{}.json".format(os.getpid()))) as f:
+            self.assertEqual(json.load(f)["pid"], os.getpid())
+
+
+def slow_view():
+    time.sleep(0.05)
+    return "done"
+
+
+class ProfilerTestCases(BaseTestCase):
+    """Tests for the sampling profiler"""
+
+    def setUp(self):
+        super(ProfilerTestCases, self).setUp()
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.app.add_url_rule("/slow", "slow", slow_view)
+        profiler.configure(self.app, directory=self.directory)
+        self.state = self.app.extensions["profiler"]
+        self.state.token = "profile-token"
+        self.state.interval = 0.001
+
+    def tearDown(self):
+        profiler.stop(self.app)
+        super(ProfilerTestCases, self).tearDown()
+
+    def test_requests_are_not_profiled_by_default(self):
+        """Test that requests without the profile header are left alone"""
+        response = self.client.get("/slow")
+        self.assertNotIn("X-Profile-Samples", response.headers)
+        self.assertIsNone(self.state.sampler)
+
+    def test_request_with_the_token_is_profiled_per_endpoint(self):
+        """Test that the stacks of a profiled request are written as collapsed stacks"""
+        response = self.client.get("/slow", headers={"X-Profile": "profile-token"})
+        self.assertGreater(int(response.headers["X-Profile-Samples"]), 0)
+
+        path, = profiler.flush(self.app)
+        self.assertEqual(os.path.basename(path), "slow.{}.folded".format(os.getpid()))
+        with open(path) as f:
+            lines = f.read().splitlines()
+        stack, count = lines[0].rsplit(" ", 1)
+        self.assertGreater(int(count), 0)
+        self.assertTrue(any(line.split(" ")[0].endswith("tests.test_telemetry:slow_view") for line in lines))
+        self.assertEqual(self.state.active, {})
+
+    def test_wrong_token_is_not_profiled(self):
+        """Test that a header without the token or an admin session does not profile"""
+        for value in ("wrong", "1"):
+            response = self.client.get("/slow", headers={"X-Profile": value})
+            self.assertNotIn("X-Profile-Samples", response.headers)
+
+    def test_turned_off_profiler_can_not_be_configured(self):
+        """Test that configuring a turned off profiler fails with a clear error"""
+        config["testing_profiler_off"] = ProfilerOffTestingConfig
+        with self.assertRaises(RuntimeError) as ctx:
+            profiler.configure(create_app("testing_profiler_off"), sample_rate=1)
+        self.assertIn("PROFILER_ENABLED", str(ctx.exception))
+
+    def test_admin_can_profile_a_request(self):
+        """Test that an admin asks for a profile without the token"""
+        UserAccount.query.filter_by(username="user1").update(dict(admin=True))
+        self.db.session.commit()
+        self.login()
+
+        response = self.client.get("/slow", headers={"X-Profile": "1"})
+        self.assertIn("X-Profile-Samples", response.headers)
+
+    def test_sampled_fraction_of_traffic_is_profiled(self):
+        """Test that every request is profiled with a sample rate of 1"""
+        profiler.configure(self.app, sample_rate=1.0)
+        response = self.client.get("/slow")
+        self.assertIn("X-Profile-Samples", response.headers)
+
+
+if __name__ == "__main__":
+    unittest.main()